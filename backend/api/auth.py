@@ -8,9 +8,13 @@ from passlib.context import CryptContext
 
 from settings import ALGORITHM, MAX_PASSWORD_LEN, SECRET_KEY
 
+from .workers import bcrypt_pool
+
 pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/api/auth/token/login')
+optional_oauth2_scheme = OAuth2PasswordBearer(
+    tokenUrl='/api/auth/token/login', auto_error=False)
 
 
 def create_jwt(data: dict) -> str:
@@ -34,7 +38,10 @@ def is_authenticated(token: str = Depends(oauth2_scheme)) -> Optional[int]:
 
 
 def get_user_id_from_token_or_none(
-        token: str = Depends(oauth2_scheme)) -> Optional[int]:
+        token: Optional[str] = Depends(optional_oauth2_scheme)
+        ) -> Optional[int]:
+    if token is None:
+        return None
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload.get('sub')
@@ -46,9 +53,10 @@ def password_format_is_valid(password: str) -> bool:
     return password and len(password) <= MAX_PASSWORD_LEN
 
 
-def hash_password(raw_password: str) -> str:
-    return pwd_context.hash(raw_password)
+async def hash_password(raw_password: str) -> str:
+    return await bcrypt_pool.run(pwd_context.hash, raw_password)
 
 
-def password_hash_is_valid(raw_password, hashed_password) -> bool:
-    return pwd_context.verify(raw_password, hashed_password)
+async def password_hash_is_valid(raw_password, hashed_password) -> bool:
+    return await bcrypt_pool.run(
+        pwd_context.verify, raw_password, hashed_password)
@@ -0,0 +1,426 @@
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Iterable, Optional
+from urllib.parse import unquote, urlparse
+
+from fastapi import HTTPException, status
+
+from db.invalidation import ALL, invalidation_bus
+from metrics import Counter, record_cache_lookups
+from settings import (CACHE_BACKEND, CACHE_KEY_PREFIX, CACHE_MAX_ENTRIES,
+                      CACHE_NEGATIVE_TTL, CACHE_TIMEOUT, CACHE_TTL,
+                      CACHE_URL)
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+_background_tasks: set[asyncio.Task] = set()
+
+# Marks a cached 404 (stored as a dict so that it survives JSON encoding)
+NOT_FOUND = '__not_found__'
+
+CACHE_BACKEND_ERRORS = Counter(
+    'cache_backend_errors_total',
+    'Cache backend calls that failed and were skipped, by operation.',
+    ('operation',))
+SHARED_CALLS = Counter(
+    'single_flight_shared_total',
+    'Calls answered by joining an identical call already in flight.',
+    ('name',))
+
+# Cached values embedding other entities, by the entity they embed
+DEPENDENT_PREFIXES = {
+    'tags': ('recipes:',),
+    'ingredients': ('recipes:',),
+    'users': ('recipes:',),
+}
+
+
+class SingleFlight:
+    '''
+    Runs one call per key at a time: concurrent callers with the same key
+    wait for the call already in flight and share its result.
+    '''
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable,
+                 call: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is not None:
+            SHARED_CALLS.inc(name=self.name)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if (not future.cancelled()
+                        or asyncio.current_task().cancelling()):
+                    raise
+                # the leading caller went away, carry on without it
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(
+            lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    async def get(self, key: str) -> Any:
+        '''Returns MISSING for absent or expired keys.'''
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        pass
+
+    @abstractmethod
+    async def delete(self, keys: Iterable[str]) -> None:
+        pass
+
+    @abstractmethod
+    async def delete_prefix(self, prefix: str) -> None:
+        pass
+
+    @abstractmethod
+    async def clear(self) -> None:
+        pass
+
+    def discard_nowait(self, keys: Iterable[str],
+                       prefixes: Iterable[str]) -> None:
+        keys, prefixes = list(keys), list(prefixes)
+
+        async def discard():
+            try:
+                await self.delete(keys)
+                for prefix in prefixes:
+                    await self.delete_prefix(prefix)
+            except BACKEND_ERRORS:
+                CACHE_BACKEND_ERRORS.inc(operation='discard')
+                logger.warning('Could not discard cache entries',
+                               exc_info=True)
+
+        task = asyncio.get_running_loop().create_task(discard())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    def clear_nowait(self) -> None:
+        self.discard_nowait((), ('',))
+
+
+class MemoryCacheBackend(CacheBackend):
+    '''
+    Bounded LRU with per-entry expiry. Values are shared, not copied, so
+    callers must not mutate what they get back.
+    '''
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    async def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, keys: Iterable[str]) -> None:
+        self._discard(keys, ())
+
+    async def delete_prefix(self, prefix: str) -> None:
+        self._discard((), (prefix,))
+
+    async def clear(self) -> None:
+        self._entries.clear()
+
+    def _discard(self, keys: Iterable[str], prefixes: Iterable[str]) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+        prefixes = tuple(prefixes)
+        if prefixes:
+            for key in [k for k in self._entries if k.startswith(prefixes)]:
+                del self._entries[key]
+
+    def discard_nowait(self, keys: Iterable[str],
+                       prefixes: Iterable[str]) -> None:
+        self._discard(keys, prefixes)
+
+
+CONNECTION_CLOSED = 'Connection closed by the Redis server'
+
+
+class RedisError(Exception):
+    pass
+
+
+# what a backend that is down or restarting raises
+BACKEND_ERRORS = (RedisError, OSError, asyncio.TimeoutError)
+
+
+class RedisConnection:
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+
+    @staticmethod
+    def encode(*args) -> bytes:
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    async def execute(self, *args) -> Any:
+        self._writer.write(self.encode(*args))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _read_reply(self) -> Any:
+        line = await self._reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError(CONNECTION_CLOSED)
+        kind, payload = line[:1], line[1:-2]
+
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RedisError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            try:
+                data = await self._reader.readexactly(length + 2)
+            except asyncio.IncompleteReadError as err:
+                raise ConnectionError(CONNECTION_CLOSED) from err
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            if length == -1:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisError(f'Unexpected reply: {line!r}')
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+class RedisCacheBackend(CacheBackend):
+    '''
+    Talks RESP to Redis or any server speaking its protocol. Values are
+    stored as JSON; every key is namespaced with CACHE_KEY_PREFIX.
+    '''
+    def __init__(self, url: str, namespace: str, max_connections: int = 10,
+                 timeout: float = CACHE_TIMEOUT):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.namespace = namespace
+        self.timeout = timeout
+        self._idle: asyncio.LifoQueue = asyncio.LifoQueue()
+        self._slots = asyncio.Semaphore(max_connections)
+
+    async def _connect(self) -> RedisConnection:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        connection = RedisConnection(reader, writer)
+        if self.password:
+            await connection.execute('AUTH', self.password)
+        if self.db:
+            await connection.execute('SELECT', self.db)
+        return connection
+
+    async def execute(self, *args) -> Any:
+        async with self._slots:
+            connection = (self._idle.get_nowait() if not self._idle.empty()
+                          else await asyncio.wait_for(
+                              self._connect(), self.timeout))
+            try:
+                reply = await asyncio.wait_for(
+                    connection.execute(*args), self.timeout)
+            except BaseException:
+                # the reply may be half read, never reuse the connection
+                connection.close()
+                raise
+            self._idle.put_nowait(connection)
+            return reply
+
+    def _key(self, key: str) -> str:
+        return self.namespace + key
+
+    async def get(self, key: str) -> Any:
+        data = await self.execute('GET', self._key(key))
+        return MISSING if data is None else json.loads(data)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        await self.execute('SET', self._key(key), json.dumps(value),
+                           'PX', max(int(ttl * 1000), 1))
+
+    async def delete(self, keys: Iterable[str]) -> None:
+        keys = [self._key(key) for key in keys]
+        if keys:
+            await self.execute('DEL', *keys)
+
+    async def delete_prefix(self, prefix: str) -> None:
+        pattern = ''.join(
+            '\\' + char if char in '*?[]\\' else char
+            for char in self._key(prefix)) + '*'
+        cursor = '0'
+        while True:
+            cursor, keys = await self.execute(
+                'SCAN', cursor, 'MATCH', pattern, 'COUNT', 500)
+            cursor = cursor.decode()
+            if keys:
+                await self.execute('DEL', *keys)
+            if cursor == '0':
+                break
+
+    async def clear(self) -> None:
+        await self.delete_prefix('')
+
+
+class Cache:
+    '''
+    Front for the configured backend. Keys look like "<entity>:<...>";
+    the entity part names the stats bucket and drives invalidation.
+
+    The cache is an optimization only: when the backend fails, reads count
+    as misses and writes are skipped, so requests go to the database.
+    '''
+    def __init__(self, backend: CacheBackend,
+                 default_ttl: float = CACHE_TTL,
+                 negative_ttl: float = CACHE_NEGATIVE_TTL):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl
+        self._flights = SingleFlight('cache')
+        self._generation = 0
+
+    @staticmethod
+    def _prefix(key: str) -> str:
+        return key.split(':', 1)[0]
+
+    async def get(self, key: str) -> Any:
+        try:
+            value = await self.backend.get(key)
+        except BACKEND_ERRORS:
+            CACHE_BACKEND_ERRORS.inc(operation='get')
+            logger.warning('Could not read %s from the cache', key,
+                           exc_info=True)
+            value = MISSING
+        hit = value is not MISSING
+        record_cache_lookups(self._prefix(key), int(hit), int(not hit))
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        try:
+            await self.backend.set(key, value, ttl)
+        except BACKEND_ERRORS:
+            CACHE_BACKEND_ERRORS.inc(operation='set')
+            logger.warning('Could not write %s to the cache', key,
+                           exc_info=True)
+
+    @staticmethod
+    def _raise_if_not_found(value: Any) -> None:
+        if isinstance(value, dict) and NOT_FOUND in value:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=value[NOT_FOUND])
+
+    async def get_or_set(self, key: str, load: Callable[[], Awaitable[Any]],
+                         ttl: Optional[float] = None) -> Any:
+        '''
+        Returns the cached value or loads it once for all concurrent
+        callers. A 404 raised by `load` is cached for `negative_ttl`.
+        '''
+        value = await self.get(key)
+        if value is MISSING:
+            return await self._flights.do(
+                key, lambda: self._load_and_set(key, load, ttl))
+
+        self._raise_if_not_found(value)
+        return value
+
+    async def _load_and_set(self, key: str,
+                            load: Callable[[], Awaitable[Any]],
+                            ttl: Optional[float]) -> Any:
+        generation = self._generation
+        try:
+            value = await load()
+        except HTTPException as err:
+            if (err.status_code == status.HTTP_404_NOT_FOUND
+                    and generation == self._generation):
+                await self.set(
+                    key, {NOT_FOUND: err.detail}, self.negative_ttl)
+            raise
+
+        # skip values that may have been invalidated while loading
+        if generation == self._generation:
+            await self.set(key, value, ttl or self.default_ttl)
+        return value
+
+    async def raise_if_known_missing(self, key: str) -> None:
+        value = await self.get(key)
+        if value is not MISSING:
+            self._raise_if_not_found(value)
+
+    async def remember_missing(self, key: str, detail: str) -> None:
+        await self.set(key, {NOT_FOUND: detail}, self.negative_ttl)
+
+    def invalidate(self, entity: str, key: str = '') -> None:
+        self._generation += 1
+        if entity == ALL:
+            self.backend.clear_nowait()
+            return
+
+        keys = [f'{entity}:{key}'] if key else []
+        prefixes = [f'{entity}:list']
+        if not key:
+            prefixes = [f'{entity}:']
+        prefixes.extend(DEPENDENT_PREFIXES.get(entity, ()))
+        self.backend.discard_nowait(keys, prefixes)
+
+
+def create_backend() -> CacheBackend:
+    if CACHE_BACKEND == 'redis':
+        return RedisCacheBackend(CACHE_URL, CACHE_KEY_PREFIX)
+    if CACHE_BACKEND == 'memory':
+        return MemoryCacheBackend(CACHE_MAX_ENTRIES)
+    raise ValueError(f'Unknown cache backend: {CACHE_BACKEND}')
+
+
+cache = Cache(create_backend())
+invalidation_bus.subscribe(cache.invalidate)
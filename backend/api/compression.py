@@ -0,0 +1,120 @@
+import base64
+import gzip
+import zlib
+from typing import Optional
+
+from metrics import Counter
+from settings import (BROTLI_QUALITY, CACHE_TTL, COMPRESSION_ENCODINGS,
+                      COMPRESSION_OFFLOAD_SIZE, GZIP_LEVEL)
+
+from .cache import MISSING, cache
+from .workers import compression_pool
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_BYTES = Counter(
+    'http_compression_bytes_total',
+    'Response body bytes before and after compression.',
+    ('encoding', 'stage'))
+
+
+class GzipCompressor:
+    def __init__(self):
+        self._compressor = zlib.compressobj(
+            GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes) -> bytes:
+        # a sync flush lets every chunk reach the client as soon as it's sent
+        return (self._compressor.compress(data)
+                + self._compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(
+            mode=brotli.MODE_TEXT, quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def _gzip(body: bytes) -> bytes:
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _brotli(body: bytes) -> bytes:
+    return brotli.compress(body, mode=brotli.MODE_TEXT, quality=BROTLI_QUALITY)
+
+
+CODECS = {'gzip': (_gzip, GzipCompressor)}
+if brotli is not None:
+    CODECS['br'] = (_brotli, BrotliCompressor)
+
+ENCODINGS = [encoding for encoding in COMPRESSION_ENCODINGS
+             if encoding in CODECS]
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    '''
+    Picks the encoding with the highest q-value in Accept-Encoding,
+    preferring the order of COMPRESSION_ENCODINGS on ties.
+    '''
+    accepted = {}
+    for item in accept_encoding.split(','):
+        coding, *params = item.split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+async def compress(encoding: str, body: bytes,
+                   etag: Optional[str] = None) -> bytes:
+    '''
+    Compresses a whole body. Bodies with an ETag are compressed once per
+    encoding and shared between workers through the cache, base64 encoded
+    as the backends store JSON.
+    '''
+    if etag is not None:
+        key = f'compressed:{encoding}:{etag}'
+        compressed = await cache.get(key)
+        if compressed is not MISSING:
+            return base64.b64decode(compressed)
+
+    compress_body, _ = CODECS[encoding]
+    if len(body) > COMPRESSION_OFFLOAD_SIZE:
+        compressed = await compression_pool.run(compress_body, body)
+    else:
+        compressed = compress_body(body)
+
+    COMPRESSION_BYTES.inc(len(body), encoding=encoding, stage='in')
+    COMPRESSION_BYTES.inc(len(compressed), encoding=encoding, stage='out')
+    if etag is not None:
+        await cache.set(
+            key, base64.b64encode(compressed).decode(), CACHE_TTL)
+    return compressed
+
+
+def streaming_compressor(encoding: str):
+    _, compressor_class = CODECS[encoding]
+    return compressor_class()
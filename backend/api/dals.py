@@ -1,15 +1,43 @@
-from typing import Optional
+from functools import lru_cache
+from typing import AsyncIterator, Optional
 
 from fastapi import HTTPException, status
-from sqlalchemy import and_, case, delete, exists, func, literal, select
+from sqlalchemy import (Row, Table, and_, bindparam, delete, exists, func,
+                        literal, select)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import aliased, load_only, noload
 
-from db.models import (AmountModel, RecipeModel, TagModel, UserModel, favorite,
-                       recipe_tag_association, shopping_cart, subscription)
+from db.models import (AmountModel, IngredientModel, RecipeModel, TagModel,
+                       UserModel, favorite, recipe_tag_association,
+                       shopping_cart, subscription)
+from settings import STREAM_BATCH_SIZE
 
+from .cache import cache
+from .loaders import RequestLoaders
 from .utils import BoolOptions
 
+# RecipeModel columns that a sparse fieldset may leave unloaded
+RECIPE_COLUMNS = ('name', 'image', 'cooking_time', 'text', 'pub_date')
+
+# the hot queries below are built once as templates with bound parameters,
+# per variant where their shape depends on the arguments, so a call only
+# binds values: SQLAlchemy memoizes the cache key of a reused statement
+# and finds its compiled form in the engine's compiled cache
+QUERY_TEMPLATES_SIZE = 256
+
+
+def _link_query(table: Table, *columns: str):
+    return select(table).where(and_(
+        *(table.c[column] == bindparam(column) for column in columns)))
+
+
+_RECIPE_TAG_QUERY = _link_query(
+    recipe_tag_association, 'tag_id', 'recipe_id')
+_FAVORITE_QUERY = _link_query(favorite, 'user_id', 'recipe_id')
+_SUBSCRIPTION_QUERY = _link_query(subscription, 'user_id', 'followed_user_id')
+_SHOPPING_CART_QUERY = _link_query(shopping_cart, 'user_id', 'recipe_id')
+
 
 async def get_amount(
         session, recipe_id, ingredient_id) -> Optional[AmountModel]:
@@ -23,67 +51,52 @@ async def get_amount(
     return amount_instance
 
 
-async def get_shopping_cart(session, user_id):
-
-    shopping_cart_subq = (
-        select(RecipeModel.id.label('recipe_id'))
-        .where(shopping_cart.c.recipe_id == RecipeModel.id,
-               shopping_cart.c.user_id == user_id)
-        .alias()
-    )
+async def get_shopping_cart(session, loaders: RequestLoaders, user_id):
 
     query = (
         select(AmountModel)
-        .filter(exists().where(
-            shopping_cart_subq.c.recipe_id == RecipeModel.id))
-        .options(selectinload(AmountModel.ingredient))
+        .join(shopping_cart,
+              shopping_cart.c.recipe_id == AmountModel.recipe_id)
+        .where(shopping_cart.c.user_id == user_id)
+        .options(noload('*'))
     )
 
     result = await session.execute(query)
     amounts = result.scalars().all()
 
+    await loaders.attach_ingredients(amounts)
+
     return amounts
 
 
 async def recipe_tag_association_exists(session, tag_id, recipe_id) -> bool:
-    query = select(recipe_tag_association).where(and_(
-        recipe_tag_association.c.tag_id == tag_id,
-        recipe_tag_association.c.recipe_id == recipe_id
-    ))
-    result = await session.execute(query)
+    result = await session.execute(
+        _RECIPE_TAG_QUERY, {'tag_id': tag_id, 'recipe_id': recipe_id})
     tag_instance = result.scalar()
 
     return tag_instance is not None
 
 
 async def is_recipe_in_favorite(session, user_id, recipe_id) -> bool:
-    query = select(favorite).where(and_(
-        favorite.c.user_id == user_id,
-        favorite.c.recipe_id == recipe_id
-    ))
-    result = await session.execute(query)
+    result = await session.execute(
+        _FAVORITE_QUERY, {'user_id': user_id, 'recipe_id': recipe_id})
     favorite_instance = result.scalar()
 
     return favorite_instance is not None
 
 
 async def is_subscribed(session, user_id, followed_user_id) -> bool:
-    query = select(subscription).where(and_(
-        subscription.c.user_id == user_id,
-        subscription.c.followed_user_id == followed_user_id
-    ))
-    result = await session.execute(query)
+    result = await session.execute(
+        _SUBSCRIPTION_QUERY,
+        {'user_id': user_id, 'followed_user_id': followed_user_id})
     subscription_instance = result.scalar()
 
     return subscription_instance is not None
 
 
 async def is_recipe_in_shopping_cart(session, user_id, recipe_id) -> bool:
-    query = select(shopping_cart).where(and_(
-        shopping_cart.c.user_id == user_id,
-        shopping_cart.c.recipe_id == recipe_id
-    ))
-    result = await session.execute(query)
+    result = await session.execute(
+        _SHOPPING_CART_QUERY, {'user_id': user_id, 'recipe_id': recipe_id})
     shopping_cart_instance = result.scalar()
 
     return shopping_cart_instance is not None
@@ -91,20 +104,90 @@ async def is_recipe_in_shopping_cart(session, user_id, recipe_id) -> bool:
 
 async def get_recipe_or_404(
         recipe_id: int, session: AsyncSession) -> Optional[RecipeModel]:
+    cache_key = f'recipes:{recipe_id}'
+    await cache.raise_if_known_missing(cache_key)
+
     existing_recipe = await session.execute(
         select(RecipeModel).where(RecipeModel.id == recipe_id))
 
     existing_recipe = existing_recipe.scalar()
 
     if not existing_recipe:
+        detail = f'Recipe with id {recipe_id} not found'
+        await cache.remember_missing(cache_key, detail)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=f'Recipe with id {recipe_id} not found'
+            detail=detail
         )
 
     return existing_recipe
 
 
+async def bulk_add_recipes(
+    session: AsyncSession,
+    table: Table,
+    user_id: int,
+        recipe_ids: list[int]) -> dict[int, str]:
+    '''
+    Links the given recipes to the user in `favorite` or `shopping_cart`
+    with a single statement. Returns the status of every existing recipe:
+    "added", or "unchanged" when it was linked already.
+    '''
+    existing = (
+        select(RecipeModel.id)
+        .where(RecipeModel.id.in_(recipe_ids))
+        .cte('existing')
+    )
+
+    inserted = (
+        insert(table)
+        .from_select(['user_id', 'recipe_id'],
+                     select(literal(user_id), existing.c.id))
+        .on_conflict_do_nothing()
+        .returning(table.c.recipe_id)
+        .cte('inserted')
+    )
+
+    result = await session.execute(
+        select(existing.c.id, inserted.c.recipe_id.is_not(None))
+        .outerjoin(inserted, inserted.c.recipe_id == existing.c.id)
+    )
+
+    return {recipe_id: 'added' if added else 'unchanged'
+            for recipe_id, added in result}
+
+
+async def bulk_remove_recipes(
+    session: AsyncSession,
+    table: Table,
+    user_id: int,
+        recipe_ids: list[int]) -> dict[int, str]:
+    '''
+    Counterpart of bulk_add_recipes with "removed" and "unchanged".
+    '''
+    existing = (
+        select(RecipeModel.id)
+        .where(RecipeModel.id.in_(recipe_ids))
+        .cte('existing')
+    )
+
+    deleted = (
+        delete(table)
+        .where(table.c.user_id == user_id,
+               table.c.recipe_id.in_(recipe_ids))
+        .returning(table.c.recipe_id)
+        .cte('deleted')
+    )
+
+    result = await session.execute(
+        select(existing.c.id, deleted.c.recipe_id.is_not(None))
+        .outerjoin(deleted, deleted.c.recipe_id == existing.c.id)
+    )
+
+    return {recipe_id: 'removed' if removed else 'unchanged'
+            for recipe_id, removed in result}
+
+
 async def get_recipes_by_user_id(
     user_id: int, session: AsyncSession, recipes_limit: int
         ) -> tuple[list[RecipeModel], int]:
@@ -121,6 +204,7 @@ async def get_recipes_by_user_id(
         select(RecipeModel)
         .where(RecipeModel.author == user_id)
         .order_by(RecipeModel.pub_date.desc())
+        .options(noload('*'))
     ).limit(recipes_limit)
 
     recipes_result = await session.execute(recipes_query)
@@ -132,20 +216,92 @@ async def get_recipes_by_user_id(
 
 async def get_user_or_404(
         user_id: int, session: AsyncSession) -> Optional[UserModel]:
+    cache_key = f'users:{user_id}'
+    await cache.raise_if_known_missing(cache_key)
+
     existing_user = await session.execute(
-        select(UserModel).where(UserModel.id == user_id))
+        select(UserModel)
+        .where(UserModel.id == user_id)
+        .options(noload('*')))
 
     existing_user = existing_user.scalar()
 
     if not existing_user:
+        detail = f'User with id {user_id} not found'
+        await cache.remember_missing(cache_key, detail)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=f'User with id {user_id} not found'
+            detail=detail
         )
 
     return existing_user
 
 
+def _users_query(after_id: Optional[int], username: Optional[str]):
+    query = (
+        select(UserModel.id,
+               UserModel.email,
+               UserModel.username,
+               UserModel.first_name,
+               UserModel.last_name,
+               UserModel.is_subscribed)
+        .order_by(UserModel.id)
+    )
+
+    if after_id is not None:
+        query = query.where(UserModel.id > after_id)
+
+    if username:
+        query = query.where(
+            UserModel.username.startswith(username, autoescape=True))
+
+    return query
+
+
+async def get_users_page(
+    session: AsyncSession,
+    after_id: Optional[int],
+    limit: int,
+        username: Optional[str] = None) -> list:
+    query = _users_query(after_id, username).limit(limit)
+
+    result = await session.execute(query)
+    users = result.fetchall()
+
+    return users
+
+
+async def stream_users(
+    session: AsyncSession,
+    after_id: Optional[int],
+        username: Optional[str] = None) -> AsyncIterator[list]:
+    query = _users_query(after_id, username)
+
+    result = await session.stream(
+        query.execution_options(yield_per=STREAM_BATCH_SIZE))
+
+    async for users in result.partitions():
+        yield users
+
+
+def ingredients_query(name: Optional[str]):
+    query = select(IngredientModel).order_by(IngredientModel.name)
+    if name:
+        query = query.where(IngredientModel.name.startswith(name))
+    return query
+
+
+async def stream_ingredients(
+        session: AsyncSession,
+        name: Optional[str]) -> AsyncIterator[list[IngredientModel]]:
+    result = await session.stream_scalars(
+        ingredients_query(name).execution_options(
+            yield_per=STREAM_BATCH_SIZE))
+
+    async for ingredients in result.partitions():
+        yield ingredients
+
+
 async def get_user_by_email_for_auth(
         email: str, session: AsyncSession) -> Optional[UserModel]:
     existing_user = await session.execute(
@@ -189,117 +345,322 @@ async def delete_tags(
     )
 
 
+def _recipe_filters(
+    author_id,
+    tags,
+    is_favorited_only,
+        is_in_shopping_cart_only) -> tuple[bool, bool, bool, bool]:
+    '''
+    Reduces the list filters to the flags that shape the query.
+    '''
+    return (bool(author_id), bool(tags),
+            is_favorited_only == BoolOptions.true,
+            is_in_shopping_cart_only == BoolOptions.true)
+
+
+def _recipe_params(current_user_id: Optional[int], author_id, tags) -> dict:
+    params = {'user_id': current_user_id}
+    if author_id:
+        params['author_id'] = author_id
+    if tags:
+        params['tags'] = list(tags)
+    return params
+
+
+def _filter_recipes(
+    query,
+    by_author: bool,
+    by_tags: bool,
+    favorited_only: bool,
+        in_shopping_cart_only: bool):
+    if by_author:
+        query = query.filter(RecipeModel.author == bindparam('author_id'))
+
+    if by_tags:
+        query = query.filter(RecipeModel.tags.any(
+            TagModel.slug.in_(bindparam('tags', expanding=True))))
+
+    user_id = bindparam('user_id')
+
+    if favorited_only:
+        query = query.join(
+            favorite, and_(favorite.c.recipe_id == RecipeModel.id,
+                           favorite.c.user_id == user_id)
+        )
+
+    if in_shopping_cart_only:
+        query = query.join(
+            shopping_cart, and_(shopping_cart.c.recipe_id == RecipeModel.id,
+                                shopping_cart.c.user_id == user_id)
+        )
+
+    return query
+
+
+def _recipe_load_options(fields: Optional[tuple[str, ...]]) -> tuple:
+    if fields is None:
+        return (noload('*'),)
+
+    columns = [getattr(RecipeModel, name)
+               for name in RECIPE_COLUMNS if name in fields]
+    return (noload('*'),
+            load_only(RecipeModel.id, RecipeModel.author, *columns))
+
+
+@lru_cache(maxsize=QUERY_TEMPLATES_SIZE)
+def _recipes_query(
+    by_author: bool,
+    by_tags: bool,
+    favorited_only: bool,
+    in_shopping_cart_only: bool,
+        fields: Optional[tuple[str, ...]] = None):
+    user_id = bindparam('user_id')
+
+    # the flags cost an index probe per recipe, skip the ones not requested;
+    # favorited_only joins the same tables, so correlate to recipes only
+    is_favorited = literal(False)
+    if fields is None or 'is_favorited' in fields:
+        is_favorited = exists().where(and_(
+            favorite.c.recipe_id == RecipeModel.id,
+            favorite.c.user_id == user_id)).correlate(RecipeModel)
+
+    is_in_shopping_cart = literal(False)
+    if fields is None or 'is_in_shopping_cart' in fields:
+        is_in_shopping_cart = exists().where(and_(
+            shopping_cart.c.recipe_id == RecipeModel.id,
+            shopping_cart.c.user_id == user_id)).correlate(RecipeModel)
+
+    recipes_query = (
+        select(RecipeModel,
+               is_favorited.label('is_favorited'),
+               is_in_shopping_cart.label('is_in_shopping_cart'))
+        .options(*_recipe_load_options(fields))
+    )
+
+    return _filter_recipes(
+        recipes_query, by_author, by_tags, favorited_only,
+        in_shopping_cart_only)
+
+
+async def _load_recipe_relations(
+    loaders: RequestLoaders,
+    rows,
+        fields: Optional[tuple[str, ...]] = None
+        ) -> list[tuple[RecipeModel, UserModel, bool, bool]]:
+    recipes = [recipe for recipe, _, _ in rows]
+
+    authors = [None] * len(recipes)
+    if fields is None or 'author' in fields:
+        authors = await loaders.users.load_many(r.author for r in recipes)
+
+    await loaders.attach_recipe_relations(
+        recipes,
+        tags=fields is None or 'tags' in fields,
+        ingredients=fields is None or 'ingredients' in fields)
+
+    return [
+        (recipe, author, is_favorited, is_in_shopping_cart)
+        for (recipe, is_favorited, is_in_shopping_cart), author
+        in zip(rows, authors)
+    ]
+
+
 async def get_recipes_from_db(
     session: AsyncSession,
+    loaders: RequestLoaders,
     current_user_id: Optional[int],
     author_id,
     tags,
     is_favorited_only,
-    is_in_shopping_cart_only
+    is_in_shopping_cart_only,
+        fields: Optional[tuple[str, ...]] = None
         ) -> list[tuple[RecipeModel, UserModel, bool, bool]]:
 
-    favorite_subq = (
-        select(RecipeModel.id.label('recipe_id'),
-               UserModel.id.label('user_id'))
-        .where(favorite.c.recipe_id == RecipeModel.id,
-               favorite.c.user_id == current_user_id)
-        .alias()
-    )
+    recipes_query = _recipes_query(
+        *_recipe_filters(author_id, tags, is_favorited_only,
+                         is_in_shopping_cart_only),
+        fields)
 
-    shopping_cart_subq = (
-        select(RecipeModel.id.label('recipe_id'),
-               UserModel.id.label('user_id'))
-        .where(shopping_cart.c.recipe_id == RecipeModel.id,
-               shopping_cart.c.user_id == current_user_id)
-        .alias()
-    )
+    recipes_result = await session.execute(
+        recipes_query, _recipe_params(current_user_id, author_id, tags))
+    rows = recipes_result.fetchall()
 
-    recipes_query = (
+    return await _load_recipe_relations(loaders, rows, fields)
+
+
+async def stream_recipes_from_db(
+    session: AsyncSession,
+    loaders: RequestLoaders,
+    current_user_id: Optional[int],
+    author_id,
+    tags,
+    is_favorited_only,
+    is_in_shopping_cart_only,
+        fields: Optional[tuple[str, ...]] = None
+        ) -> AsyncIterator[list[tuple[RecipeModel, UserModel, bool, bool]]]:
+    '''
+    Same as get_recipes_from_db, read through a server-side cursor and
+    yielded in batches of STREAM_BATCH_SIZE recipes.
+    '''
+    recipes_query = _recipes_query(
+        *_recipe_filters(author_id, tags, is_favorited_only,
+                         is_in_shopping_cart_only),
+        fields)
+
+    # passed with the call, .execution_options() would copy the template
+    recipes_result = await session.stream(
+        recipes_query, _recipe_params(current_user_id, author_id, tags),
+        execution_options={'yield_per': STREAM_BATCH_SIZE})
+
+    async for rows in recipes_result.partitions():
+        yield await _load_recipe_relations(loaders, rows, fields)
+        # recipes are never seen twice, only authors and ingredients repeat
+        loaders.tags_by_recipe.clear()
+        loaders.amounts_by_recipe.clear()
+
+
+@lru_cache(maxsize=QUERY_TEMPLATES_SIZE)
+def _single_recipe_query(fields: Optional[tuple[str, ...]]):
+    recipe_id = bindparam('recipe_id')
+    user_id = bindparam('user_id')
+
+    return (
         select(RecipeModel,
-               UserModel,
-               case(
-                (exists().where(and_(
-                    favorite_subq.c.recipe_id == RecipeModel.id,
-                    favorite_subq.c.user_id == current_user_id,)),
-                 literal(True)),
-                else_=literal(False))
+               exists().where(and_(
+                   favorite.c.recipe_id == recipe_id,
+                   favorite.c.user_id == user_id))
                .label('is_favorited'),
-               case(
-                (exists().where(and_(
-                    shopping_cart_subq.c.recipe_id == RecipeModel.id,
-                    shopping_cart_subq.c.user_id == current_user_id,)),
-                 literal(True)),
-                else_=literal(False))
-               .label('is_in_shopping_cart')
-               )
-        .options(selectinload(RecipeModel.tags),
-                 selectinload(RecipeModel.ingredients))
-        .outerjoin(UserModel)
+               exists().where(and_(
+                   shopping_cart.c.recipe_id == recipe_id,
+                   shopping_cart.c.user_id == user_id))
+               .label('is_in_shopping_cart'))
+        .options(*_recipe_load_options(fields))
+        .filter(RecipeModel.id == recipe_id)
     )
 
-    if author_id:
-        recipes_query = recipes_query.filter(
-            RecipeModel.author == author_id)
 
-    if tags:
-        recipes_query = recipes_query.filter(
-            RecipeModel.tags.any(TagModel.slug.in_(tags)))
+async def get_single_recipe_from_db(
+    id,
+    session: AsyncSession,
+    loaders: RequestLoaders,
+    current_user_id,
+        fields: Optional[tuple[str, ...]] = None
+        ) -> Optional[tuple[RecipeModel, UserModel, bool, bool]]:
 
-    if is_favorited_only == BoolOptions.true:
-        recipes_query = recipes_query.join(
-            favorite, and_(favorite.c.recipe_id == RecipeModel.id,
-                           favorite.c.user_id == current_user_id)
-        )
+    recipe_result = await session.execute(
+        _single_recipe_query(fields),
+        {'recipe_id': id, 'user_id': current_user_id})
+    row = recipe_result.fetchone()
 
-    if is_in_shopping_cart_only == BoolOptions.true:
-        recipes_query = recipes_query.join(
-            shopping_cart, and_(shopping_cart.c.recipe_id == RecipeModel.id,
-                                shopping_cart.c.user_id == current_user_id)
-        )
+    if row is None:
+        return None
 
-    recipes_result = await session.execute(recipes_query)
-    recipes = recipes_result.fetchall()
+    recipes = await _load_recipe_relations(loaders, [row], fields)
 
-    return recipes
+    return recipes[0]
 
 
-async def get_single_recipe_from_db(
-    id, session: AsyncSession, current_user_id
-        ) -> tuple[RecipeModel, UserModel, bool, bool]:
-
-    recipe_query = (
-        select(RecipeModel, UserModel)
-        .options(selectinload(RecipeModel.tags),
-                 selectinload(RecipeModel.ingredients))
-        .outerjoin(UserModel)
-        .filter(RecipeModel.id == id)
+@lru_cache(maxsize=None)
+def _recipe_validators_query(authenticated: bool):
+    recipe_id = bindparam('recipe_id')
+
+    tags_updated_at = (
+        select(func.max(TagModel.updated_at))
+        .join(recipe_tag_association,
+              recipe_tag_association.c.tag_id == TagModel.id)
+        .where(recipe_tag_association.c.recipe_id == recipe_id)
+        .scalar_subquery()
     )
 
-    recipe_query = recipe_query.add_columns(
-        exists().where(and_(
-            favorite.c.recipe_id == id,
-            favorite.c.user_id == current_user_id))
-        .label('is_favorited')
+    ingredients_updated_at = (
+        select(func.max(IngredientModel.updated_at))
+        .join(AmountModel, AmountModel.ingredient_id == IngredientModel.id)
+        .where(AmountModel.recipe_id == recipe_id)
+        .scalar_subquery()
     )
 
-    recipe_query = recipe_query.add_columns(
-        exists().where(and_(
-            shopping_cart.c.recipe_id == id,
-            shopping_cart.c.user_id == current_user_id))
-        .label('is_in_shopping_cart')
+    is_favorited = literal(False)
+    is_in_shopping_cart = literal(False)
+    if authenticated:
+        is_favorited = exists().where(and_(
+            favorite.c.recipe_id == recipe_id,
+            favorite.c.user_id == bindparam('user_id')))
+        is_in_shopping_cart = exists().where(and_(
+            shopping_cart.c.recipe_id == recipe_id,
+            shopping_cart.c.user_id == bindparam('user_id')))
+
+    return (
+        select(RecipeModel.updated_at,
+               UserModel.updated_at.label('author_updated_at'),
+               tags_updated_at.label('tags_updated_at'),
+               ingredients_updated_at.label('ingredients_updated_at'),
+               is_favorited.label('is_favorited'),
+               is_in_shopping_cart.label('is_in_shopping_cart'))
+        .join(UserModel, UserModel.id == RecipeModel.author)
+        .where(RecipeModel.id == recipe_id)
     )
 
-    recipe_result = await session.execute(recipe_query)
-    recipe_with_user = recipe_result.fetchone()
 
-    return recipe_with_user
+async def get_recipe_validators(
+    session: AsyncSession,
+    recipe_id: int,
+        current_user_id: Optional[int]) -> Optional[Row]:
+    '''
+    Returns what a recipe response depends on: update times of the recipe,
+    its author, tags and ingredients, plus the viewer's flags.
+    '''
+    result = await session.execute(
+        _recipe_validators_query(current_user_id is not None),
+        {'recipe_id': recipe_id, 'user_id': current_user_id})
 
+    return result.one_or_none()
 
-async def get_user_subscriptions(
-    current_user_id: int,
-        session: AsyncSession):
 
+@lru_cache(maxsize=None)
+def _recipes_list_validators_query(*filters: bool):
     query = (
+        select(func.count(RecipeModel.id).label('recipes_count'),
+               func.max(RecipeModel.updated_at).label('updated_at'),
+               func.max(UserModel.updated_at).label('authors_updated_at'),
+               select(func.max(TagModel.updated_at))
+               .scalar_subquery().label('tags_updated_at'),
+               select(func.max(IngredientModel.updated_at))
+               .scalar_subquery().label('ingredients_updated_at'))
+        .join(UserModel, UserModel.id == RecipeModel.author)
+    )
+
+    return _filter_recipes(query, *filters)
+
+
+async def get_recipes_list_validators(
+    session: AsyncSession,
+    current_user_id: Optional[int],
+    author_id,
+    tags,
+    is_favorited_only,
+        is_in_shopping_cart_only) -> Row:
+    '''
+    Same as get_recipe_validators for a whole list: the number of matching
+    recipes and the latest update among them, their authors and the tag
+    and ingredient catalogs.
+    '''
+    result = await session.execute(
+        _recipes_list_validators_query(*_recipe_filters(
+            author_id, tags, is_favorited_only, is_in_shopping_cart_only)),
+        _recipe_params(current_user_id, author_id, tags))
+
+    return result.one()
+
+
+async def get_user_subscriptions(
+    current_user_id: int,
+    session: AsyncSession,
+        recipes_limit: int) -> list[tuple[UserModel, list[RecipeModel], int]]:
+    '''
+    Returns the followed users with their latest `recipes_limit` recipes
+    and their recipe count.
+    '''
+    users_query = (
         select(UserModel).join(
             subscription,
             and_(
@@ -307,15 +668,38 @@ async def get_user_subscriptions(
                 subscription.c.user_id == current_user_id
             )
         )
-        .add_columns(
-            func.count(
-                case((RecipeModel.author == UserModel.id, RecipeModel.id)))
-            .label('recipes_count')
-        )
+        .outerjoin(RecipeModel, RecipeModel.author == UserModel.id)
+        .add_columns(func.count(RecipeModel.id).label('recipes_count'))
         .group_by(UserModel.id)
+        .options(noload('*'))
     )
 
-    result = await session.execute(query)
-    users = result.fetchall()
+    users_result = await session.execute(users_query)
+    users = users_result.fetchall()
+    if not users:
+        return []
+
+    ranked = (
+        select(RecipeModel, func.row_number().over(
+            partition_by=RecipeModel.author,
+            order_by=RecipeModel.pub_date.desc()).label('rank'))
+        .where(RecipeModel.author.in_([user.id for user, _ in users]))
+        .subquery()
+    )
+    latest_recipe = aliased(RecipeModel, ranked)
+    recipes_query = (
+        select(latest_recipe)
+        .where(ranked.c.rank <= recipes_limit)
+        .order_by(ranked.c.author, ranked.c.rank)
+        .options(noload('*'))
+    )
 
-    return users
+    recipes_result = await session.execute(recipes_query)
+    recipes_by_author: dict[int, list[RecipeModel]] = {}
+    for recipe in recipes_result.scalars():
+        recipes_by_author.setdefault(recipe.author, []).append(recipe)
+
+    return [
+        (user, recipes_by_author.get(user.id, []), recipes_count)
+        for user, recipes_count in users
+    ]
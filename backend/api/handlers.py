@@ -1,9 +1,11 @@
 import base64
 from datetime import datetime
+from functools import partial
 from io import BytesIO
+from typing import Optional
 
 from fastapi import (APIRouter, Depends, Form, HTTPException, Path, Query,
-                     status)
+                     Request, status)
 from fastapi.responses import JSONResponse, StreamingResponse
 from PIL import Image
 from sqlalchemy import delete
@@ -14,32 +16,47 @@ from starlette.responses import Response
 
 from db.models import (AmountModel, IngredientModel, RecipeModel, TagModel,
                        UserModel, favorite, shopping_cart, subscription)
-from db.schemas import (BriefRecipeSchema, BriefUserSchema, CreateRecipeSchema,
+from db.schemas import (BriefRecipeSchema, BriefUserSchema, BulkRecipesSchema,
+                        BulkResultSchema, CreateRecipeSchema,
                         CreateUserSchema, DetailedRecipeSchema,
                         DetailedUserSchema, IngredientSchema, TagSchema,
                         TokenSchema)
 from db.session import get_async_session
-from settings import DEFAULT_RECIPES_LIMIT, PAGE_LIMIT
+from settings import DEFAULT_RECIPES_LIMIT, HTTP_CACHE_MAX_AGE, PAGE_LIMIT
 
 from .auth import (create_jwt, get_user_id_from_token_or_none, hash_password,
                    is_authenticated, password_format_is_valid,
                    password_hash_is_valid)
-from .dals import (delete_amounts, delete_tags, get_amount, get_recipe_or_404,
-                   get_recipes_by_user_id, get_recipes_from_db,
+from .cache import SingleFlight, cache
+from .dals import (bulk_add_recipes, bulk_remove_recipes, delete_amounts,
+                   delete_tags, get_amount, get_recipe_or_404,
+                   get_recipe_validators, get_recipes_by_user_id,
+                   get_recipes_from_db, get_recipes_list_validators,
                    get_shopping_cart, get_single_recipe_from_db,
                    get_user_by_email_for_auth, get_user_or_404,
-                   get_user_subscriptions, is_recipe_in_favorite,
-                   is_recipe_in_shopping_cart, is_subscribed,
-                   recipe_tag_association_exists)
+                   get_user_subscriptions, get_users_page, ingredients_query,
+                   is_recipe_in_favorite, is_recipe_in_shopping_cart,
+                   is_subscribed, recipe_tag_association_exists,
+                   stream_ingredients, stream_recipes_from_db, stream_users)
+from .loaders import RequestLoaders, get_loaders
 from .serializers import (serialize_favorite, serialize_ingredient,
                           serialize_ingredients_list, serialize_recipe,
-                          serialize_recipes_list, serialize_shopping_cart,
+                          serialize_recipes_fields, serialize_shopping_cart,
                           serialize_tag, serialize_tags_list, serialize_user,
                           serialize_user_with_recipes, serialize_users_list)
-from .utils import BoolOptions
+from .streaming import stream_response
+from .utils import (BoolOptions, StreamFormat, get_validator_headers,
+                    is_not_modified, latest, make_etag, not_modified_response,
+                    parse_fields)
+from .workers import image_pool
 
 router = APIRouter()
 
+PUBLIC_CACHE_CONTROL = f'public, max-age={HTTP_CACHE_MAX_AGE}'
+PRIVATE_CACHE_CONTROL = 'private, no-cache'
+
+recipe_reads = SingleFlight('recipe_reads')
+
 
 class RecipeUtility:
     @staticmethod
@@ -110,12 +127,17 @@ class RecipeUtility:
         _, image_format = prefix.split('/')
 
         image_data = base64.b64decode(imgstr)
-        image = Image.open(BytesIO(image_data))
         image_path = f'media/{hash(image_data)}.{image_format}'
-        image.save(image_path)
+        await image_pool.run(
+            RecipeUtility._save_image, image_data, image_path)
 
         return image_path
 
+    @staticmethod
+    def _save_image(image_data: bytes, image_path: str) -> None:
+        image = Image.open(BytesIO(image_data))
+        image.save(image_path)
+
     @staticmethod
     async def _update_recipe_fields(
         cur_recipe: RecipeModel,
@@ -168,6 +190,13 @@ class RecipeUtility:
         await delete_amounts(cur_recipe, ingredient_ids, session, orphan=True)
         await delete_tags(cur_recipe, tag_ids, session, orphan=True)
 
+    @staticmethod
+    def bulk_report(recipe_ids: list[int], statuses: dict) -> list[dict]:
+        return [
+            {'id': recipe_id, 'status': statuses.get(recipe_id, 'not_found')}
+            for recipe_id in dict.fromkeys(recipe_ids)
+        ]
+
 
 @router.post('/auth/token/login', response_model=TokenSchema)
 async def get_token(
@@ -175,7 +204,8 @@ async def get_token(
     password: str = Form(),
         session: AsyncSession = Depends(get_async_session)) -> JSONResponse:
     user = await get_user_by_email_for_auth(username, session)
-    if not user or not password_hash_is_valid(password, user.password):
+    if not user or not await password_hash_is_valid(
+            password, user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Invalid credentials',
@@ -192,9 +222,18 @@ async def get_token(
 
 @router.get('/users', response_model=list[BriefUserSchema])
 async def get_users_list(
+    after_id: int = Query(None, ge=0, title='After ID'),
+    limit: int = Query(PAGE_LIMIT, ge=1, le=100, title='Limit'),
+    username: str = Query(None, title='Username'),
+    stream: StreamFormat = Query(None, title='Stream format'),
         session: AsyncSession = Depends(get_async_session)) -> JSONResponse:
-    users_result = await session.execute(select(UserModel))
-    users = users_result.scalars().all()
+    # streaming exports every user after `after_id`, ignoring `limit`
+    if stream is not None:
+        return stream_response(
+            stream_users(session, after_id, username),
+            serialize_users_list, stream)
+
+    users = await get_users_page(session, after_id, limit, username)
     users_data: list[dict] = serialize_users_list(users)
 
     return JSONResponse(content=users_data, status_code=status.HTTP_200_OK)
@@ -203,10 +242,8 @@ async def get_users_list(
 @router.get('/users/me', response_model=BriefUserSchema)
 async def get_current_user_info(
     current_user_id: int = Depends(is_authenticated),
-        session: AsyncSession = Depends(get_async_session)) -> JSONResponse:
-    user_result = await session.execute(
-        select(UserModel).filter_by(id=current_user_id))
-    user = user_result.scalar()
+        loaders: RequestLoaders = Depends(get_loaders)) -> JSONResponse:
+    user = await loaders.users.load(current_user_id)
 
     user_data: dict = serialize_user(user)
 
@@ -219,12 +256,12 @@ async def get_subscriptions(
     recipes_limit: int = Query(DEFAULT_RECIPES_LIMIT, title='Recipes limit'),
         session: AsyncSession = Depends(get_async_session)) -> JSONResponse:
 
-    subs_result = await get_user_subscriptions(current_user_id, session)
+    subs_result = await get_user_subscriptions(
+        current_user_id, session, recipes_limit)
 
     subscriptions = [
-        serialize_user_with_recipes(
-            user, user.recipes[:recipes_limit], recipes_count)
-        for user, recipes_count in subs_result
+        serialize_user_with_recipes(user, recipes, recipes_count)
+        for user, recipes, recipes_count in subs_result
     ]
 
     return JSONResponse(content=subscriptions, status_code=status.HTTP_200_OK)
@@ -239,7 +276,8 @@ async def change_password(
 
     user = await get_user_or_404(current_user_id, session)
 
-    if not user or not password_hash_is_valid(current_password, user.password):
+    if not user or not await password_hash_is_valid(
+            current_password, user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Invalid credentials',
@@ -252,7 +290,7 @@ async def change_password(
             detail='Invalid password format',
         )
 
-    user.password = hash_password(new_password)
+    user.password = await hash_password(new_password)
 
     await session.commit()
 
@@ -260,22 +298,37 @@ async def change_password(
 
 
 @router.get('/users/{id}', response_model=BriefUserSchema)
-async def get_user_by_id(id: int = Path(..., title='User ID'),
+async def get_user_by_id(request: Request,
+                         id: int = Path(..., title='User ID'),
                          _: int = Depends(is_authenticated),
-                         session: AsyncSession = Depends(get_async_session)
+                         loaders: RequestLoaders = Depends(get_loaders)
                          ) -> JSONResponse:
-    user_result = await session.execute(select(UserModel).filter_by(id=id))
-    user = user_result.scalar()
 
-    if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f'User with ID {id} not found'
-        )
+    async def load_user() -> dict:
+        user = await loaders.users.load(id)
 
-    user_data: dict = serialize_user(user)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f'User with ID {id} not found'
+            )
 
-    return JSONResponse(content=user_data, status_code=status.HTTP_200_OK)
+        return {'user': serialize_user(user),
+                'updated_at': user.updated_at.isoformat()}
+
+    cached: dict = await cache.get_or_set(f'users:{id}', load_user)
+
+    updated_at = datetime.fromisoformat(cached['updated_at'])
+    etag = make_etag('user', id, updated_at)
+    headers = get_validator_headers(
+        etag, updated_at, PRIVATE_CACHE_CONTROL, vary='Authorization')
+
+    if is_not_modified(request, etag, updated_at):
+        return not_modified_response(headers)
+
+    return JSONResponse(content=cached['user'],
+                        status_code=status.HTTP_200_OK,
+                        headers=headers)
 
 
 @router.post('/users', response_model=BriefUserSchema)
@@ -283,7 +336,7 @@ async def create_user(
         user_data: CreateUserSchema,
         session: AsyncSession = Depends(get_async_session)) -> JSONResponse:
 
-    user_data.password = hash_password(user_data.password)
+    user_data.password = await hash_password(user_data.password)
 
     new_user = UserModel(**user_data.dict())
     session.add(new_user)
@@ -295,9 +348,7 @@ async def create_user(
             detail=f'User with username {new_user.username} already exists'
         )
 
-    created_user = await get_user_or_404(new_user.id, session)
-
-    user_data: dict = serialize_user(created_user)
+    user_data: dict = serialize_user(new_user)
     user_data.pop('is_subscribed')
 
     await session.commit()
@@ -309,41 +360,68 @@ async def create_user(
 @router.get('/tags', response_model=list[TagSchema])
 async def get_tags_list(
         session: AsyncSession = Depends(get_async_session)) -> JSONResponse:
-    tags_result = await session.execute(select(TagModel))
-    tags = tags_result.scalars().all()
-    tags_data: list[dict] = serialize_tags_list(tags)
+
+    async def load_tags() -> list[dict]:
+        tags_result = await session.execute(select(TagModel))
+        tags = tags_result.scalars().all()
+        return serialize_tags_list(tags)
+
+    tags_data: list[dict] = await cache.get_or_set('tags:list', load_tags)
 
     return JSONResponse(content=tags_data, status_code=status.HTTP_200_OK)
 
 
 @router.get('/tags/{id}', response_model=TagSchema)
-async def get_tag_by_id(id: int = Path(..., title='Tag ID'),
+async def get_tag_by_id(request: Request,
+                        id: int = Path(..., title='Tag ID'),
                         session: AsyncSession = Depends(get_async_session)
                         ) -> JSONResponse:
-    tag_result = await session.execute(select(TagModel).filter_by(id=id))
-    tag = tag_result.scalar()
 
-    if tag is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f'Tag with ID {id} not found'
-        )
+    async def load_tag() -> dict:
+        tag_result = await session.execute(select(TagModel).filter_by(id=id))
+        tag = tag_result.scalar()
+
+        if tag is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f'Tag with ID {id} not found'
+            )
+
+        return {'tag': serialize_tag(tag),
+                'updated_at': tag.updated_at.isoformat()}
+
+    cached: dict = await cache.get_or_set(f'tags:{id}', load_tag)
+
+    updated_at = datetime.fromisoformat(cached['updated_at'])
+    etag = make_etag('tag', id, updated_at)
+    headers = get_validator_headers(etag, updated_at, PUBLIC_CACHE_CONTROL)
 
-    tag_data: dict = serialize_tag(tag)
+    if is_not_modified(request, etag, updated_at):
+        return not_modified_response(headers)
 
-    return JSONResponse(content=tag_data, status_code=status.HTTP_200_OK)
+    return JSONResponse(content=cached['tag'],
+                        status_code=status.HTTP_200_OK,
+                        headers=headers)
 
 
 @router.get('/ingredients', response_model=list[IngredientSchema])
 async def get_ingredients_list(
         name: str = Query(None, title='Name'),
+        stream: StreamFormat = Query(None, title='Stream format'),
         session: AsyncSession = Depends(get_async_session)) -> JSONResponse:
-    query = select(IngredientModel).order_by(IngredientModel.name)
-    if name:
-        query = query.where(IngredientModel.name.startswith(name))
-    ingredients_result = await session.execute(query)
-    ingredients = ingredients_result.scalars().all()
-    ingredients_data: list[dict] = serialize_ingredients_list(ingredients)
+
+    if stream is not None:
+        return stream_response(
+            stream_ingredients(session, name),
+            serialize_ingredients_list, stream)
+
+    async def load_ingredients() -> list[dict]:
+        ingredients_result = await session.execute(ingredients_query(name))
+        ingredients = ingredients_result.scalars().all()
+        return serialize_ingredients_list(ingredients)
+
+    ingredients_data: list[dict] = await cache.get_or_set(
+        f'ingredients:list:{name or ""}', load_ingredients)
 
     return JSONResponse(
         content=ingredients_data, status_code=status.HTTP_200_OK)
@@ -353,17 +431,22 @@ async def get_ingredients_list(
 async def get_ingredient_by_id(
     id: int = Path(..., title='Ingredient ID'),
         session: AsyncSession = Depends(get_async_session)) -> JSONResponse:
-    ingredient_result = await session.execute(
-        select(IngredientModel).filter_by(id=id))
-    ingredient = ingredient_result.scalar()
 
-    if ingredient is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f'Ingredient with ID {id} not found'
-        )
+    async def load_ingredient() -> dict:
+        ingredient_result = await session.execute(
+            select(IngredientModel).filter_by(id=id))
+        ingredient = ingredient_result.scalar()
 
-    ingredient_data: dict = serialize_ingredient(ingredient)
+        if ingredient is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f'Ingredient with ID {id} not found'
+            )
+
+        return serialize_ingredient(ingredient)
+
+    ingredient_data: dict = await cache.get_or_set(
+        f'ingredients:{id}', load_ingredient)
 
     return JSONResponse(
         content=ingredient_data, status_code=status.HTTP_200_OK)
@@ -371,6 +454,7 @@ async def get_ingredient_by_id(
 
 @router.get('/recipes', response_model=list[DetailedRecipeSchema])
 async def get_recipes_list(
+    request: Request,
     current_user_id: int = Depends(get_user_id_from_token_or_none),
     author: int = Query(None, title='Author'),
     tags: list[str] = Query(None, title='Tags'),
@@ -378,24 +462,59 @@ async def get_recipes_list(
         BoolOptions.false, title='Is favorited'),
     is_in_shopping_cart: BoolOptions = Query(
         BoolOptions.false, title='Is in shopping cart'),
-    session: AsyncSession = Depends(get_async_session)
+    fields: str = Query(None, title='Fields'),
+    stream: StreamFormat = Query(None, title='Stream format'),
+    session: AsyncSession = Depends(get_async_session),
+    loaders: RequestLoaders = Depends(get_loaders)
         ) -> JSONResponse:
 
+    fields = parse_fields(fields, DetailedRecipeSchema)
+
+    if stream is not None:
+        return stream_response(
+            stream_recipes_from_db(
+                session, loaders, current_user_id,
+                author, tags,
+                is_favorited, is_in_shopping_cart, fields
+            ),
+            partial(serialize_recipes_fields, fields=fields), stream)
+
+    headers = None
+
+    # personal flags make the list of a signed in user uncacheable
+    if current_user_id is None:
+        validators = await get_recipes_list_validators(
+            session, current_user_id,
+            author, tags,
+            is_favorited, is_in_shopping_cart
+        )
+        # a deleted recipe leaves no update time behind, only the count in
+        # the ETag tells the list changed, so no Last-Modified here
+        etag = make_etag('recipes', str(request.query_params), *validators)
+        headers = get_validator_headers(
+            etag, None, PUBLIC_CACHE_CONTROL, vary='Authorization')
+
+        if is_not_modified(request, etag, None):
+            return not_modified_response(headers)
+
     recipes = await get_recipes_from_db(
-        session, current_user_id,
+        session, loaders, current_user_id,
         author, tags,
-        is_favorited, is_in_shopping_cart
+        is_favorited, is_in_shopping_cart, fields
     )
-    recipes_data = await serialize_recipes_list(recipes)
+    recipes_data = await serialize_recipes_fields(recipes, fields)
 
-    return JSONResponse(content=recipes_data, status_code=status.HTTP_200_OK)
+    return JSONResponse(content=recipes_data,
+                        status_code=status.HTTP_200_OK,
+                        headers=headers)
 
 
 @router.post('/recipes', response_model=DetailedRecipeSchema)
 async def create_recipe(
     recipe_data: CreateRecipeSchema,
     current_user_id: int = Depends(is_authenticated),
-    session: AsyncSession = Depends(get_async_session)
+    session: AsyncSession = Depends(get_async_session),
+    loaders: RequestLoaders = Depends(get_loaders)
         ) -> JSONResponse:
 
     new_recipe = RecipeModel(
@@ -410,7 +529,7 @@ async def create_recipe(
     await session.flush()
 
     created_recipe = await get_single_recipe_from_db(
-        new_recipe.id, session, current_user_id)
+        new_recipe.id, session, loaders, current_user_id)
 
     recipe_data: dict = await serialize_recipe(*created_recipe)
 
@@ -423,9 +542,10 @@ async def create_recipe(
 @router.get('/recipes/download_shopping_cart')
 async def download_shopping_cart(
     current_user_id: int = Depends(is_authenticated),
-    session: AsyncSession = Depends(get_async_session)
+    session: AsyncSession = Depends(get_async_session),
+    loaders: RequestLoaders = Depends(get_loaders)
         ) -> StreamingResponse:
-    amounts = await get_shopping_cart(session, current_user_id)
+    amounts = await get_shopping_cart(session, loaders, current_user_id)
 
     shopping_cart, measure_units = {}, {}
 
@@ -448,12 +568,80 @@ async def download_shopping_cart(
                  'attachment;filename=shopping_cart.csv'})
 
 
+@router.post('/recipes/favorite/bulk', response_model=list[BulkResultSchema])
+async def add_to_favorite_bulk(
+    recipes: BulkRecipesSchema,
+    current_user_id: int = Depends(is_authenticated),
+    session: AsyncSession = Depends(get_async_session)
+        ) -> JSONResponse:
+
+    statuses = await bulk_add_recipes(
+        session, favorite, current_user_id, recipes.ids)
+    await session.commit()
+
+    return JSONResponse(
+        content=RecipeUtility.bulk_report(recipes.ids, statuses),
+        status_code=status.HTTP_200_OK)
+
+
+@router.post('/recipes/favorite/bulk/delete',
+             response_model=list[BulkResultSchema])
+async def delete_from_favorite_bulk(
+    recipes: BulkRecipesSchema,
+    current_user_id: int = Depends(is_authenticated),
+    session: AsyncSession = Depends(get_async_session)
+        ) -> JSONResponse:
+
+    statuses = await bulk_remove_recipes(
+        session, favorite, current_user_id, recipes.ids)
+    await session.commit()
+
+    return JSONResponse(
+        content=RecipeUtility.bulk_report(recipes.ids, statuses),
+        status_code=status.HTTP_200_OK)
+
+
+@router.post('/recipes/shopping_cart/bulk',
+             response_model=list[BulkResultSchema])
+async def add_to_shopping_cart_bulk(
+    recipes: BulkRecipesSchema,
+    current_user_id: int = Depends(is_authenticated),
+    session: AsyncSession = Depends(get_async_session)
+        ) -> JSONResponse:
+
+    statuses = await bulk_add_recipes(
+        session, shopping_cart, current_user_id, recipes.ids)
+    await session.commit()
+
+    return JSONResponse(
+        content=RecipeUtility.bulk_report(recipes.ids, statuses),
+        status_code=status.HTTP_200_OK)
+
+
+@router.post('/recipes/shopping_cart/bulk/delete',
+             response_model=list[BulkResultSchema])
+async def delete_from_shopping_cart_bulk(
+    recipes: BulkRecipesSchema,
+    current_user_id: int = Depends(is_authenticated),
+    session: AsyncSession = Depends(get_async_session)
+        ) -> JSONResponse:
+
+    statuses = await bulk_remove_recipes(
+        session, shopping_cart, current_user_id, recipes.ids)
+    await session.commit()
+
+    return JSONResponse(
+        content=RecipeUtility.bulk_report(recipes.ids, statuses),
+        status_code=status.HTTP_200_OK)
+
+
 @router.patch('/recipes/{id}', response_model=DetailedRecipeSchema)
 async def update_recipe(
     recipe_data: CreateRecipeSchema,
     id: int = Path(..., title='Recipe ID'),
     current_user_id: int = Depends(is_authenticated),
-    session: AsyncSession = Depends(get_async_session)
+    session: AsyncSession = Depends(get_async_session),
+    loaders: RequestLoaders = Depends(get_loaders)
         ) -> JSONResponse:
 
     target_recipe: RecipeModel = await get_recipe_or_404(id, session)
@@ -466,12 +654,14 @@ async def update_recipe(
 
     await RecipeUtility.perform_update_recipe(
         target_recipe, recipe_data.dict(), session)
+    # tag and ingredient changes live in other tables, bump it explicitly
+    target_recipe.updated_at = datetime.utcnow()
 
     await session.flush()
     await session.refresh(target_recipe)
 
     updated_recipe = await get_single_recipe_from_db(
-        target_recipe.id, session, current_user_id)
+        target_recipe.id, session, loaders, current_user_id)
 
     recipe_data: dict = await serialize_recipe(*updated_recipe)
 
@@ -482,22 +672,76 @@ async def update_recipe(
 
 @router.get('/recipes/{id}', response_model=DetailedRecipeSchema)
 async def get_recipe_by_id(
+    request: Request,
     id: int = Path(..., title='Tag ID'),
+    fields: str = Query(None, title='Fields'),
     current_user_id: int = Depends(get_user_id_from_token_or_none),
-    session: AsyncSession = Depends(get_async_session)
+    session: AsyncSession = Depends(get_async_session),
+    loaders: RequestLoaders = Depends(get_loaders)
         ) -> JSONResponse:
-    recipe_with_user = (
-        await get_single_recipe_from_db(id, session, current_user_id))
 
-    if recipe_with_user is None:
+    fields = parse_fields(fields, DetailedRecipeSchema)
+
+    validators = await get_recipe_validators(session, id, current_user_id)
+
+    if validators is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Recipe with ID {id} not found'
+        )
+
+    etag = make_etag('recipe', id, fields, current_user_id, *validators)
+    if current_user_id is None:
+        last_modified = latest(*validators[:4])
+        cache_control = PUBLIC_CACHE_CONTROL
+    else:
+        # flags are not timestamped, so only the ETag can tell they changed
+        last_modified = None
+        cache_control = PRIVATE_CACHE_CONTROL
+    headers = get_validator_headers(
+        etag, last_modified, cache_control, vary='Authorization')
+
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(headers)
+
+    flags = {
+        'is_favorited': validators.is_favorited,
+        'is_in_shopping_cart': validators.is_in_shopping_cart,
+    }
+    shared_fields = fields
+    if fields is not None:
+        flags = {name: flags[name] for name in flags if name in fields}
+        shared_fields = tuple(name for name in fields if name not in flags)
+
+    async def load_recipe() -> Optional[dict]:
+        recipe_with_user = await get_single_recipe_from_db(
+            id, session, loaders, None, shared_fields)
+        if recipe_with_user is None:
+            return None
+        if shared_fields is None:
+            return await serialize_recipe(*recipe_with_user)
+        recipes_data = await serialize_recipes_fields(
+            [recipe_with_user], shared_fields)
+        return recipes_data[0]
+
+    # viewers of the same recipe share one fetch and serialization, the
+    # per-viewer flags come with the validators. Keying on the update times
+    # keeps a request from joining a fetch that started before a write, so
+    # the body is never older than its ETag.
+    shared_recipe_data = await recipe_reads.do(
+        (id, shared_fields, *validators[:4]), load_recipe)
+
+    if shared_recipe_data is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Recipe with ID {id} not found'
         )
 
-    recipe_data: dict = await serialize_recipe(*recipe_with_user)
+    recipe_data = {**shared_recipe_data, **flags}
 
-    return JSONResponse(content=recipe_data, status_code=status.HTTP_200_OK)
+    return JSONResponse(content=recipe_data,
+                        status_code=status.HTTP_200_OK,
+                        headers=headers)
 
 
 @router.delete('/recipes/{id}')
@@ -0,0 +1,151 @@
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Hashable, Iterable, Optional
+
+from fastapi import Depends
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import noload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from db.models import (AmountModel, IngredientModel, TagModel, UserModel,
+                       recipe_tag_association)
+from db.session import get_async_session
+from metrics import record_cache_lookups
+
+
+class BatchLoader:
+    '''
+    Collects keys, fetches the missing ones with a single batch call and
+    keeps the results for the rest of the request, so every key is
+    requested from the database at most once.
+    '''
+    def __init__(
+        self,
+        name: str,
+        batch_load_fn: Callable[[list], Awaitable[dict]],
+            default_factory: Optional[Callable[[], Any]] = None):
+        self.name = name
+        self._batch_load_fn = batch_load_fn
+        self._default_factory = default_factory
+        self._cache: dict[Hashable, Any] = {}
+
+    async def load_many(self, keys: Iterable[Hashable]) -> list:
+        keys = list(keys)
+        unique_keys = dict.fromkeys(keys)
+        missing = [key for key in unique_keys if key not in self._cache]
+        record_cache_lookups(
+            f'loader_{self.name}', len(unique_keys) - len(missing),
+            len(missing))
+
+        if missing:
+            found = await self._batch_load_fn(missing)
+            for key in missing:
+                if key in found:
+                    self._cache[key] = found[key]
+                elif self._default_factory is not None:
+                    self._cache[key] = self._default_factory()
+                else:
+                    self._cache[key] = None
+
+        return [self._cache[key] for key in keys]
+
+    async def load(self, key: Hashable) -> Any:
+        values = await self.load_many([key])
+        return values[0]
+
+    def prime(self, key: Hashable, value: Any) -> None:
+        self._cache.setdefault(key, value)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+class RequestLoaders:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.users = BatchLoader('users', self._load_users)
+        self.ingredients = BatchLoader('ingredients', self._load_ingredients)
+        self.tags_by_recipe = BatchLoader(
+            'tags_by_recipe', self._load_tags_by_recipe, list)
+        self.amounts_by_recipe = BatchLoader(
+            'amounts_by_recipe', self._load_amounts_by_recipe, list)
+
+    async def _load_users(self, user_ids: list[int]) -> dict:
+        result = await self.session.execute(
+            select(UserModel)
+            .where(UserModel.id.in_(user_ids))
+            .options(noload('*'))
+        )
+        return {user.id: user for user in result.scalars()}
+
+    async def _load_ingredients(self, ingredient_ids: list[int]) -> dict:
+        result = await self.session.execute(
+            select(IngredientModel)
+            .where(IngredientModel.id.in_(ingredient_ids))
+        )
+        return {i.id: i for i in result.scalars()}
+
+    async def _load_tags_by_recipe(self, recipe_ids: list[int]) -> dict:
+        result = await self.session.execute(
+            select(recipe_tag_association.c.recipe_id, TagModel)
+            .join(TagModel,
+                  TagModel.id == recipe_tag_association.c.tag_id)
+            .where(recipe_tag_association.c.recipe_id.in_(recipe_ids))
+            .order_by(TagModel.id)
+        )
+        tags = defaultdict(list)
+        for recipe_id, tag in result:
+            tags[recipe_id].append(tag)
+        return tags
+
+    async def _load_amounts_by_recipe(self, recipe_ids: list[int]) -> dict:
+        result = await self.session.execute(
+            select(AmountModel)
+            .where(AmountModel.recipe_id.in_(recipe_ids))
+            .options(noload('*'))
+        )
+        amounts = result.scalars().all()
+
+        await self.attach_ingredients(amounts)
+
+        amounts_by_recipe = defaultdict(list)
+        for amount in amounts:
+            amounts_by_recipe[amount.recipe_id].append(amount)
+        return amounts_by_recipe
+
+    async def attach_ingredients(self, amounts: list[AmountModel]) -> None:
+        ingredients = await self.ingredients.load_many(
+            a.ingredient_id for a in amounts)
+        for amount, ingredient in zip(amounts, ingredients):
+            set_committed_value(amount, 'ingredient', ingredient)
+
+    async def attach_recipe_relations(
+        self,
+        recipes: list,
+        tags: bool = True,
+            ingredients: bool = True) -> None:
+        '''
+        Populates `tags` and `ingredients` of the given recipes with one
+        query per entity type, whatever the number of recipes.
+        '''
+        recipe_ids = [recipe.id for recipe in recipes]
+
+        if tags:
+            recipe_tags = await self.tags_by_recipe.load_many(recipe_ids)
+            for recipe, tag_list in zip(recipes, recipe_tags):
+                set_committed_value(recipe, 'tags', tag_list)
+
+        if ingredients:
+            amounts = await self.amounts_by_recipe.load_many(recipe_ids)
+            for recipe, amount_list in zip(recipes, amounts):
+                set_committed_value(recipe, 'ingredients', amount_list)
+
+    def clear(self) -> None:
+        for loader in (self.users, self.ingredients,
+                       self.tags_by_recipe, self.amounts_by_recipe):
+            loader.clear()
+
+
+def get_loaders(
+        session: AsyncSession = Depends(get_async_session)) -> RequestLoaders:
+    return RequestLoaders(session)
@@ -1,7 +1,40 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+from db.invalidation import invalidation_bus
+from metrics import CONTENT_TYPE, REGISTRY
+from settings import PROFILE_SAMPLE_RATE, PROFILE_SECRET
 
 from .handlers import router
+from .middleware import (CompressionMiddleware, MetricsMiddleware,
+                         ProfilingMiddleware, QueryStatsMiddleware,
+                         ReadYourWritesMiddleware)
+from .watchdog import loop_watchdog
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await invalidation_bus.start()
+    await loop_watchdog.start()
+    yield
+    await loop_watchdog.stop()
+    await invalidation_bus.stop()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(MetricsMiddleware)
+if PROFILE_SAMPLE_RATE or PROFILE_SECRET:
+    app.add_middleware(ProfilingMiddleware)
 
 app.include_router(router, prefix='/api')
+
+
+@app.get('/metrics', include_in_schema=False)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
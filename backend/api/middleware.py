@@ -0,0 +1,262 @@
+import asyncio
+import random
+import sys
+import time
+from uuid import uuid4
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from db.query_stats import track_queries
+from db.session import PRIMARY_STICKY_COOKIE, READ_METHODS, replicas
+from metrics import Counter, Gauge, Histogram
+from settings import (COMPRESSION_CONTENT_TYPES, COMPRESSION_MIN_SIZE,
+                      PROFILE_SAMPLE_RATE, READ_YOUR_WRITES_SECONDS)
+
+from .compression import (COMPRESSION_BYTES, choose_encoding, compress,
+                          streaming_compressor)
+from .profiling import (SIGNATURE_HEADER, Profile, is_signed, profile_path,
+                        sampler, write_profile)
+from .workers import profiling_pool
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route.',
+    ('method', 'route', 'status'))
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'Requests being handled by route.',
+    ('method', 'route'))
+PROFILED_REQUESTS = Counter(
+    'http_profiled_requests_total', 'Profiled requests by route and trigger.',
+    ('route', 'trigger'))
+
+# route of the request each task is handling, read by the loop watchdog
+# from its own thread: a dict lookup is atomic, while the locals of a
+# running frame may be read half updated
+task_routes: dict[asyncio.Task, str] = {}
+
+
+def get_route_path(scope: Scope) -> str:
+    for route in scope['app'].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return 'unmatched'
+
+
+class QueryStatsMiddleware:
+    '''
+    Counts the statements executed while handling a request and reports
+    them in the `Server-Timing` header.
+    '''
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+
+            async def send_with_timing(message: Message) -> None:
+                if message['type'] == 'http.response.start':
+                    headers = MutableHeaders(scope=message)
+                    headers.append('Server-Timing', stats.server_timing())
+                await send(message)
+
+            await self.app(scope, receive, send_with_timing)
+
+        stats.report_duplicates(f'{scope["method"]} {scope["path"]}')
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method, route = scope['method'], get_route_path(scope)
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        task = asyncio.current_task()
+        task_routes[task] = f'{method} {route}'
+        REQUESTS_IN_FLIGHT.inc(method=method, route=route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            task_routes.pop(task, None)
+            REQUESTS_IN_FLIGHT.dec(method=method, route=route)
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                method=method, route=route, status=status_code)
+
+
+class ReadYourWritesMiddleware:
+    '''
+    After a successful write, marks the client with a cookie that keeps its
+    reads on the primary until replicas have caught up.
+    '''
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (scope['type'] != 'http' or scope['method'] in READ_METHODS
+                or not replicas.engines):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message) -> None:
+            if (message['type'] == 'http.response.start'
+                    and message['status'] < 400):
+                sticky_until = time.time() + READ_YOUR_WRITES_SECONDS
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    'Set-Cookie',
+                    f'{PRIMARY_STICKY_COOKIE}={sticky_until:.0f}; '
+                    f'Max-Age={READ_YOUR_WRITES_SECONDS}; Path=/; '
+                    'HttpOnly; SameSite=Lax')
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+class CompressionMiddleware:
+    '''
+    Compresses allowlisted content types with the best encoding the client
+    accepts. Bodies sent in one message are skipped under
+    COMPRESSION_MIN_SIZE, and those with an ETag are compressed once per
+    encoding by all workers. Streamed bodies are compressed chunk by chunk.
+    '''
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    @staticmethod
+    def _is_compressible_type(headers: Headers) -> bool:
+        content_type = headers.get('content-type', '')
+        media_type = content_type.split(';', 1)[0].strip().lower()
+        return media_type in COMPRESSION_CONTENT_TYPES
+
+    def _should_compress(self, message: Message) -> bool:
+        headers = Headers(raw=message['headers'])
+        return (message['status'] not in (204, 304)
+                and 'content-encoding' not in headers
+                and 'no-transform' not in headers.get('cache-control', '')
+                and self._is_compressible_type(headers))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        encoding = None
+        if scope['type'] == 'http' and scope['method'] != 'HEAD':
+            encoding = choose_encoding(
+                Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message, compressor
+            if message['type'] == 'http.response.start':
+                if self._should_compress(message):
+                    # held back until the first body shows its size
+                    start_message = message
+                    return
+                await send(message)
+                return
+
+            if message['type'] != 'http.response.body' or (
+                    start_message is None and compressor is None):
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+            if start_message is not None:
+                headers = MutableHeaders(scope=start_message)
+                headers.add_vary_header('Accept-Encoding')
+
+                if not more_body:
+                    if len(body) >= COMPRESSION_MIN_SIZE:
+                        body = await compress(
+                            encoding, body, headers.get('etag'))
+                        headers['Content-Encoding'] = encoding
+                        headers['Content-Length'] = str(len(body))
+                    await send(start_message)
+                    start_message = None
+                    await send({'type': 'http.response.body', 'body': body})
+                    return
+
+                compressor = streaming_compressor(encoding)
+                headers['Content-Encoding'] = encoding
+                if 'content-length' in headers:
+                    del headers['Content-Length']
+                await send(start_message)
+                start_message = None
+
+            chunk = compressor.compress(body) if body else b''
+            if not more_body:
+                chunk += compressor.finish()
+            COMPRESSION_BYTES.inc(len(body), encoding=encoding, stage='in')
+            COMPRESSION_BYTES.inc(len(chunk), encoding=encoding, stage='out')
+            if chunk or not more_body:
+                await send({'type': 'http.response.body', 'body': chunk,
+                            'more_body': more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+class ProfilingMiddleware:
+    '''
+    Profiles a PROFILE_SAMPLE_RATE share of requests, plus those carrying
+    a valid X-Profile-Signature, and writes one profile per request under
+    PROFILE_DIR/<route>/. Signed requests get the file name back in the
+    X-Profile-Id header.
+    '''
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or not sampler.is_supported():
+            await self.app(scope, receive, send)
+            return
+
+        signed = is_signed(scope['method'], scope['path'],
+                           Headers(scope=scope).get(SIGNATURE_HEADER))
+        if not signed and random.random() >= PROFILE_SAMPLE_RATE:
+            await self.app(scope, receive, send)
+            return
+
+        route = get_route_path(scope)
+        profile_id = f'{time.strftime("%Y%m%dT%H%M%S")}-{uuid4().hex[:8]}'
+
+        async def send_with_profile_id(message: Message) -> None:
+            if message['type'] == 'http.response.start' and signed:
+                headers = MutableHeaders(scope=message)
+                headers.append('X-Profile-Id', profile_id)
+            await send(message)
+
+        # samples count only while this frame is on the loop's stack
+        profile = Profile(f'{scope["method"]} {route}', sys._getframe())
+        sampler.start(profile)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            sampler.stop(profile)
+
+        PROFILED_REQUESTS.inc(
+            route=route, trigger='signed' if signed else 'sampled')
+        await profiling_pool.run(
+            write_profile, profile, profile_path(route, profile_id))
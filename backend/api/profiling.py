@@ -0,0 +1,190 @@
+'''
+Statistical profiling of single requests.
+
+Every PROFILE_INTERVAL seconds of CPU time a timer signal interrupts the
+event loop and records its stack. Samples are kept for a profiled request
+only when its entry frame is on that stack, so the profile shows where
+the request spends CPU time on the loop, not what concurrent requests do.
+Time spent awaiting the database or worker pools leaves no samples.
+
+A request is profiled at random with PROFILE_SAMPLE_RATE, or on demand
+with a header signed with PROFILE_SECRET, good for one request:
+
+    python -m api.profiling GET /api/recipes
+'''
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Optional
+
+from settings import (PROFILE_DIR, PROFILE_FORMAT, PROFILE_INTERVAL,
+                      PROFILE_SECRET)
+
+SIGNATURE_HEADER = 'x-profile-signature'
+DEFAULT_SIGNATURE_TTL = 300  # seconds
+
+Frame = tuple[str, str, int]
+
+
+class Profile:
+    def __init__(self, name: str, root: FrameType):
+        self.name = name
+        self.root = root
+        self.stacks: Counter = Counter()
+
+    def sample(self, frame: Optional[FrameType]) -> None:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            if frame is self.root:
+                stack.reverse()
+                self.stacks[tuple(stack)] += 1
+                return
+            frame = frame.f_back
+
+    def collapsed(self) -> str:
+        return ''.join(
+            ';'.join(f'{name} ({filename}:{line})'
+                     for name, filename, line in stack) + f' {count}\n'
+            for stack, count in self.stacks.items())
+
+    def speedscope(self) -> str:
+        frames: dict[Frame, int] = {}
+        samples, weights = [], []
+        for stack, count in self.stacks.items():
+            samples.append([frames.setdefault(frame, len(frames))
+                            for frame in stack])
+            weights.append(count * PROFILE_INTERVAL)
+
+        return json.dumps({
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': self.name,
+            'shared': {'frames': [
+                {'name': name, 'file': filename, 'line': line}
+                for name, filename, line in frames]},
+            'profiles': [{
+                'type': 'sampled',
+                'name': self.name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        })
+
+
+class StackSampler:
+    '''
+    Samples the registered profiles on a SIGPROF interval timer. Python runs
+    the handler on the main thread, the event loop's, between two bytecodes,
+    while a sampling thread would only get the GIL when the loop releases
+    it and would never see short bursts of CPU work between awaits.
+    '''
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._profiles: set[Profile] = set()
+        self._installed = False
+
+    @staticmethod
+    def is_supported() -> bool:
+        return (hasattr(signal, 'setitimer')
+                and threading.current_thread() is threading.main_thread())
+
+    def start(self, profile: Profile) -> None:
+        if not self._installed:
+            # left installed, a late signal must never hit the default action
+            signal.signal(signal.SIGPROF, self._handle)
+            self._installed = True
+        if not self._profiles:
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self._profiles.add(profile)
+
+    def stop(self, profile: Profile) -> None:
+        self._profiles.discard(profile)
+        if not self._profiles:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+
+    def _handle(self, signum: int, frame: Optional[FrameType]) -> None:
+        for profile in tuple(self._profiles):
+            profile.sample(frame)
+
+
+sampler = StackSampler(PROFILE_INTERVAL)
+
+
+# nonces of the signatures accepted by this worker, with their expiry
+_used_nonces: dict[str, int] = {}
+
+
+def sign_request(method: str, path: str, expires: int, nonce: str) -> str:
+    message = f'{expires}:{nonce}:{method.upper()} {path}'.encode()
+    digest = hmac.new(
+        PROFILE_SECRET.encode(), message, hashlib.sha256).hexdigest()
+    return f'{expires}.{nonce}.{digest}'
+
+
+def is_signed(method: str, path: str, signature: Optional[str]) -> bool:
+    '''
+    Accepts a signature once: its nonce is remembered until it expires, so
+    a captured header cannot be replayed to profile more requests.
+    '''
+    if not PROFILE_SECRET or not signature:
+        return False
+    try:
+        expires, nonce, _ = signature.split('.')
+        expires = int(expires)
+    except ValueError:
+        return False
+
+    now = time.time()
+    for used, used_expires in list(_used_nonces.items()):
+        if used_expires < now:
+            del _used_nonces[used]
+    if expires < now or nonce in _used_nonces:
+        return False
+
+    if not hmac.compare_digest(
+            signature, sign_request(method, path, expires, nonce)):
+        return False
+    _used_nonces[nonce] = expires
+    return True
+
+
+def profile_path(route: str, profile_id: str) -> str:
+    extension = 'json' if PROFILE_FORMAT == 'speedscope' else 'txt'
+    route_dir = re.sub(r'\W+', '_', route).strip('_') or 'root'
+    return os.path.join(PROFILE_DIR, route_dir, f'{profile_id}.{extension}')
+
+
+def write_profile(profile: Profile, path: str) -> None:
+    content = (profile.speedscope() if PROFILE_FORMAT == 'speedscope'
+               else profile.collapsed())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(content)
+
+
+def main() -> None:
+    if len(sys.argv) != 3:
+        sys.exit('usage: python -m api.profiling METHOD PATH')
+    if not PROFILE_SECRET:
+        sys.exit('PROFILE_SECRET is not set')
+    method, path = sys.argv[1:]
+    expires = int(time.time()) + DEFAULT_SIGNATURE_TTL
+    signature = sign_request(method, path, expires, secrets.token_hex(8))
+    print(f'X-Profile-Signature: {signature}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
-from pydantic import ValidationError
+from functools import lru_cache
+
+from pydantic import BaseModel, ValidationError, create_model
 
 from db.schemas import (BriefRecipeSchema, BriefUserSchema,
                         DetailedRecipeSchema, DetailedUserSchema,
@@ -10,7 +12,7 @@ from .utils import handle_validation_error
 def serialize_users_list(users) -> list[dict]:
     try:
         users_data = [
-            BriefUserSchema(**user.__dict__).dict() for user in users]
+            BriefUserSchema(**user._mapping).dict() for user in users]
     except ValidationError as err:
         handle_validation_error(
             err, 'Validation error while processing the user data')
@@ -160,3 +162,50 @@ async def serialize_recipe(
             err, 'Validation error while processing the recipe data')
 
     return recipes_data
+
+
+@lru_cache
+def _partial_recipe_schema(fields: tuple[str, ...]) -> type[BaseModel]:
+    return create_model(
+        'PartialRecipeSchema',
+        **{name: (DetailedRecipeSchema.model_fields[name].annotation, ...)
+           for name in fields}
+    )
+
+
+def _recipe_field(name, recipe, user, is_favorited, is_in_shopping_cart):
+    if name == 'pub_date':
+        return recipe.pub_date.isoformat()
+    if name == 'author':
+        return user.__dict__
+    if name == 'tags':
+        return [tag.__dict__ for tag in recipe.tags]
+    if name == 'ingredients':
+        return [{**i.ingredient.__dict__, 'amount': i.amount}
+                for i in recipe.ingredients]
+    if name == 'is_favorited':
+        return is_favorited
+    if name == 'is_in_shopping_cart':
+        return is_in_shopping_cart
+    return getattr(recipe, name)
+
+
+async def serialize_recipes_fields(recipes, fields) -> list[dict]:
+    '''
+    serialize_recipes_list limited to the given fields, None meaning all.
+    '''
+    if fields is None:
+        return await serialize_recipes_list(recipes)
+
+    schema = _partial_recipe_schema(fields)
+    try:
+        recipes_data = [
+            schema(**{name: _recipe_field(name, *recipe) for name in fields})
+            .dict()
+            for recipe in recipes
+        ]
+    except ValidationError as err:
+        handle_validation_error(
+            err, 'Validation error while processing the recipe data')
+
+    return recipes_data
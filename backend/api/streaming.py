@@ -0,0 +1,58 @@
+import inspect
+import json
+from typing import Any, AsyncIterator, Callable
+
+from fastapi.responses import StreamingResponse
+
+from .utils import StreamFormat
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+
+def _dumps(item: Any) -> str:
+    # same output as JSONResponse
+    return json.dumps(item, ensure_ascii=False, allow_nan=False,
+                      separators=(',', ':'))
+
+
+async def serialize_batches(
+    batches: AsyncIterator[list],
+        serialize: Callable) -> AsyncIterator[list[dict]]:
+    async for batch in batches:
+        items = serialize(batch)
+        if inspect.isawaitable(items):
+            items = await items
+        yield items
+
+
+async def encode_batches(
+    batches: AsyncIterator[list[dict]],
+        stream_format: StreamFormat) -> AsyncIterator[bytes]:
+    '''
+    Encodes every batch as soon as it arrives, one chunk per batch, either
+    as JSON lines or as the pieces of a single JSON array.
+    '''
+    if stream_format == StreamFormat.ndjson:
+        async for batch in batches:
+            if batch:
+                yield ''.join(_dumps(item) + '\n' for item in batch).encode()
+        return
+
+    yield b'['
+    separator = ''
+    async for batch in batches:
+        if batch:
+            yield (separator + ','.join(map(_dumps, batch))).encode()
+            separator = ','
+    yield b']'
+
+
+def stream_response(
+    batches: AsyncIterator[list],
+    serialize: Callable,
+        stream_format: StreamFormat) -> StreamingResponse:
+    media_type = (NDJSON_MEDIA_TYPE if stream_format == StreamFormat.ndjson
+                  else 'application/json')
+    return StreamingResponse(
+        encode_batches(serialize_batches(batches, serialize), stream_format),
+        media_type=media_type)
@@ -1,7 +1,12 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 from enum import Enum
+from typing import Optional
 
-from fastapi import HTTPException, status
-from pydantic import ValidationError
+from fastapi import HTTPException, Request, status
+from pydantic import BaseModel, ValidationError
+from starlette.responses import Response
 
 
 class BoolOptions(Enum):
@@ -9,6 +14,11 @@ class BoolOptions(Enum):
     true = '1'
 
 
+class StreamFormat(Enum):
+    ndjson = 'ndjson'
+    json = 'json'
+
+
 def get_pagination_links(page: int, limit: int, total_items: int) -> dict:
     last = (total_items - 1) // limit + 1
     nxt = page + 1 if page < last else None
@@ -26,3 +36,76 @@ def handle_validation_error(err: ValidationError, error_message: str) -> None:
         status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
         detail=error_message,
     ) from err
+
+
+def parse_fields(
+    fields: Optional[str],
+        schema: type[BaseModel]) -> Optional[tuple[str, ...]]:
+    '''
+    Turns a comma separated `fields` parameter into the requested field
+    names in schema order, or None when every field is wanted.
+    '''
+    if not fields:
+        return None
+
+    requested = {name.strip() for name in fields.split(',') if name.strip()}
+    unknown = requested - set(schema.model_fields)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Unknown fields: {", ".join(sorted(unknown))}'
+        )
+
+    return tuple(name for name in schema.model_fields if name in requested)
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12)
+    # weak, as the same payload may go out with different content-encodings
+    return f'W/"{digest.hexdigest()}"'
+
+
+def latest(*timestamps: Optional[datetime]) -> Optional[datetime]:
+    return max((ts for ts in timestamps if ts is not None), default=None)
+
+
+def get_validator_headers(
+    etag: str,
+    last_modified: Optional[datetime],
+    cache_control: str,
+        vary: Optional[str] = None) -> dict:
+    headers = {'ETag': etag, 'Cache-Control': cache_control}
+    if vary is not None:
+        headers['Vary'] = vary
+    if last_modified is not None:
+        headers['Last-Modified'] = format_datetime(
+            last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+
+def is_not_modified(
+    request: Request,
+    etag: str,
+        last_modified: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        etags = [tag.strip().removeprefix('W/')
+                 for tag in if_none_match.split(',')]
+        return '*' in etags or etag.removeprefix('W/') in etags
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        modified_since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if modified_since.tzinfo is None:
+        modified_since = modified_since.replace(tzinfo=timezone.utc)
+    return (last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+            <= modified_since)
+
+
+def not_modified_response(headers: dict) -> Response:
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
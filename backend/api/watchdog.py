@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from metrics import Counter, Histogram
+from settings import LOOP_BLOCK_THRESHOLD, LOOP_LAG_INTERVAL
+
+from .middleware import task_routes
+
+logger = logging.getLogger(__name__)
+
+STACK_LIMIT = 30
+
+LOOP_LAG = Histogram(
+    'event_loop_lag_seconds',
+    'Delay of the event loop in running a scheduled callback.',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+LOOP_BLOCKS = Counter(
+    'event_loop_blocks_total',
+    'Times the event loop was blocked over the threshold, by route.',
+    ('route',))
+LOOP_BLOCKED_SECONDS = Counter(
+    'event_loop_blocked_seconds_total',
+    'Time the event loop spent blocked over the threshold, by route.',
+    ('route',))
+
+
+def find_route(loop: asyncio.AbstractEventLoop) -> str:
+    '''
+    Names the route of the request whose task the loop is running, as
+    recorded by MetricsMiddleware. Safe to call from another thread.
+    '''
+    return task_routes.get(asyncio.current_task(loop), 'background')
+
+
+class LoopWatchdog:
+    '''
+    Measures event loop lag with a heartbeat task and watches it from a
+    thread. When the heartbeat is late by more than LOOP_BLOCK_THRESHOLD,
+    the thread logs the loop's stack while it is still blocked, and the
+    heartbeat records the whole delay once the loop is free again.
+    '''
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id = 0
+        self._last_beat = 0.0
+        self._beats = 0
+        # route of the block being reported, set by the thread
+        self._blocked_route: Optional[str] = None
+
+    async def start(self) -> None:
+        if self.threshold <= 0 or self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(
+            target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._thread.join()
+        self._thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - started - self.interval, 0.0)
+            self._last_beat = now
+            self._beats += 1
+            LOOP_LAG.observe(lag)
+
+            if lag >= self.threshold:
+                # a C call holding the GIL can keep the thread from noticing
+                route = self._blocked_route or 'unknown'
+                self._blocked_route = None
+                LOOP_BLOCKS.inc(route=route)
+                LOOP_BLOCKED_SECONDS.inc(lag, route=route)
+                logger.warning('Event loop was blocked for %.3fs in %s',
+                               lag, route)
+
+    def _watch(self) -> None:
+        reported_beat = -1
+        check_interval = min(self.interval, self.threshold) / 2
+        while not self._stopped.wait(check_interval):
+            beats = self._beats
+            late = time.monotonic() - self._last_beat - self.interval
+            if late < self.threshold or beats == reported_beat:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            reported_beat = beats
+            route = find_route(self._loop)
+            self._blocked_route = route
+            logger.warning(
+                'Event loop blocked for over %.3fs in %s:\n%s', late, route,
+                ''.join(traceback.format_stack(frame, limit=STACK_LIMIT)))
+
+
+loop_watchdog = LoopWatchdog(LOOP_LAG_INTERVAL, LOOP_BLOCK_THRESHOLD)
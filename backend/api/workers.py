@@ -0,0 +1,68 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+from metrics import Gauge
+from settings import BCRYPT_WORKERS, COMPRESSION_WORKERS, IMAGE_WORKERS
+
+WORKER_POOL_TASKS = Gauge(
+    'worker_pool_tasks', 'Tasks in worker pools by state.', ('pool', 'state'))
+
+
+class WorkerPool:
+    '''
+    Thread pool for CPU-heavy calls that would otherwise block the event
+    loop. Keeps track of queued and running tasks for the metrics.
+    '''
+    pools: dict[str, 'WorkerPool'] = {}
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.queued = 0
+        self.running = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name)
+        WorkerPool.pools[name] = self
+
+    def _call(self, func: Callable, *args) -> Any:
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def _dequeue_cancelled(self, future: Future) -> None:
+        # cancelled before a thread picked it up, so _call never ran
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    async def run(self, func: Callable, *args) -> Any:
+        with self._lock:
+            self.queued += 1
+        future = self._executor.submit(partial(self._call, func, *args))
+        future.add_done_callback(self._dequeue_cancelled)
+        return await asyncio.wrap_future(future)
+
+
+def _tasks_by_state() -> dict:
+    tasks = {}
+    for name, pool in WorkerPool.pools.items():
+        tasks[(name, 'queued')] = pool.queued
+        tasks[(name, 'running')] = pool.running
+    return tasks
+
+
+WORKER_POOL_TASKS.set_function(_tasks_by_state)
+
+bcrypt_pool = WorkerPool('bcrypt', BCRYPT_WORKERS)
+image_pool = WorkerPool('image', IMAGE_WORKERS)
+compression_pool = WorkerPool('compression', COMPRESSION_WORKERS)
+# writes profiles to disk, which the event loop should not wait on
+profiling_pool = WorkerPool('profiling', 1)
@@ -0,0 +1,285 @@
+'''
+Benchmarks the main endpoints with the app running in-process.
+
+    python -m db.synthetic --seed 42 --truncate
+    python -m benchmarks.endpoints --output before.json
+    python -m benchmarks.endpoints --output after.json --baseline before.json
+
+Requests go through an ASGI client, so no server is needed, against the
+database in POSTGRES_URL, which should hold data from db.synthetic
+(--generate fills it with the default sizes). Each concurrent worker is
+logged in as its own synthetic user and draws recipes with the same
+Zipfian skew the generator uses.
+
+Every scenario reports latency percentiles, throughput, statements
+executed per request and peak RSS. RSS is a high-water mark of the whole
+process, so run one --scenario at a time to attribute memory precisely.
+'''
+import argparse
+import asyncio
+import math
+import random
+import resource
+import sys
+import time
+from collections import Counter
+from typing import Awaitable, Callable
+
+import httpx
+
+from api.main import app
+from benchmarks.results import change, load, metadata, print_baseline, save
+from db import synthetic
+from db.bulk import connect
+from db.query_stats import track_queries
+from db.synthetic import SYNTHETIC_PASSWORD, Zipf
+
+DEFAULT_REQUESTS = 200
+DEFAULT_CONCURRENCY = 4
+DEFAULT_WARMUP = 20
+PERCENTILES = (50, 95, 99)
+
+
+class BenchmarkUser:
+    def __init__(self, email: str, token: str, spare_recipe_id: int):
+        self.email = email
+        self.headers = {'Authorization': f'Bearer {token}'}
+        # a recipe not in the user's favorites, for the toggle scenario
+        self.spare_recipe_id = spare_recipe_id
+
+
+Scenario = Callable[
+    [httpx.AsyncClient, BenchmarkUser, int], Awaitable[list[httpx.Response]]]
+
+
+async def login(client, user, recipe_id):
+    return [await client.post('/api/auth/token/login', data={
+        'username': user.email, 'password': SYNTHETIC_PASSWORD})]
+
+
+async def recipes_list(client, user, recipe_id):
+    return [await client.get('/api/recipes')]
+
+
+async def recipes_list_authenticated(client, user, recipe_id):
+    return [await client.get('/api/recipes', headers=user.headers)]
+
+
+async def recipe_detail(client, user, recipe_id):
+    return [await client.get(f'/api/recipes/{recipe_id}',
+                             headers=user.headers)]
+
+
+async def subscriptions(client, user, recipe_id):
+    return [await client.get('/api/users/subscriptions',
+                             headers=user.headers)]
+
+
+async def download_shopping_cart(client, user, recipe_id):
+    return [await client.get('/api/recipes/download_shopping_cart',
+                             headers=user.headers)]
+
+
+async def favorite_toggle(client, user, recipe_id):
+    # adds and removes the same recipe, leaving the data as it was
+    url = f'/api/recipes/{user.spare_recipe_id}/favorite'
+    return [await client.post(url, headers=user.headers),
+            await client.delete(url, headers=user.headers)]
+
+
+SCENARIOS: dict[str, Scenario] = {
+    'login': login,
+    'recipes_list': recipes_list,
+    'recipes_list_authenticated': recipes_list_authenticated,
+    'recipe_detail': recipe_detail,
+    'subscriptions': subscriptions,
+    'download_shopping_cart': download_shopping_cart,
+    'favorite_toggle': favorite_toggle,
+}
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    # nearest rank
+    rank = math.ceil(percent / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+async def load_fixtures(user_count: int) -> tuple[list[tuple], list[int]]:
+    '''
+    Returns the (id, email, spare recipe id) of up to `user_count`
+    synthetic users and the ids of all recipes.
+    '''
+    connection = await connect()
+    try:
+        users = await connection.fetch(
+            '''
+            SELECT u.id, u.email, (
+                SELECT r.id FROM recipes r
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM favorite f
+                    WHERE f.user_id = u.id AND f.recipe_id = r.id)
+                ORDER BY r.id LIMIT 1) AS spare_recipe_id
+            FROM users u
+            WHERE u.email LIKE 'user%@example.com'
+            ORDER BY u.id
+            LIMIT $1
+            ''', user_count)
+        recipe_ids = [row['id'] for row in await connection.fetch(
+            'SELECT id FROM recipes ORDER BY id')]
+    finally:
+        await connection.close()
+
+    if not users or not recipe_ids:
+        raise SystemExit(
+            'No synthetic data found, run python -m db.synthetic first '
+            'or pass --generate')
+    return [tuple(row) for row in users], recipe_ids
+
+
+async def log_in(client: httpx.AsyncClient,
+                 fixtures: list[tuple]) -> list[BenchmarkUser]:
+    users = []
+    for _, email, spare_recipe_id in fixtures:
+        response = await client.post('/api/auth/token/login', data={
+            'username': email, 'password': SYNTHETIC_PASSWORD})
+        response.raise_for_status()
+        users.append(BenchmarkUser(
+            email, response.json()['access_token'], spare_recipe_id))
+    return users
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario,
+                       users: list[BenchmarkUser], recipes: Zipf,
+                       requests: int, concurrency: int) -> dict:
+    latencies, query_counts, statuses = [], [], Counter()
+    remaining = iter(range(requests))
+
+    async def worker(user: BenchmarkUser) -> None:
+        for _ in remaining:
+            with track_queries() as stats:
+                started = time.perf_counter()
+                responses = await scenario(client, user, recipes.draw())
+                latencies.append(time.perf_counter() - started)
+            query_counts.append(stats.count)
+            statuses.update(str(r.status_code) for r in responses)
+
+    rss_before = peak_rss_kb()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        worker(users[index % len(users)]) for index in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    peak = peak_rss_kb()
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'latency_ms': {
+            'mean': 1000 * sum(latencies) / len(latencies),
+            **{f'p{percent}': 1000 * percentile(latencies, percent)
+               for percent in PERCENTILES},
+            'max': 1000 * latencies[-1],
+        },
+        'queries': {
+            'mean': sum(query_counts) / len(query_counts),
+            'max': max(query_counts),
+        },
+        'statuses': dict(sorted(statuses.items())),
+        'peak_rss_kb': peak,
+        'rss_growth_kb': peak - rss_before,
+    }
+
+
+async def benchmark(args: argparse.Namespace) -> dict:
+    if args.generate:
+        await synthetic.generate(synthetic.build_parser().parse_args(
+            ['--seed', str(args.seed), '--truncate']))
+
+    fixtures, recipe_ids = await load_fixtures(args.concurrency)
+    recipes = Zipf(random.Random(args.seed), recipe_ids, args.zipf)
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(
+                transport=transport, base_url='http://benchmark') as client:
+            users = await log_in(client, fixtures)
+            for name in args.scenario or SCENARIOS:
+                scenario = SCENARIOS[name]
+                if args.warmup:
+                    await run_scenario(client, scenario, users, recipes,
+                                       args.warmup, args.concurrency)
+                results[name] = await run_scenario(
+                    client, scenario, users, recipes, args.requests,
+                    args.concurrency)
+                print_result(name, results[name])
+
+    return {'meta': metadata(args), 'scenarios': results}
+
+
+def print_result(name: str, result: dict) -> None:
+    latency = result['latency_ms']
+    print(f'{name:28} {result["throughput"]:8.1f} req/s  '
+          f'p50 {latency["p50"]:7.1f}  p95 {latency["p95"]:7.1f}  '
+          f'p99 {latency["p99"]:7.1f} ms  '
+          f'{result["queries"]["mean"]:5.1f} queries  '
+          f'{result["peak_rss_kb"] // 1024} MiB  {result["statuses"]}',
+          file=sys.stderr)
+
+
+def compare(results: dict, baseline: dict) -> None:
+    metrics = (
+        ('throughput', lambda r: r['throughput']),
+        *((f'p{percent}', lambda r, p=percent: r['latency_ms'][f'p{p}'])
+          for percent in PERCENTILES),
+        ('queries', lambda r: r['queries']['mean']),
+        ('peak_rss_kb', lambda r: r['peak_rss_kb']),
+    )
+    print_baseline(baseline)
+    for name, result in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        changes = [f'{metric} {change(value(before), value(result))}'
+                   for metric, value in metrics]
+        print(f'{name:28} ' + '  '.join(changes), file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmark the main API endpoints in-process.')
+    parser.add_argument('--scenario', action='append',
+                        choices=sorted(SCENARIOS),
+                        help='run only this scenario, may be repeated')
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS,
+                        help='measured requests per scenario')
+    parser.add_argument('--concurrency', type=int,
+                        default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP,
+                        help='unmeasured requests per scenario')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--zipf', type=float, default=1.1,
+                        help='Zipf exponent of recipe popularity')
+    parser.add_argument('--generate', action='store_true',
+                        help='refill the database with db.synthetic first')
+    parser.add_argument('--output', help='file to save the results to')
+    parser.add_argument('--baseline',
+                        help='results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    results = asyncio.run(benchmark(args))
+
+    if args.output:
+        save(args.output, results)
+    if args.baseline:
+        compare(results, load(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+'''
+Micro-benchmarks of the serializers and of query construction in api.dals,
+on fixed in-memory fixtures, so no database is needed.
+
+    python -m benchmarks.micro --output before.json
+    python -m benchmarks.micro --output after.json --baseline before.json
+
+Serializers are timed per item and traced with tracemalloc for the peak
+memory allocated per item. DAL functions are run against a session that
+stops them at their first query; the statement they built is then timed
+again through the three steps SQLAlchemy takes on every execution:
+building it, computing its cache key and, on a cache miss, compiling it.
+'''
+import argparse
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Coroutine
+
+from api.dals import (get_recipe_validators, get_recipes_by_user_id,
+                      get_recipes_from_db, get_recipes_list_validators,
+                      get_shopping_cart, get_single_recipe_from_db,
+                      get_user_subscriptions, get_users_page,
+                      is_recipe_in_favorite, is_recipe_in_shopping_cart,
+                      is_subscribed)
+from api.serializers import (serialize_ingredients_list, serialize_recipe,
+                             serialize_recipes_fields, serialize_recipes_list,
+                             serialize_user_with_recipes)
+from api.utils import BoolOptions
+from benchmarks.results import change, load, metadata, print_baseline, save
+from db.models import (AmountModel, IngredientModel, RecipeModel, TagModel,
+                       UserModel)
+from db.query_capture import DIALECT, CapturingSession, capture_statement
+
+DEFAULT_ITEMS = 100
+DEFAULT_REPEAT = 5
+DEFAULT_NUMBER = 20
+
+
+def run_sync(coroutine: Coroutine) -> Any:
+    '''
+    Runs a coroutine that never suspends, without an event loop.
+    '''
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError('The coroutine suspended')
+
+
+def make_user(user_id: int) -> UserModel:
+    return UserModel(
+        id=user_id, email=f'user{user_id}@example.com', password='-',
+        username=f'user{user_id}', first_name=f'First{user_id}',
+        last_name=f'Last{user_id}', is_subscribed=False)
+
+
+def make_recipe(recipe_id: int, author: UserModel, tags: int,
+                ingredients: int) -> RecipeModel:
+    recipe = RecipeModel(
+        id=recipe_id, name=f'Recipe {recipe_id}', text='Mix and bake. ' * 20,
+        pub_date=datetime(2024, 1, 1), author=author.id, cooking_time=30,
+        image=f'media/recipes/{recipe_id}.png')
+    recipe.tags = [
+        TagModel(id=tag_id, name=f'tag {tag_id}', slug=f'tag-{tag_id}',
+                 color=f'#{tag_id:06x}')
+        for tag_id in range(1, tags + 1)]
+    recipe.ingredients = [
+        AmountModel(
+            ingredient_id=ingredient_id, amount=ingredient_id * 10,
+            ingredient=IngredientModel(
+                id=ingredient_id, name=f'ingredient {ingredient_id}',
+                measurement_unit='g'))
+        for ingredient_id in range(1, ingredients + 1)]
+    return recipe
+
+
+def measure(func: Callable[[], Any], items: int, repeat: int,
+            number: int) -> dict:
+    func()  # warms up lru caches and SQLAlchemy's memoized attributes
+
+    best = min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'us_per_call': best * 1e6,
+        'us_per_item': best * 1e6 / items,
+        'peak_bytes_per_item': (peak - before) / items,
+    }
+
+
+def serializer_benchmarks(args: argparse.Namespace) -> dict:
+    authors = [make_user(user_id) for user_id in range(1, 11)]
+    recipes = [
+        make_recipe(recipe_id, authors[recipe_id % len(authors)],
+                    args.tags, args.ingredients)
+        for recipe_id in range(1, args.items + 1)]
+    rows = [(recipe, authors[recipe.id % len(authors)], False, True)
+            for recipe in recipes]
+    ingredients = [amount.ingredient
+                   for recipe in recipes for amount in recipe.ingredients]
+    subscriptions = [(author, recipes[:6], 42) for author in authors]
+    fields = ('id', 'name', 'image', 'cooking_time', 'author')
+
+    cases = {
+        'serialize_recipes_list': (
+            lambda: run_sync(serialize_recipes_list(rows)), len(rows)),
+        'serialize_recipes_fields': (
+            lambda: run_sync(serialize_recipes_fields(rows, fields)),
+            len(rows)),
+        'serialize_recipe': (
+            lambda: run_sync(serialize_recipe(*rows[0])), 1),
+        'serialize_user_with_recipes': (
+            lambda: [serialize_user_with_recipes(*subscription)
+                     for subscription in subscriptions],
+            len(subscriptions)),
+        'serialize_ingredients_list': (
+            lambda: serialize_ingredients_list(ingredients),
+            len(ingredients)),
+    }
+    return {
+        name: measure(func, items, args.repeat, args.number)
+        for name, (func, items) in cases.items()
+    }
+
+
+DAL_CASES: dict[str, Callable[[CapturingSession], Coroutine]] = {
+    'get_recipes_from_db': lambda session: get_recipes_from_db(
+        session, None, 1, None, None, None, None),
+    'get_recipes_from_db_filtered': lambda session: get_recipes_from_db(
+        session, None, 1, 2, ['breakfast', 'dinner'], BoolOptions.true,
+        BoolOptions.false),
+    'get_single_recipe_from_db': lambda session: get_single_recipe_from_db(
+        1, session, None, 1),
+    'get_recipe_validators': lambda session: get_recipe_validators(
+        session, 1, 1),
+    'get_recipes_list_validators': lambda session: (
+        get_recipes_list_validators(session, 1, None, None, None, None)),
+    'get_recipes_by_user_id': lambda session: get_recipes_by_user_id(
+        1, session, 6),
+    'get_user_subscriptions': lambda session: get_user_subscriptions(
+        1, session, 6),
+    'get_users_page': lambda session: get_users_page(session, 100, 10),
+    'get_shopping_cart': lambda session: get_shopping_cart(
+        session, None, 1),
+    'is_recipe_in_favorite': lambda session: is_recipe_in_favorite(
+        session, 1, 1),
+    'is_recipe_in_shopping_cart': lambda session: (
+        is_recipe_in_shopping_cart(session, 1, 1)),
+    'is_subscribed': lambda session: is_subscribed(session, 1, 2),
+}
+
+
+def dal_benchmarks(args: argparse.Namespace) -> dict:
+    results = {}
+    for name, call in DAL_CASES.items():
+        statement = capture_statement(call)
+        results[name] = {
+            'build': measure(lambda: capture_statement(call), 1,
+                             args.repeat, args.number),
+            'cache_key': measure(statement._generate_cache_key, 1,
+                                 args.repeat, args.number),
+            'compile': measure(lambda: statement.compile(dialect=DIALECT),
+                               1, args.repeat, args.number),
+        }
+    return results
+
+
+def print_results(results: dict) -> None:
+    for name, result in results['serializers'].items():
+        print(f'{name:32} {result["us_per_item"]:9.1f} us/item  '
+              f'{result["peak_bytes_per_item"]:9.0f} B/item',
+              file=sys.stderr)
+    for name, steps in results['dals'].items():
+        timings = '  '.join(f'{step} {result["us_per_call"]:8.1f} us'
+                            for step, result in steps.items())
+        print(f'{name:32} {timings}', file=sys.stderr)
+
+
+def compare(results: dict, baseline: dict) -> None:
+    print_baseline(baseline)
+    for name, result in results['serializers'].items():
+        before = baseline['serializers'].get(name)
+        if before is not None:
+            print(f'{name:32} time '
+                  f'{change(before["us_per_item"], result["us_per_item"])}  '
+                  'memory ' + change(before['peak_bytes_per_item'],
+                                     result['peak_bytes_per_item']),
+                  file=sys.stderr)
+    for name, steps in results['dals'].items():
+        before = baseline['dals'].get(name)
+        if before is not None:
+            changes = '  '.join(
+                f'{step} ' + change(before[step]['us_per_call'],
+                                    result['us_per_call'])
+                for step, result in steps.items())
+            print(f'{name:32} {changes}', file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmark serializers and DAL query construction.')
+    parser.add_argument('--items', type=int, default=DEFAULT_ITEMS,
+                        help='recipes in the serializer fixtures')
+    parser.add_argument('--tags', type=int, default=3,
+                        help='tags per recipe')
+    parser.add_argument('--ingredients', type=int, default=10,
+                        help='ingredients per recipe')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='timing runs, the best one is reported')
+    parser.add_argument('--number', type=int, default=DEFAULT_NUMBER,
+                        help='calls per timing run')
+    parser.add_argument('--output', help='file to save the results to')
+    parser.add_argument('--baseline',
+                        help='results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    results = {
+        'meta': metadata(args),
+        'serializers': serializer_benchmarks(args),
+        'dals': dal_benchmarks(args),
+    }
+    print_results(results)
+
+    if args.output:
+        save(args.output, results)
+    if args.baseline:
+        compare(results, load(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
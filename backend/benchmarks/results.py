@@ -0,0 +1,44 @@
+import json
+import subprocess
+import sys
+from datetime import datetime
+from typing import Optional
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'), capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(args) -> dict:
+    return {
+        'timestamp': datetime.utcnow().isoformat(),
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'args': {name: value for name, value in vars(args).items()
+                 if name not in ('output', 'baseline')},
+    }
+
+
+def save(path: str, results: dict) -> None:
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+
+
+def load(path: str) -> dict:
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def change(old: float, new: float) -> str:
+    return f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+
+
+def print_baseline(baseline: dict) -> None:
+    meta = baseline['meta']
+    print(f'Compared with {meta.get("revision")} ({meta["timestamp"]}):',
+          file=sys.stderr)
@@ -0,0 +1,67 @@
+import asyncio
+from contextlib import AsyncExitStack
+
+import asyncpg
+import httpx
+import pytest
+
+from api.main import app
+from db.bulk import connect
+from db.synthetic import SYNTHETIC_PASSWORD
+from settings import DB
+
+
+@pytest.fixture(scope='session')
+def loop():
+    # one loop for the whole run, pooled connections are bound to it
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope='session')
+def run(loop):
+    return loop.run_until_complete
+
+
+@pytest.fixture(scope='session')
+def database(run):
+    '''
+    A connection to the database in POSTGRES_URL, migrated and filled by
+    db.synthetic. Tests using it are skipped when none is configured.
+    '''
+    if not DB:
+        pytest.skip('POSTGRES_DB is not set')
+    try:
+        connection = run(connect())
+    except (OSError, asyncpg.PostgresError) as error:
+        pytest.skip(f'Cannot connect to the database: {error}')
+    yield connection
+    run(connection.close())
+
+
+@pytest.fixture(scope='session')
+def client(run, database):
+    async def open_client(stack: AsyncExitStack) -> httpx.AsyncClient:
+        await stack.enter_async_context(app.router.lifespan_context(app))
+        return await stack.enter_async_context(httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url='http://test'))
+
+    stack = AsyncExitStack()
+    yield run(open_client(stack))
+    run(stack.aclose())
+
+
+@pytest.fixture(scope='session')
+def log_in(run, client):
+    '''
+    Returns the Authorization headers of a synthetic user, by email.
+    '''
+    def log_in(email: str) -> dict:
+        response = run(client.post('/api/auth/token/login', data={
+            'username': email, 'password': SYNTHETIC_PASSWORD}))
+        response.raise_for_status()
+        return {
+            'Authorization': f'Bearer {response.json()["access_token"]}'}
+
+    return log_in
@@ -0,0 +1,172 @@
+import csv
+import io
+import json
+import sys
+import time
+from contextlib import asynccontextmanager
+from itertools import islice
+from typing import IO, Any, AsyncIterator, Iterable, Iterator, Optional
+
+import asyncpg
+from sqlalchemy.engine import make_url
+
+from db.invalidation import CHANNEL
+from settings import POSTGRES_URL
+
+JSON_READ_SIZE = 64 * 1024
+NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+
+def asyncpg_dsn(url: str = POSTGRES_URL) -> str:
+    return make_url(url).set(drivername='postgresql').render_as_string(
+        hide_password=False)
+
+
+async def connect(url: str = POSTGRES_URL) -> asyncpg.Connection:
+    return await asyncpg.connect(asyncpg_dsn(url))
+
+
+@asynccontextmanager
+async def invalidating_once(connection: asyncpg.Connection,
+                            tables: Iterable[str],
+                            entities: Iterable[str]) -> AsyncIterator[None]:
+    '''
+    Disables the row level cache invalidation triggers of `tables` and
+    announces every entity in `entities` as a whole instead, so that a bulk
+    write sends a few notifications rather than one per row. Must be used
+    inside a transaction: the tables stay locked and the notifications
+    are only delivered once it commits.
+    '''
+    tables = list(tables)
+    for table in tables:
+        await connection.execute(f'ALTER TABLE {table} DISABLE TRIGGER USER')
+    yield
+    for table in tables:
+        await connection.execute(f'ALTER TABLE {table} ENABLE TRIGGER USER')
+    for entity in entities:
+        await connection.execute(
+            'SELECT pg_notify($1, $2)', CHANNEL, f'{entity}:')
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_json_array(file: IO[str]) -> Iterator[Any]:
+    '''
+    Yields the items of a top-level JSON array one by one, reading the
+    file in JSON_READ_SIZE chunks instead of loading it whole.
+    '''
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+
+    def fill() -> None:
+        nonlocal buffer, position, eof
+        chunk = file.read(JSON_READ_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def skip_whitespace() -> None:
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if buffer[position:position + 1] != '[':
+        raise ValueError('Expected a JSON array')
+    position += 1
+
+    skip_whitespace()
+    if buffer[position:position + 1] == ']':
+        return
+
+    while True:
+        skip_whitespace()
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        # a number may be cut off at the chunk boundary
+        if not eof and (end == len(buffer) or (
+                isinstance(item, (int, float))
+                and buffer[end] in NUMBER_CHARS)):
+            fill()
+            continue
+        position = end
+        yield item
+
+        skip_whitespace()
+        separator = buffer[position:position + 1]
+        position += 1
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f'Unexpected {separator!r} in JSON array')
+
+
+def iter_records(file: IO[str], file_format: str) -> Iterator[dict]:
+    if file_format == 'csv':
+        yield from csv.DictReader(file)
+    elif file_format == 'ndjson':
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+    elif file_format == 'json':
+        yield from iter_json_array(file)
+    else:
+        raise ValueError(f'Unknown format: {file_format}')
+
+
+def guess_format(path: str) -> str:
+    for suffix, file_format in (('.csv', 'csv'), ('.ndjson', 'ndjson'),
+                                ('.jsonl', 'ndjson'), ('.json', 'json')):
+        if path.endswith(suffix):
+            return file_format
+    raise ValueError(f'Cannot guess the format of {path}, pass --format')
+
+
+def open_input(path: str) -> IO[str]:
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    return open(path, encoding='utf-8', newline='')
+
+
+class Progress:
+    '''
+    Prints a running count with throughput to stderr, at most once per
+    `interval` seconds.
+    '''
+    def __init__(self, label: str, total: Optional[int] = None,
+                 interval: float = 1.0):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.count = 0
+        self._started = time.monotonic()
+        self._reported = 0.0
+
+    def advance(self, count: int) -> None:
+        self.count += count
+        now = time.monotonic()
+        if now - self._reported >= self.interval:
+            self._reported = now
+            self._print(now)
+
+    def finish(self) -> None:
+        self._print(time.monotonic(), end='\n')
+
+    def _print(self, now: float, end: str = '\r') -> None:
+        elapsed = max(now - self._started, 1e-9)
+        done = f'{self.count}/{self.total}' if self.total else str(self.count)
+        print(f'{self.label}: {done} rows, {self.count / elapsed:.0f} rows/s',
+              end=end, file=sys.stderr, flush=True)
@@ -0,0 +1,180 @@
+'''
+Loads ingredients or tags from CSV, NDJSON or a JSON array into Postgres.
+
+    python -m db.catalog_import ingredients ingredients.csv
+    python -m db.catalog_import tags tags.json --batch-size 5000
+
+Records are streamed in batches with COPY into a temporary staging table
+and merged in the same transaction with INSERT ... ON CONFLICT (name), so
+memory use does not depend on the file size and a failed import changes
+nothing. Rows whose values did not change are left untouched.
+
+Records that would break a constraint (no name, a slug or color in the
+wrong format or already used by another tag) are reported by their
+position in the file and skipped, the rest is imported. The cache is
+invalidated with a single notification for the whole catalog.
+'''
+import argparse
+import asyncio
+import sys
+
+import asyncpg
+from sqlalchemy import Table
+
+from db.bulk import (Progress, batched, connect, guess_format,
+                     invalidating_once, iter_records, open_input)
+from db.models import IngredientModel, TagModel
+
+DEFAULT_BATCH_SIZE = 10000
+
+# target table and its columns, the first one being the unique `name`
+CATALOGS = {
+    'ingredients': (IngredientModel.__table__, ('name', 'measurement_unit')),
+    'tags': (TagModel.__table__, ('name', 'slug', 'color')),
+}
+
+# formats checked by the model validators, which COPY bypasses
+PATTERNS = {
+    'slug': '^[-a-zA-Z0-9_]+$',
+    'color': '^#[a-f0-9]{6}$',
+}
+
+
+def to_row(record: dict, columns: tuple[str, ...]) -> tuple:
+    values = (record.get(column) for column in columns)
+    return tuple(None if value is None else str(value) for value in values)
+
+
+def superseded_query(staging: str) -> str:
+    # only the last occurrence of a duplicated name is imported
+    return f'''
+        DELETE FROM {staging} s
+        USING {staging} later
+        WHERE later.name = s.name AND later.row_number > s.row_number
+    '''
+
+
+def rejects_query(table: Table, staging: str,
+                  columns: tuple[str, ...]) -> str:
+    problems = ["WHEN coalesce(s.name, '') = '' THEN 'missing name'"]
+    for column in columns:
+        problems.append(
+            f'WHEN length(s.{column}) > {table.c[column].type.length} '
+            f"THEN '{column} is too long'")
+        if column in PATTERNS:
+            problems.append(f"WHEN s.{column} !~ '{PATTERNS[column]}' "
+                            f"THEN 'invalid {column}'")
+    unique = [column for column in columns[1:] if table.c[column].unique]
+    for column in unique:
+        problems.append(
+            f'WHEN EXISTS (SELECT 1 FROM {staging} o '
+            f'WHERE o.{column} = s.{column} AND o.name <> s.name) '
+            f"THEN 'duplicate {column} in the file'")
+        problems.append(
+            f'WHEN EXISTS (SELECT 1 FROM {table.name} t '
+            f'WHERE t.{column} = s.{column} AND t.name <> s.name) '
+            f"THEN '{column} used by another row'")
+    cases = '\n'.join(problems)
+    return f'''
+        WITH checked AS (
+            SELECT s.row_number, CASE {cases} END AS problem
+            FROM {staging} s
+        )
+        DELETE FROM {staging} s
+        USING checked
+        WHERE checked.row_number = s.row_number
+          AND checked.problem IS NOT NULL
+        RETURNING s.row_number, checked.problem
+    '''
+
+
+def merge_query(table: str, staging: str, columns: tuple[str, ...]) -> str:
+    column_list = ', '.join(columns)
+    updates = ', '.join(f'{column} = EXCLUDED.{column}'
+                        for column in columns[1:])
+    changed = ' OR '.join(f'{table}.{column} IS DISTINCT FROM '
+                          f'EXCLUDED.{column}' for column in columns[1:])
+    # counted in SQL rather than by fetching a row per merged record
+    return f'''
+        WITH merged AS (
+            INSERT INTO {table} ({column_list})
+            SELECT {column_list} FROM {staging}
+            ON CONFLICT (name) DO UPDATE
+            SET {updates}, updated_at = timezone('utc', now())
+            WHERE {changed}
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted) AS inserted,
+               count(*) FILTER (WHERE NOT inserted) AS updated
+        FROM merged
+    '''
+
+
+async def import_catalog(
+    catalog: str,
+    path: str,
+    file_format: str,
+        batch_size: int) -> tuple[int, int, list[asyncpg.Record]]:
+    '''
+    Returns the number of inserted and updated rows, and the skipped
+    records as (row_number, problem), row_number counting from 1.
+    '''
+    table, columns = CATALOGS[catalog]
+    staging = f'staging_{table.name}'
+    progress = Progress(f'Copying {catalog}')
+
+    connection = await connect()
+    try:
+        async with connection.transaction():
+            # row_number keeps the last occurrence of a duplicated name
+            column_types = ', '.join(f'{column} text' for column in columns)
+            await connection.execute(f'''
+                CREATE TEMPORARY TABLE {staging}
+                ({column_types}, row_number bigserial)
+                ON COMMIT DROP
+            ''')
+
+            with open_input(path) as file:
+                records = (to_row(record, columns)
+                           for record in iter_records(file, file_format))
+                for batch in batched(records, batch_size):
+                    await connection.copy_records_to_table(
+                        staging, records=batch, columns=columns)
+                    progress.advance(len(batch))
+            progress.finish()
+
+            await connection.execute(superseded_query(staging))
+            rejected = await connection.fetch(
+                rejects_query(table, staging, columns))
+            async with invalidating_once(
+                    connection, [table.name], [table.name]):
+                merged = await connection.fetchrow(
+                    merge_query(table.name, staging, columns))
+    finally:
+        await connection.close()
+
+    return (merged['inserted'], merged['updated'],
+            sorted(rejected, key=lambda row: row['row_number']))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Import ingredients or tags into the catalog.')
+    parser.add_argument('catalog', choices=sorted(CATALOGS))
+    parser.add_argument('path', help='input file, "-" for stdin')
+    parser.add_argument('--format', choices=('csv', 'ndjson', 'json'),
+                        help='guessed from the file extension by default')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    file_format = args.format or guess_format(args.path)
+    inserted, updated, rejected = asyncio.run(import_catalog(
+        args.catalog, args.path, file_format, args.batch_size))
+    for row_number, problem in rejected:
+        print(f'Skipping record {row_number}: {problem}', file=sys.stderr)
+    print(f'{args.catalog}: {inserted} inserted, {updated} updated, '
+          f'{len(rejected)} skipped', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from typing import Callable, Optional
+
+import asyncpg
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from db.models import AmountModel
+from settings import INVALIDATION_LISTEN_URL, INVALIDATION_RECONNECT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Must match the channel used by notify_cache_invalidation() in migrations
+CHANNEL = 'cache_invalidation'
+
+# Entity name passed to subscribers when every cached value must be dropped
+ALL = '*'
+
+KEEPALIVE_SECONDS = 30
+
+Subscriber = Callable[[str, str], None]
+
+
+def _entity_key(instance) -> Optional[tuple[str, str]]:
+    if isinstance(instance, AmountModel):
+        return 'recipes', str(instance.recipe_id)
+    instance_id = getattr(instance, 'id', None)
+    if instance_id is None:
+        return None
+    return instance.__tablename__, str(instance_id)
+
+
+class InvalidationBus:
+    '''
+    Delivers "<entity>:<id>" invalidation events to in-process caches.
+
+    Rows changed in any worker (or by hand, or by an import script) are
+    announced by triggers with NOTIFY on CHANNEL, and every worker LISTENs
+    on a dedicated connection. ORM changes committed by this worker are
+    also dispatched right after commit, without waiting for the round
+    trip through Postgres.
+    '''
+    def __init__(self, listen_url: str):
+        url = make_url(listen_url)
+        self._dsn = url.set(drivername='postgresql').render_as_string(
+            hide_password=False)
+        self._subscribers: list[Subscriber] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, subscriber: Subscriber) -> None:
+        self._subscribers.append(subscriber)
+
+    def dispatch(self, entity: str, key: str = '') -> None:
+        for subscriber in self._subscribers:
+            try:
+                subscriber(entity, key)
+            except Exception:
+                logger.exception('Cache invalidation subscriber failed')
+
+    def dispatch_payload(self, payload: str) -> None:
+        entity, _, key = payload.partition(':')
+        self.dispatch(entity, key)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _on_notification(self, connection, pid, channel, payload) -> None:
+        self.dispatch_payload(payload)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                await self._listen_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Cache invalidation listener failed')
+            await asyncio.sleep(INVALIDATION_RECONNECT_SECONDS)
+
+    async def _listen_once(self) -> None:
+        connection = await asyncpg.connect(self._dsn)
+        terminated = asyncio.Event()
+        connection.add_termination_listener(lambda _: terminated.set())
+        try:
+            await connection.add_listener(CHANNEL, self._on_notification)
+            # anything may have changed while nobody was listening
+            self.dispatch(ALL)
+
+            while not terminated.is_set():
+                try:
+                    await asyncio.wait_for(
+                        terminated.wait(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    await connection.execute('SELECT 1')
+        finally:
+            if not connection.is_closed():
+                await connection.close()
+
+
+invalidation_bus = InvalidationBus(INVALIDATION_LISTEN_URL)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_invalidations(session, flush_context):
+    invalidations = session.info.setdefault('invalidations', set())
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        entity_key = _entity_key(instance)
+        if entity_key is not None:
+            invalidations.add(entity_key)
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_invalidations(session):
+    for entity, key in session.info.pop('invalidations', ()):
+        invalidation_bus.dispatch(entity, key)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _drop_invalidations(session, previous_transaction):
+    session.info.pop('invalidations', None)
@@ -0,0 +1,26 @@
+"""username prefix index
+
+Revision ID: 4b1e6f0c2a7d
+Revises: 9992cb800d49
+Create Date: 2026-10-19 10:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '4b1e6f0c2a7d'
+down_revision: Union[str, None] = '9992cb800d49'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'username_prefix_index', 'users', ['username'], unique=False,
+        postgresql_ops={'username': 'varchar_pattern_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('username_prefix_index', table_name='users')
@@ -0,0 +1,25 @@
+"""users email index
+
+Revision ID: a7e3c9d2f5b1
+Revises: f1c4d2a9b7e3
+Create Date: 2026-10-19 19:05:37.214683
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7e3c9d2f5b1'
+down_revision: Union[str, None] = 'f1c4d2a9b7e3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'users_email_index', 'users', ['email'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('users_email_index', table_name='users')
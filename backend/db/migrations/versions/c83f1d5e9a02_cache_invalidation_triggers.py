@@ -0,0 +1,63 @@
+"""cache invalidation triggers
+
+Revision ID: c83f1d5e9a02
+Revises: 4b1e6f0c2a7d
+Create Date: 2026-10-19 14:37:05.902117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c83f1d5e9a02'
+down_revision: Union[str, None] = '4b1e6f0c2a7d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# table: (entity announced in the payload, column holding its id)
+NOTIFYING_TABLES = {
+    'recipes': ('recipes', 'id'),
+    'amounts': ('recipes', 'recipe_id'),
+    'recipe_tag_association': ('recipes', 'recipe_id'),
+    'users': ('users', 'id'),
+    'tags': ('tags', 'id'),
+    'ingredients': ('ingredients', 'id'),
+}
+
+
+def upgrade() -> None:
+    op.execute('''
+        CREATE OR REPLACE FUNCTION notify_cache_invalidation()
+        RETURNS trigger AS $$
+        DECLARE
+            changed_row jsonb;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                changed_row := to_jsonb(OLD);
+            ELSE
+                changed_row := to_jsonb(NEW);
+            END IF;
+            PERFORM pg_notify(
+                'cache_invalidation',
+                TG_ARGV[0] || ':' || (changed_row ->> TG_ARGV[1]));
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    ''')
+
+    for table, (entity, id_column) in NOTIFYING_TABLES.items():
+        op.execute(f'''
+            CREATE TRIGGER {table}_cache_invalidation
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW
+            EXECUTE FUNCTION notify_cache_invalidation(
+                '{entity}', '{id_column}');
+        ''')
+
+
+def downgrade() -> None:
+    for table in NOTIFYING_TABLES:
+        op.execute(
+            f'DROP TRIGGER IF EXISTS {table}_cache_invalidation ON {table};')
+    op.execute('DROP FUNCTION IF EXISTS notify_cache_invalidation();')
@@ -0,0 +1,38 @@
+"""updated_at columns
+
+Revision ID: e5a9273bd614
+Revises: c83f1d5e9a02
+Create Date: 2026-10-19 16:02:48.551730
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a9273bd614'
+down_revision: Union[str, None] = 'c83f1d5e9a02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('users', 'ingredients', 'tags', 'recipes')
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        op.add_column(table, sa.Column(
+            'updated_at', sa.DateTime(), nullable=False,
+            server_default=sa.text("timezone('utc', now())")))
+        op.create_index(
+            op.f(f'ix_{table}_updated_at'), table, ['updated_at'],
+            unique=False)
+
+    op.execute('UPDATE recipes SET updated_at = pub_date '
+               'WHERE pub_date IS NOT NULL')
+
+
+def downgrade() -> None:
+    for table in reversed(TABLES):
+        op.drop_index(op.f(f'ix_{table}_updated_at'), table_name=table)
+        op.drop_column(table, 'updated_at')
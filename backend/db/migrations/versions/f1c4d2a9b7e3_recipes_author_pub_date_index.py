@@ -0,0 +1,26 @@
+"""recipes author pub_date index
+
+Revision ID: f1c4d2a9b7e3
+Revises: e5a9273bd614
+Create Date: 2026-10-19 16:40:12.527391
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1c4d2a9b7e3'
+down_revision: Union[str, None] = 'e5a9273bd614'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'recipes_author_pub_date_index', 'recipes', ['author', 'pub_date'],
+        unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('recipes_author_pub_date_index', table_name='recipes')
@@ -3,12 +3,23 @@ from datetime import datetime
 
 from sqlalchemy import (Boolean, CheckConstraint, Column, DateTime, ForeignKey,
                         Index, Integer, SmallInteger, String, Table, Text,
-                        UniqueConstraint)
+                        UniqueConstraint, text)
 from sqlalchemy.orm import declarative_base, relationship, validates
 
 Base = declarative_base()
 
 
+def updated_at_column() -> Column:
+    return Column(
+        DateTime,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=text("timezone('utc', now())"),
+        nullable=False,
+        index=True
+    )
+
+
 recipe_tag_association = Table(
     'recipe_tag_association',
     Base.metadata,
@@ -59,6 +70,7 @@ class UserModel(Base):
     first_name = Column(String(150), nullable=False)
     last_name = Column(String(150), nullable=False)
     is_subscribed = Column(Boolean(), default=False)
+    updated_at = updated_at_column()
     recipes = relationship(
         'RecipeModel', back_populates='author_relation',
         lazy='selectin', order_by='desc(RecipeModel.pub_date)')
@@ -83,6 +95,7 @@ class IngredientModel(Base):
     id = Column(Integer, autoincrement=True, primary_key=True)
     name = Column(String(200), unique=True)
     measurement_unit = Column(String(200))
+    updated_at = updated_at_column()
     recipes = relationship('AmountModel', back_populates='ingredient')
 
 
@@ -93,6 +106,7 @@ class TagModel(Base):
     name = Column(String(200), unique=True)
     slug = Column(String(200), unique=True)
     color = Column(String(7), unique=True)
+    updated_at = updated_at_column()
     recipes = relationship(
         'RecipeModel', secondary=recipe_tag_association, back_populates='tags')
 
@@ -117,6 +131,7 @@ class RecipeModel(Base):
     name = Column(String(200), nullable=False)
     text = Column(Text, nullable=False)
     pub_date = Column(DateTime, default=datetime.utcnow)
+    updated_at = updated_at_column()
     author = Column(
         Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     ingredients = relationship('AmountModel',
@@ -153,3 +168,9 @@ class AmountModel(Base):
 
 
 name_index = Index('name_index', IngredientModel.name)
+username_prefix_index = Index(
+    'username_prefix_index', UserModel.username,
+    postgresql_ops={'username': 'varchar_pattern_ops'})
+recipes_author_pub_date_index = Index(
+    'recipes_author_pub_date_index', RecipeModel.author, RecipeModel.pub_date)
+users_email_index = Index('users_email_index', UserModel.email)
@@ -0,0 +1,79 @@
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from metrics import Counter, Gauge, Histogram
+
+POOL_CHECKOUT_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds',
+    'Time spent waiting for a connection from the pool, by engine.',
+    ('engine',),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+             5.0, 30.0))
+POOL_OVERFLOW_CHECKOUTS = Counter(
+    'db_pool_overflow_checkouts_total',
+    'Checkouts that had to open an overflow connection, by engine.',
+    ('engine',))
+POOL_TIMEOUTS = Counter(
+    'db_pool_timeouts_total',
+    'Checkouts that gave up after the pool timeout, by engine.',
+    ('engine',))
+POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'Pool connections by engine and state.',
+    ('engine', 'state'))
+
+_engines: dict[str, AsyncEngine] = {}
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    '''
+    Records checkout waits, overflows and timeouts under `engine_name`,
+    which create_engine() passes through from its own keyword arguments.
+    '''
+    def __init__(self, creator, engine_name: str = 'default', **kwargs):
+        super().__init__(creator, **kwargs)
+        self.engine_name = engine_name
+
+    def recreate(self) -> 'InstrumentedQueuePool':
+        pool = super().recreate()
+        pool.engine_name = self.engine_name
+        return pool
+
+    def _do_get(self):
+        overflow_before = self._overflow
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            POOL_TIMEOUTS.inc(engine=self.engine_name)
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.observe(
+                time.perf_counter() - start, engine=self.engine_name)
+
+        if self._overflow > max(overflow_before, 0):
+            POOL_OVERFLOW_CHECKOUTS.inc(engine=self.engine_name)
+
+        return connection
+
+
+def _connections_by_state() -> dict:
+    connections = {}
+    for name, engine in _engines.items():
+        pool = engine.pool
+        connections.update({
+            (name, 'size'): pool.size(),
+            (name, 'checked_in'): pool.checkedin(),
+            (name, 'checked_out'): pool.checkedout(),
+            (name, 'overflow'): max(pool.overflow(), 0),
+        })
+    return connections
+
+
+POOL_CONNECTIONS.set_function(_connections_by_state)
+
+
+def register_pool_metrics(name: str, engine: AsyncEngine) -> None:
+    _engines[name] = engine
@@ -0,0 +1,58 @@
+'''
+Captures the first statement a DAL function runs, without a database:
+the function gets a stand-in session that stops it there. Used by the
+micro-benchmarks and by the query plan checks.
+'''
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy.dialects.postgresql.asyncpg import PGDialect_asyncpg
+
+DIALECT = PGDialect_asyncpg()
+
+
+class StatementCaptured(Exception):
+    def __init__(self, statement, params):
+        super().__init__()
+        self.statement = statement
+        self.params = params
+
+
+class CapturingSession:
+    '''
+    Stands in for AsyncSession and raises with the first statement the
+    DAL function tries to run, and the parameters it passes.
+    '''
+    async def execute(self, statement, params=None, *args, **kwargs):
+        raise StatementCaptured(statement, params or {})
+
+    stream = stream_scalars = execute
+
+
+def capture_query(
+        call: Callable[[CapturingSession], Awaitable]) -> StatementCaptured:
+    '''
+    Runs `call` up to its first statement. Streaming DAL functions are
+    async generators: pass anext() of them.
+    '''
+    awaitable = call(CapturingSession())
+    try:
+        awaitable.send(None)
+    except StatementCaptured as captured:
+        return captured
+    finally:
+        awaitable.close()
+    raise RuntimeError('No statement was executed')
+
+
+def capture_statement(call: Callable[[CapturingSession], Awaitable]) -> Any:
+    return capture_query(call).statement
+
+
+def render_statement(captured: StatementCaptured) -> str:
+    '''
+    Compiles a captured statement with its parameters inlined, as it
+    would run, for EXPLAIN.
+    '''
+    statement = captured.statement.params(captured.params)
+    return str(statement.compile(
+        dialect=DIALECT, compile_kwargs={'literal_binds': True}))
@@ -0,0 +1,127 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine.interfaces import CacheStats
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from metrics import record_cache_lookups
+from settings import DUPLICATE_QUERY_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+_collectors: ContextVar[tuple] = ContextVar('query_collectors', default=())
+
+_PARAM_RE = re.compile(r'\$\d+|%\(\w+\)s|\?')
+_PARAM_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+def statement_shape(statement: str) -> str:
+    '''
+    Reduces a statement to its shape: placeholders are unified and
+    expanded IN lists are collapsed, so the same query issued with a
+    different number of ids is still counted as a duplicate.
+    '''
+    shape = _PARAM_RE.sub('?', statement)
+    shape = _PARAM_LIST_RE.sub('(?)', shape)
+    return ' '.join(shape.split())
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes: Counter = Counter()
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.duration += duration
+        self.shapes[statement_shape(statement)] += 1
+
+    @property
+    def duplicates(self) -> dict[str, int]:
+        return {
+            shape: count for shape, count in self.shapes.items() if count > 1}
+
+    def server_timing(self) -> str:
+        return (f'db;desc="{self.count} queries";'
+                f'dur={self.duration * 1000:.2f}')
+
+    def report_duplicates(self, label: str) -> None:
+        for shape, count in self.duplicates.items():
+            if count >= DUPLICATE_QUERY_THRESHOLD:
+                logger.warning(
+                    'Possible N+1 in %s: statement executed %d times: %s',
+                    label, count, shape)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    stats = QueryStats()
+    token = _collectors.set(_collectors.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _collectors.reset(token)
+
+
+@contextmanager
+def assert_query_budget(max_queries: int) -> Iterator[QueryStats]:
+    '''
+    Fails when the wrapped code (e.g. a request made through an in-process
+    ASGI client) executes more statements than declared.
+    '''
+    with track_queries() as stats:
+        yield stats
+
+    if stats.count > max_queries:
+        statements = '\n'.join(
+            f'{count} x {shape}' for shape, count in stats.shapes.items())
+        raise QueryBudgetExceeded(
+            f'{stats.count} queries executed, budget is {max_queries}:\n'
+            f'{statements}')
+
+
+def _before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_start_time'].pop()
+    for stats in _collectors.get():
+        stats.record(statement, duration)
+
+    # whether SQLAlchemy found the statement in its compiled cache; raw
+    # driver SQL and uncacheable constructs are left out
+    cache_hit = getattr(context, 'cache_hit', None)
+    if cache_hit is CacheStats.CACHE_HIT:
+        record_cache_lookups('sql_compiled', 1, 0)
+    elif cache_hit is CacheStats.CACHE_MISS:
+        record_cache_lookups('sql_compiled', 0, 1)
+
+
+def _handle_error(context):
+    # a failed statement never reaches after_cursor_execute
+    if context.connection is not None:
+        start_times = context.connection.info.get('query_start_time')
+        if start_times:
+            start_times.pop()
+
+
+def install_query_stats(engine: AsyncEngine) -> None:
+    event.listen(
+        engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(
+        engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine.sync_engine, 'handle_error', _handle_error)
@@ -0,0 +1,354 @@
+'''
+Moves recipes between databases as NDJSON, one recipe per line.
+
+    python -m db.recipe_transfer export recipes.ndjson [--embed-images]
+    python -m db.recipe_transfer import recipes.ndjson [--source-media DIR]
+
+Authors are referenced by username, ingredients and tags by name; all of
+them must already exist in the target database (see db.catalog_import).
+Images travel either as paths relative to the media root, copied from
+--source-media on import, or embedded as base64 with --embed-images.
+Either way they are decoded and re-saved with Pillow in a worker pool,
+under a name carrying the new recipe id, and removed again if the chunk
+fails. Without either option the paths are kept as they are.
+
+Recipes are written in chunks, each in its own transaction, with ids
+taken from the recipes sequence up front so that recipes, amounts and
+tags all go in with COPY. The cache invalidation triggers are disabled
+meanwhile and each chunk announces the recipes once. Importing the same
+file twice duplicates the recipes.
+'''
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from typing import IO, Optional
+
+import asyncpg
+from PIL import Image
+
+from db.bulk import (Progress, batched, connect, invalidating_once,
+                     iter_records, open_input)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_IMAGE_WORKERS = 4
+
+EXPORT_QUERY = '''
+    SELECT r.name, r.text, r.cooking_time, r.image, r.pub_date,
+           u.username AS author,
+           COALESCE((
+               SELECT json_agg(json_build_object(
+                          'name', i.name, 'amount', a.amount)
+                      ORDER BY i.name)
+               FROM amounts a JOIN ingredients i ON i.id = a.ingredient_id
+               WHERE a.recipe_id = r.id), '[]') AS ingredients,
+           COALESCE((
+               SELECT json_agg(t.name ORDER BY t.name)
+               FROM recipe_tag_association rt JOIN tags t ON t.id = rt.tag_id
+               WHERE rt.recipe_id = r.id), '[]') AS tags
+    FROM recipes r JOIN users u ON u.id = r.author
+    ORDER BY r.id
+'''
+
+RECIPE_COLUMNS = (
+    'id', 'name', 'text', 'cooking_time', 'image', 'pub_date', 'author')
+
+# tables written on import that have cache invalidation triggers
+TRIGGER_TABLES = ('recipes', 'amounts', 'recipe_tag_association')
+
+
+def read_image(media_root: str, image_path: str) -> str:
+    with open(os.path.join(media_root, image_path), 'rb') as file:
+        return base64.b64encode(file.read()).decode()
+
+
+def imported_image_path(image_path: str, recipe_id: int) -> str:
+    # recipes imported twice must not share, and then overwrite, one file
+    stem, extension = os.path.splitext(image_path)
+    return f'{stem}-{recipe_id}{extension}'
+
+
+def save_image(media_root: str, image_path: str, target_path: str,
+               image_data: Optional[str], source_root: Optional[str]) -> None:
+    if image_data is not None:
+        source = BytesIO(base64.b64decode(image_data))
+    else:
+        source = os.path.join(source_root, image_path)
+
+    target = os.path.join(media_root, target_path)
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    with Image.open(source) as image:
+        image.save(target)
+
+
+async def export_recipes(output: IO[str], batch_size: int, media_root: str,
+                         embed_images: bool, workers: int) -> int:
+    progress = Progress('Exporting recipes')
+    loop = asyncio.get_running_loop()
+
+    connection = await connect()
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            async with connection.transaction():
+                cursor = connection.cursor(EXPORT_QUERY, prefetch=batch_size)
+                batch = []
+                async for row in cursor:
+                    batch.append(row)
+                    if len(batch) == batch_size:
+                        await write_batch(output, batch, loop, executor,
+                                          media_root, embed_images)
+                        progress.advance(len(batch))
+                        batch = []
+                if batch:
+                    await write_batch(output, batch, loop, executor,
+                                      media_root, embed_images)
+                    progress.advance(len(batch))
+    finally:
+        await connection.close()
+
+    progress.finish()
+    return progress.count
+
+
+async def write_batch(output: IO[str], rows: list[asyncpg.Record],
+                      loop: asyncio.AbstractEventLoop,
+                      executor: ThreadPoolExecutor, media_root: str,
+                      embed_images: bool) -> None:
+    images = [None] * len(rows)
+    if embed_images:
+        images = await asyncio.gather(*(
+            loop.run_in_executor(executor, read_image, media_root, r['image'])
+            for r in rows))
+
+    for row, image_data in zip(rows, images):
+        recipe = {
+            'name': row['name'],
+            'text': row['text'],
+            'cooking_time': row['cooking_time'],
+            'image': row['image'],
+            'pub_date': row['pub_date'] and row['pub_date'].isoformat(),
+            'author': row['author'],
+            'ingredients': json.loads(row['ingredients']),
+            'tags': json.loads(row['tags']),
+        }
+        if image_data is not None:
+            recipe['image_data'] = image_data
+        output.write(json.dumps(recipe, ensure_ascii=False) + '\n')
+
+
+class RecipeImporter:
+    def __init__(self, connection: asyncpg.Connection, media_root: str,
+                 source_root: Optional[str], workers: int):
+        self.connection = connection
+        self.media_root = media_root
+        self.source_root = source_root
+        self.executor = ThreadPoolExecutor(workers)
+        self.ingredients: dict[str, int] = {}
+        self.tags: dict[str, int] = {}
+        self.users: dict[str, int] = {}
+        self.skipped: Counter = Counter()
+
+    async def load_catalogs(self) -> None:
+        self.ingredients = dict(await self.connection.fetch(
+            'SELECT name, id FROM ingredients'))
+        self.tags = dict(await self.connection.fetch(
+            'SELECT name, id FROM tags'))
+
+    async def _load_users(self, recipes: list[dict]) -> None:
+        usernames = list({r['author'] for r in recipes} - set(self.users))
+        if usernames:
+            self.users.update(await self.connection.fetch(
+                'SELECT username, id FROM users '
+                'WHERE username = ANY($1::text[])', usernames))
+
+    def _problem(self, recipe: dict) -> Optional[str]:
+        if recipe['author'] not in self.users:
+            return 'unknown author'
+        if any(i['name'] not in self.ingredients
+               for i in recipe['ingredients']):
+            return 'unknown ingredient'
+        if any(tag not in self.tags for tag in recipe['tags']):
+            return 'unknown tag'
+        return None
+
+    async def _save_images(
+        self,
+            recipes: list[tuple[int, dict]]) -> list[tuple[int, dict]]:
+        '''
+        Saves the images of (recipe_id, recipe) pairs under their new
+        paths, set as recipe['image'], and drops the recipes whose image
+        cannot be read.
+        '''
+        loop = asyncio.get_running_loop()
+        targets = [imported_image_path(r['image'], recipe_id)
+                   for recipe_id, r in recipes]
+        results = await asyncio.gather(*(
+            loop.run_in_executor(
+                self.executor, save_image, self.media_root, r['image'],
+                target, r.get('image_data'), self.source_root)
+            for (_, r), target in zip(recipes, targets)),
+            return_exceptions=True)
+
+        processed = []
+        for (recipe_id, recipe), target, result in zip(
+                recipes, targets, results):
+            if isinstance(result, Exception):
+                print(f'Skipping "{recipe["name"]}": {result}',
+                      file=sys.stderr)
+                self.skipped['bad image'] += 1
+            else:
+                recipe['image'] = target
+                processed.append((recipe_id, recipe))
+        return processed
+
+    def _remove_images(self, recipes: list[tuple[int, dict]]) -> None:
+        for _, recipe in recipes:
+            try:
+                os.remove(os.path.join(self.media_root, recipe['image']))
+            except FileNotFoundError:
+                pass
+
+    async def import_chunk(self, recipes: list[dict]) -> int:
+        await self._load_users(recipes)
+
+        valid = []
+        for recipe in recipes:
+            problem = self._problem(recipe)
+            if problem is None:
+                valid.append(recipe)
+            else:
+                self.skipped[problem] += 1
+        if not valid:
+            return 0
+
+        # ids come first, they name the saved images
+        ids = await self.connection.fetch(
+            "SELECT nextval(pg_get_serial_sequence('recipes', 'id')) "
+            'FROM generate_series(1, $1)', len(valid))
+        with_ids = [(recipe_id, recipe)
+                    for (recipe_id,), recipe in zip(ids, valid)]
+        saves_images = self.source_root is not None or any(
+            'image_data' in r for r in valid)
+        if saves_images:
+            with_ids = await self._save_images(with_ids)
+        if not with_ids:
+            return 0
+
+        try:
+            await self._write_chunk(with_ids)
+        except BaseException:
+            if saves_images:
+                self._remove_images(with_ids)
+            raise
+
+        return len(with_ids)
+
+    async def _write_chunk(self, recipes: list[tuple[int, dict]]) -> None:
+        recipe_rows, amount_rows, tag_rows = [], [], []
+        for recipe_id, recipe in recipes:
+            pub_date = recipe.get('pub_date')
+            recipe_rows.append((
+                recipe_id, recipe['name'], recipe['text'],
+                recipe['cooking_time'], recipe['image'],
+                datetime.fromisoformat(pub_date) if pub_date else None,
+                self.users[recipe['author']]))
+
+            # the same ingredient listed twice adds up
+            amounts = Counter()
+            for ingredient in recipe['ingredients']:
+                amounts[self.ingredients[ingredient['name']]] += (
+                    ingredient['amount'])
+            amount_rows.extend(
+                (recipe_id, ingredient_id, amount)
+                for ingredient_id, amount in amounts.items())
+
+            tag_rows.extend(
+                (recipe_id, self.tags[tag])
+                for tag in dict.fromkeys(recipe['tags']))
+
+        async with self.connection.transaction():
+            async with invalidating_once(
+                    self.connection, TRIGGER_TABLES, ['recipes']):
+                await self.connection.copy_records_to_table(
+                    'recipes', records=recipe_rows, columns=RECIPE_COLUMNS)
+                await self.connection.copy_records_to_table(
+                    'amounts', records=amount_rows,
+                    columns=('recipe_id', 'ingredient_id', 'amount'))
+                await self.connection.copy_records_to_table(
+                    'recipe_tag_association', records=tag_rows,
+                    columns=('recipe_id', 'tag_id'))
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+
+async def import_recipes(path: str, batch_size: int, media_root: str,
+                         source_root: Optional[str],
+                         workers: int) -> tuple[int, Counter]:
+    progress = Progress('Importing recipes')
+    connection = await connect()
+    importer = RecipeImporter(connection, media_root, source_root, workers)
+    imported = 0
+    try:
+        await importer.load_catalogs()
+        with open_input(path) as file:
+            for chunk in batched(iter_records(file, 'ndjson'), batch_size):
+                imported += await importer.import_chunk(chunk)
+                progress.advance(len(chunk))
+    finally:
+        importer.close()
+        await connection.close()
+
+    progress.finish()
+    return imported, importer.skipped
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Export or import recipes as NDJSON.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export')
+    export_parser.add_argument('path', help='output file, "-" for stdout')
+    export_parser.add_argument('--embed-images', action='store_true')
+
+    import_parser = subparsers.add_parser('import')
+    import_parser.add_argument('path', help='input file, "-" for stdin')
+    import_parser.add_argument(
+        '--source-media', help='media root to copy image files from')
+
+    for subparser in (export_parser, import_parser):
+        subparser.add_argument('--media-root', default='.')
+        subparser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        subparser.add_argument(
+            '--image-workers', type=int, default=DEFAULT_IMAGE_WORKERS)
+
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        output = (sys.stdout if args.path == '-'
+                  else open(args.path, 'w', encoding='utf-8'))
+        with output:
+            exported = asyncio.run(export_recipes(
+                output, args.batch_size, args.media_root,
+                args.embed_images, args.image_workers))
+        print(f'{exported} recipes exported', file=sys.stderr)
+        return
+
+    imported, skipped = asyncio.run(import_recipes(
+        args.path, args.batch_size, args.media_root, args.source_media,
+        args.image_workers))
+    print(f'{imported} recipes imported', file=sys.stderr)
+    for reason, count in sorted(skipped.items()):
+        print(f'{count} skipped: {reason}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,7 @@
-from pydantic import BaseModel, EmailStr, ValidationInfo, field_validator
+from pydantic import (BaseModel, EmailStr, Field, ValidationInfo,
+                      field_validator)
+
+MAX_BULK_ITEMS = 100
 
 # class CustomModel(BaseModel):
 #     model_config = ConfigDict(from_attributes=True)
@@ -81,6 +84,15 @@ class DetailedRecipeSchema(BriefRecipeSchema):
         return value
 
 
+class BulkRecipesSchema(BaseModel):
+    ids: list[int] = Field(min_length=1, max_length=MAX_BULK_ITEMS)
+
+
+class BulkResultSchema(BaseModel):
+    id: int
+    status: str
+
+
 class DetailedUserSchema(BriefUserSchema):
     recipes: list[BriefRecipeSchema]
     recipes_count: int
@@ -1,9 +1,107 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+import asyncio
+import inspect
+import logging
+import time
+from functools import partial
+from itertools import count
+from typing import Awaitable, Callable, Optional
+from uuid import uuid4
+
+from fastapi import Request
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession,
+                                    create_async_engine)
 from sqlalchemy.orm import sessionmaker
 
-from settings import POSTGRES_URL
+from db.pool import InstrumentedQueuePool, register_pool_metrics
+from db.query_stats import install_query_stats
+from db.slow_queries import install_slow_query_log
+from settings import (DB_CONNECT_TIMEOUT, DB_MAX_OVERFLOW, DB_PGBOUNCER_MODE,
+                      DB_POOL_PRE_PING, DB_POOL_RECYCLE, DB_POOL_SIZE,
+                      DB_POOL_TIMEOUT, DB_QUERY_CACHE_SIZE,
+                      DB_STATEMENT_CACHE_SIZE,
+                      POSTGRES_REPLICA_URLS, POSTGRES_URL,
+                      REPLICA_RETRY_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+PRIMARY_STICKY_COOKIE = 'db_primary_until'
+
+
+def _unique_statement_name() -> str:
+    return f'__asyncpg_{uuid4()}__'
+
+
+def get_engine_options() -> dict:
+    connect_args = {
+        'timeout': DB_CONNECT_TIMEOUT,
+        'prepared_statement_cache_size': DB_STATEMENT_CACHE_SIZE,
+    }
+
+    if DB_PGBOUNCER_MODE:
+        connect_args.update({
+            'statement_cache_size': 0,
+            'prepared_statement_cache_size': 0,
+            'prepared_statement_name_func': _unique_statement_name,
+        })
+
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'query_cache_size': DB_QUERY_CACHE_SIZE,
+        'connect_args': connect_args,
+    }
+
+
+def create_instrumented_engine(name: str, url: str) -> AsyncEngine:
+    new_engine = create_async_engine(
+        url, engine_name=name, **get_engine_options())
+    install_query_stats(new_engine)
+    install_slow_query_log(new_engine)
+    register_pool_metrics(name, new_engine)
+    return new_engine
+
+
+class ReplicaSet:
+    '''
+    Hands out replica engines round-robin, skipping the ones that recently
+    failed to connect for REPLICA_RETRY_SECONDS.
+    '''
+    def __init__(self, engines: list[AsyncEngine]):
+        self.engines = engines
+        self._counter = count()
+        self._down_until: dict[int, float] = {}
+
+    def candidates(self) -> list[AsyncEngine]:
+        if not self.engines:
+            return []
+        start = next(self._counter) % len(self.engines)
+        ordered = self.engines[start:] + self.engines[:start]
+        now = time.monotonic()
+        return [
+            replica for replica in ordered
+            if self._down_until.get(id(replica), 0) <= now
+        ]
+
+    def mark_down(self, replica: AsyncEngine) -> None:
+        self._down_until[id(replica)] = (
+            time.monotonic() + REPLICA_RETRY_SECONDS)
+
+
+engine = create_instrumented_engine('primary', POSTGRES_URL)
+read_only_engine = engine.execution_options(postgresql_readonly=True)
+replicas = ReplicaSet([
+    create_instrumented_engine(f'replica_{i}', url)
+    .execution_options(postgresql_readonly=True)
+    for i, url in enumerate(POSTGRES_REPLICA_URLS)
+])
 
-engine = create_async_engine(POSTGRES_URL)
 AsyncSessionLocal = sessionmaker(
     bind=engine,
     class_=AsyncSession,
@@ -12,6 +110,81 @@ AsyncSessionLocal = sessionmaker(
 )
 
 
-async def get_async_session() -> AsyncSession:
-    async with AsyncSessionLocal() as session:
+class LazySession:
+    '''
+    Stands in for an AsyncSession and opens the real one on the first
+    awaited call, so requests answered from cache or rejected before
+    touching the database never check out a connection.
+    '''
+    def __init__(self, open_session: Callable[[], Awaitable[AsyncSession]]):
+        self._open_session = open_session
+        self._session: Optional[AsyncSession] = None
+
+    async def get(self) -> AsyncSession:
+        if self._session is None:
+            self._session = await self._open_session()
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    def __getattr__(self, name: str):
+        if not inspect.iscoroutinefunction(getattr(AsyncSession, name, None)):
+            if self._session is None:
+                raise AttributeError(
+                    f'{name} needs an open session, await get() first')
+            return getattr(self._session, name)
+
+        async def call_on_session(*args, **kwargs):
+            session = await self.get()
+            return await getattr(session, name)(*args, **kwargs)
+
+        return call_on_session
+
+
+def is_sticky_to_primary(request: Request) -> bool:
+    try:
+        sticky_until = float(request.cookies.get(PRIMARY_STICKY_COOKIE, 0))
+    except ValueError:
+        return False
+    return sticky_until > time.time()
+
+
+async def open_read_session(use_replica: bool) -> AsyncSession:
+    '''
+    Opens a session on a replica, falling back to the primary. Either way
+    the session runs in READ ONLY transactions that are never committed.
+    '''
+    for replica in replicas.candidates() if use_replica else []:
+        session = AsyncSessionLocal(bind=replica)
+        try:
+            await session.connection()
+        except (OSError, SQLAlchemyError, asyncio.TimeoutError):
+            logger.warning('Replica %s is unavailable', replica.url,
+                           exc_info=True)
+            replicas.mark_down(replica)
+            await session.close()
+            continue
+        return session
+
+    return AsyncSessionLocal(bind=read_only_engine)
+
+
+async def get_async_session(request: Request) -> AsyncSession:
+    '''
+    Read-only requests get a lazily opened read session on a replica,
+    unless the client wrote recently (see PRIMARY_STICKY_COOKIE).
+    Everything else goes to the primary.
+    '''
+    if request.method not in READ_METHODS:
+        async with AsyncSessionLocal() as session:
+            yield session
+        return
+
+    use_replica = bool(replicas.engines) and not is_sticky_to_primary(request)
+    session = LazySession(partial(open_read_session, use_replica))
+    try:
         yield session
+    finally:
+        await session.close()
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any
+
+import asyncpg
+from sqlalchemy import event
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from db.bulk import asyncpg_dsn
+from db.query_stats import statement_shape
+from metrics import Counter
+from settings import (SLOW_QUERY_EXPLAIN, SLOW_QUERY_EXPLAIN_INTERVAL,
+                      SLOW_QUERY_EXPLAIN_TIMEOUT,
+                      SLOW_QUERY_EXPLAINS_PER_MINUTE, SLOW_QUERY_THRESHOLD)
+
+logger = logging.getLogger(__name__)
+
+MAX_PARAMETER_LENGTH = 200
+MAX_EXPLAINED_SHAPES = 1000
+
+SLOW_QUERIES = Counter(
+    'db_slow_queries_total',
+    'Statements that took longer than SLOW_QUERY_THRESHOLD.')
+
+
+def format_parameters(parameters: Any) -> str:
+    if isinstance(parameters, dict):
+        parameters = parameters.items()
+    elif not isinstance(parameters, (list, tuple)):
+        return repr(parameters)
+    values = []
+    for value in parameters:
+        text = repr(value)
+        if len(text) > MAX_PARAMETER_LENGTH:
+            text = text[:MAX_PARAMETER_LENGTH] + '...'
+        values.append(text)
+    return '(' + ', '.join(values) + ')'
+
+
+class SlowQueryLog:
+    '''
+    Logs statements slower than the threshold with their parameters and,
+    for SELECTs, logs their EXPLAIN (ANALYZE, BUFFERS) run in a read-only
+    transaction on a connection of its own, off the request. The query is
+    really executed again, so each statement shape is explained at most
+    once per explain_interval, and no more than explains_per_minute
+    EXPLAINs run in total.
+    '''
+    def __init__(self, threshold: float, explain: bool,
+                 explain_interval: float, explains_per_minute: int,
+                 explain_timeout: float):
+        self.threshold = threshold
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.explains_per_minute = explains_per_minute
+        self.explain_timeout = explain_timeout
+        self._explained: dict[str, float] = {}
+        self._recent_explains: deque[float] = deque()
+        self._tasks: set[asyncio.Task] = set()
+
+    def record(self, url: URL, statement: str, parameters: Any,
+               duration: float, executemany: bool) -> None:
+        if duration < self.threshold:
+            return
+
+        SLOW_QUERIES.inc()
+        logger.warning('Slow query (%.3fs): %s\nParameters: %s', duration,
+                       statement, format_parameters(parameters))
+
+        if executemany or not self._should_explain(statement):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(
+            self._explain(url, statement, parameters, duration))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _should_explain(self, statement: str) -> bool:
+        if not self.explain or statement.lstrip()[:6].upper() != 'SELECT':
+            return False
+
+        now = time.monotonic()
+        shape = statement_shape(statement)
+        last_explained = self._explained.get(shape, -math.inf)
+        if now - last_explained < self.explain_interval:
+            return False
+
+        while (self._recent_explains
+               and now - self._recent_explains[0] >= 60):
+            self._recent_explains.popleft()
+        if len(self._recent_explains) >= self.explains_per_minute:
+            return False
+
+        if len(self._explained) >= MAX_EXPLAINED_SHAPES:
+            self._explained = {
+                known: explained_at
+                for known, explained_at in self._explained.items()
+                if now - explained_at < self.explain_interval}
+        self._explained[shape] = now
+        self._recent_explains.append(now)
+        return True
+
+    async def _explain(self, url: URL, statement: str, parameters: Any,
+                       duration: float) -> None:
+        if not isinstance(parameters, (list, tuple)):
+            parameters = ()
+        try:
+            connection = await asyncpg.connect(
+                asyncpg_dsn(url), statement_cache_size=0)
+            try:
+                async with connection.transaction(readonly=True):
+                    await connection.execute(
+                        'SET LOCAL statement_timeout = '
+                        f'{int(self.explain_timeout * 1000)}')
+                    rows = await connection.fetch(
+                        f'EXPLAIN (ANALYZE, BUFFERS) {statement}',
+                        *parameters)
+            finally:
+                await connection.close()
+        except Exception:
+            logger.exception('Could not EXPLAIN slow query: %s', statement)
+            return
+
+        plan = '\n'.join(row[0] for row in rows)
+        logger.warning('Plan of slow query (%.3fs): %s\n%s', duration,
+                       statement, plan)
+
+
+slow_query_log = SlowQueryLog(
+    SLOW_QUERY_THRESHOLD, SLOW_QUERY_EXPLAIN, SLOW_QUERY_EXPLAIN_INTERVAL,
+    SLOW_QUERY_EXPLAINS_PER_MINUTE, SLOW_QUERY_EXPLAIN_TIMEOUT)
+
+
+def _before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('slow_query_start_time', []).append(
+        time.perf_counter())
+
+
+def _after_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['slow_query_start_time'].pop()
+    slow_query_log.record(
+        conn.engine.url, statement, parameters, duration, executemany)
+
+
+def _handle_error(context):
+    # a failed statement never reaches after_cursor_execute
+    if context.connection is not None:
+        start_times = context.connection.info.get('slow_query_start_time')
+        if start_times:
+            start_times.pop()
+
+
+def install_slow_query_log(engine: AsyncEngine) -> None:
+    if SLOW_QUERY_THRESHOLD <= 0:
+        return
+    event.listen(
+        engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(
+        engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine.sync_engine, 'handle_error', _handle_error)
@@ -0,0 +1,271 @@
+'''
+Fills the database with synthetic, production-shaped data.
+
+    python -m db.synthetic --seed 42 --users 10000 --recipes 100000
+
+On an empty database (see --truncate) the same seed and counts always
+produce the same rows, password salts aside. Popularity is Zipfian: a
+few users write most recipes and gather most subscribers, a few recipes
+collect most favorites and cart entries, and a few ingredients and tags
+(salt, "dinner") show up everywhere.
+
+Rows are generated lazily and loaded with COPY in batches. The cache
+invalidation triggers are disabled during the load and a single
+invalidate-everything notification is sent instead. Every user's
+password is SYNTHETIC_PASSWORD.
+'''
+import argparse
+import asyncio
+import random
+import sys
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Iterator
+
+import asyncpg
+from passlib.context import CryptContext
+
+from db.bulk import Progress, batched, connect, invalidating_once
+from db.invalidation import ALL
+from db.models import (AmountModel, IngredientModel, RecipeModel, TagModel,
+                       UserModel, favorite, recipe_tag_association,
+                       shopping_cart, subscription)
+
+SYNTHETIC_PASSWORD = 'synthetic-password'
+
+DEFAULT_BATCH_SIZE = 10000
+
+WORDS = (
+    'add', 'bake', 'boil', 'chop', 'dice', 'fold', 'fry', 'grate', 'grill',
+    'knead', 'mash', 'mix', 'peel', 'pour', 'roast', 'simmer', 'slice',
+    'stir', 'whisk', 'season', 'the', 'a', 'with', 'until', 'golden',
+    'tender', 'minutes', 'gently', 'bowl', 'pan', 'oven', 'heat', 'lid',
+    'sauce', 'dough', 'butter', 'garlic', 'onion', 'salt', 'pepper',
+)
+UNITS = ('g', 'kg', 'ml', 'l', 'pcs', 'tbsp', 'tsp', 'cup', 'pinch')
+
+TABLES = {
+    'users': UserModel.__table__,
+    'tags': TagModel.__table__,
+    'ingredients': IngredientModel.__table__,
+    'recipes': RecipeModel.__table__,
+    'amounts': AmountModel.__table__,
+    'recipe_tags': recipe_tag_association,
+    'favorites': favorite,
+    'carts': shopping_cart,
+    'subscriptions': subscription,
+}
+
+# tables with NOTIFY triggers, see the cache invalidation migration
+TRIGGER_TABLES = ('users', 'tags', 'ingredients', 'recipes', 'amounts',
+                  'recipe_tag_association')
+
+
+class Zipf:
+    '''
+    Draws items with probability proportional to 1 / rank ** exponent,
+    ranks being assigned to the items in a seeded random order.
+    '''
+    def __init__(self, rng: random.Random, items: list, exponent: float):
+        self.rng = rng
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cum_weights = list(accumulate(
+            1 / rank ** exponent for rank in range(1, len(self.items) + 1)))
+
+    def draw(self) -> object:
+        point = self.rng.random() * self.cum_weights[-1]
+        return self.items[bisect_left(self.cum_weights, point)]
+
+    def draw_distinct(self, count: int, exclude=None) -> list:
+        count = min(count, len(self.items) - (exclude is not None))
+        drawn = {}
+        while len(drawn) < count:
+            item = self.draw()
+            if item != exclude:
+                drawn[item] = None
+        return list(drawn)
+
+
+class Generator:
+    def __init__(self, args: argparse.Namespace, first_ids: dict[str, int]):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.user_ids = range(first_ids['users'],
+                              first_ids['users'] + args.users)
+        self.tag_ids = range(first_ids['tags'],
+                             first_ids['tags'] + args.tags)
+        self.ingredient_ids = range(
+            first_ids['ingredients'],
+            first_ids['ingredients'] + args.ingredients)
+        self.recipe_ids = range(first_ids['recipes'],
+                                first_ids['recipes'] + args.recipes)
+        self.now = datetime(2024, 1, 1)
+
+    def _count(self, mean: float) -> int:
+        # heavy-tailed per-user activity, most users do little
+        return int(self.rng.expovariate(1 / mean)) if mean > 0 else 0
+
+    def users(self) -> Iterator[tuple]:
+        password = CryptContext(schemes=['bcrypt']).hash(SYNTHETIC_PASSWORD)
+        for user_id in self.user_ids:
+            yield (user_id, f'user{user_id}@example.com', password,
+                   f'user{user_id}', f'First{user_id}', f'Last{user_id}',
+                   False)
+
+    def tags(self) -> Iterator[tuple]:
+        for tag_id in self.tag_ids:
+            yield (tag_id, f'tag {tag_id}', f'tag-{tag_id}',
+                   f'#{tag_id % 0x1000000:06x}')
+
+    def ingredients(self) -> Iterator[tuple]:
+        for ingredient_id in self.ingredient_ids:
+            yield (ingredient_id, f'ingredient {ingredient_id}',
+                   self.rng.choice(UNITS))
+
+    def recipes(self) -> Iterator[tuple]:
+        authors = Zipf(self.rng, self.user_ids, self.args.zipf)
+        for recipe_id in self.recipe_ids:
+            words = int(self.rng.lognormvariate(4.5, 0.6)) + 5
+            text = ' '.join(self.rng.choices(WORDS, k=words)).capitalize()
+            pub_date = self.now - timedelta(
+                seconds=self.rng.randrange(365 * 24 * 3600))
+            yield (recipe_id, f'Recipe {recipe_id}', text, pub_date,
+                   authors.draw(), self.rng.randint(5, 180),
+                   f'media/synthetic/{recipe_id % 100}.png')
+
+    def amounts(self) -> Iterator[tuple]:
+        ingredients = Zipf(self.rng, self.ingredient_ids, self.args.zipf)
+        for recipe_id in self.recipe_ids:
+            count = self.rng.randint(2, self.args.max_ingredients)
+            for ingredient_id in ingredients.draw_distinct(count):
+                yield recipe_id, ingredient_id, self.rng.randint(1, 500)
+
+    def recipe_tags(self) -> Iterator[tuple]:
+        tags = Zipf(self.rng, self.tag_ids, self.args.zipf)
+        for recipe_id in self.recipe_ids:
+            for tag_id in tags.draw_distinct(self.rng.randint(1, 3)):
+                yield recipe_id, tag_id
+
+    def _per_user(self, items: range, mean: float,
+                  exclude_self: bool = False) -> Iterator[tuple]:
+        popular = Zipf(self.rng, items, self.args.zipf)
+        for user_id in self.user_ids:
+            exclude = user_id if exclude_self else None
+            for item in popular.draw_distinct(self._count(mean), exclude):
+                yield user_id, item
+
+    def favorites(self) -> Iterator[tuple]:
+        return self._per_user(self.recipe_ids, self.args.favorites)
+
+    def carts(self) -> Iterator[tuple]:
+        return self._per_user(self.recipe_ids, self.args.carts)
+
+    def subscriptions(self) -> Iterator[tuple]:
+        return self._per_user(
+            self.user_ids, self.args.subscriptions, exclude_self=True)
+
+
+COLUMNS = {
+    'users': ('id', 'email', 'password', 'username', 'first_name',
+              'last_name', 'is_subscribed'),
+    'tags': ('id', 'name', 'slug', 'color'),
+    'ingredients': ('id', 'name', 'measurement_unit'),
+    'recipes': ('id', 'name', 'text', 'pub_date', 'author', 'cooking_time',
+                'image'),
+    'amounts': ('recipe_id', 'ingredient_id', 'amount'),
+    'recipe_tags': ('recipe_id', 'tag_id'),
+    'favorites': ('user_id', 'recipe_id'),
+    'carts': ('user_id', 'recipe_id'),
+    'subscriptions': ('user_id', 'followed_user_id'),
+}
+
+# tables whose ids are reserved from their sequences before generating
+SERIAL_TABLES = ('users', 'tags', 'ingredients', 'recipes')
+
+
+async def reserve_ids(connection: asyncpg.Connection, table: str,
+                      count: int) -> int:
+    '''
+    Advances the table's id sequence by `count` and returns the first id
+    of the reserved block.
+    '''
+    return await connection.fetchval(
+        '''
+        SELECT setval(seq, nextval(seq) + $1 - 1, true) - $1 + 1
+        FROM pg_get_serial_sequence($2, 'id') AS seq
+        ''', max(count, 1), table)
+
+
+async def generate(args: argparse.Namespace) -> dict[str, int]:
+    connection = await connect()
+    loaded = {}
+    try:
+        async with connection.transaction():
+            if args.truncate:
+                await connection.execute(
+                    'TRUNCATE ' + ', '.join(
+                        TABLES[name].name for name in SERIAL_TABLES)
+                    + ' RESTART IDENTITY CASCADE')
+
+            first_ids = {
+                name: await reserve_ids(
+                    connection, TABLES[name].name, getattr(args, name))
+                for name in SERIAL_TABLES
+            }
+            generator = Generator(args, first_ids)
+
+            async with invalidating_once(connection, TRIGGER_TABLES, [ALL]):
+                for name, columns in COLUMNS.items():
+                    table = TABLES[name].name
+                    progress = Progress(f'Loading {table}')
+                    for batch in batched(getattr(generator, name)(),
+                                         args.batch_size):
+                        await connection.copy_records_to_table(
+                            table, records=batch, columns=columns)
+                        progress.advance(len(batch))
+                    progress.finish()
+                    loaded[table] = progress.count
+
+        # fresh statistics, so that EXPLAIN shows the plans we'd get
+        await connection.execute('ANALYZE')
+    finally:
+        await connection.close()
+
+    return loaded
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic users, recipes and activity.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--tags', type=int, default=30)
+    parser.add_argument('--ingredients', type=int, default=2000)
+    parser.add_argument('--recipes', type=int, default=10000)
+    parser.add_argument('--max-ingredients', type=int, default=15)
+    parser.add_argument('--favorites', type=float, default=20,
+                        help='mean favorites per user')
+    parser.add_argument('--carts', type=float, default=3,
+                        help='mean shopping cart entries per user')
+    parser.add_argument('--subscriptions', type=float, default=5,
+                        help='mean subscriptions per user')
+    parser.add_argument('--zipf', type=float, default=1.1,
+                        help='Zipf exponent of every popularity skew')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--truncate', action='store_true',
+                        help='empty the tables first')
+    return parser
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+
+    loaded = asyncio.run(generate(args))
+    for table, count in loaded.items():
+        print(f'{table}: {count} rows', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+import math
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Optional, Union
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+        for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Metric(ABC):
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple = (), registry: 'Registry' = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f'{self.name} expects labels {self.labelnames}, '
+                f'got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> list[tuple[str, tuple, tuple, float]]:
+        '''Returns (sample name, label names, label values, value).'''
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.type_name}']
+        for name, labelnames, labelvalues, value in self.samples():
+            lines.append(
+                f'{name}{_format_labels(labelnames, labelvalues)} '
+                f'{_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        return [(self.name, self.labelnames, key, value)
+                for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    '''
+    Either set explicitly or computed at scrape time by a callback that
+    returns a number (no labels) or a mapping of label values to numbers.
+    '''
+    type_name = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], Union[float, dict]]] = None
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(
+            self, function: Callable[[], Union[float, dict]]) -> None:
+        self._function = function
+
+    def samples(self):
+        values = dict(self._values)
+        if self._function is not None:
+            computed = self._function()
+            if isinstance(computed, dict):
+                values.update(computed)
+            else:
+                values[()] = computed
+        return [(self.name, self.labelnames, key, value)
+                for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, *args, buckets: tuple = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0) + value
+
+    def samples(self):
+        samples = []
+        bucket_labelnames = self.labelnames + ('le',)
+        for key, counts in sorted(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', bucket_labelnames,
+                                key + (_format_value(bound),), cumulative))
+            samples.append(
+                (f'{self.name}_sum', self.labelnames, key, self._sums[key]))
+            samples.append(
+                (f'{self.name}_count', self.labelnames, key, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        return '\n'.join(
+            metric.render() for metric in self._metrics.values()) + '\n'
+
+
+REGISTRY = Registry()
+
+
+CACHE_LOOKUPS = Counter(
+    'cache_lookups_total', 'Cache lookups by cache and result.',
+    ('cache', 'result'))
+
+
+def record_cache_lookups(cache: str, hits: int, misses: int) -> None:
+    if hits:
+        CACHE_LOOKUPS.inc(hits, cache=cache, result='hit')
+    if misses:
+        CACHE_LOOKUPS.inc(misses, cache=cache, result='miss')
+
+
+def _cache_hit_ratios() -> dict:
+    totals: dict[str, list[float]] = {}
+    for _, _, (cache, result), value in CACHE_LOOKUPS.samples():
+        hits_and_total = totals.setdefault(cache, [0, 0])
+        hits_and_total[1] += value
+        if result == 'hit':
+            hits_and_total[0] += value
+    return {(cache,): hits / total
+            for cache, (hits, total) in totals.items() if total}
+
+
+CACHE_HIT_RATIO = Gauge(
+    'cache_hit_ratio', 'Share of cache lookups served from the cache.',
+    ('cache',))
+CACHE_HIT_RATIO.set_function(_cache_hit_ratios)
@@ -0,0 +1,450 @@
+import asyncio
+import re
+import time
+from typing import Optional
+
+import pytest
+from fastapi import HTTPException, status
+
+from api.cache import (MISSING, NOT_FOUND, SHARED_CALLS, Cache,
+                       MemoryCacheBackend, RedisCacheBackend, RedisError,
+                       SingleFlight, _background_tasks, cache)
+
+
+def glob_match(pattern: str, key: str) -> bool:
+    regex = ''
+    chars = iter(pattern)
+    for char in chars:
+        if char == '\\':
+            regex += re.escape(next(chars))
+        elif char == '*':
+            regex += '.*'
+        elif char == '?':
+            regex += '.'
+        else:
+            regex += re.escape(char)
+    return re.fullmatch(regex, key, re.DOTALL) is not None
+
+
+class StandInRedis:
+    '''
+    Speaks as much RESP as RedisCacheBackend uses. SCAN returns at most
+    `scan_page` keys per call, so clients must follow the cursor, and
+    `drop` makes the server hang up on the next command, either before
+    replying or half way through the reply, and `stall` makes it read
+    commands without ever replying.
+    '''
+    def __init__(self, scan_page: int = 2):
+        self.scan_page = scan_page
+        self.data: dict[str, tuple[bytes, float]] = {}
+        self.commands: list[list[str]] = []
+        self.connections = 0
+        self.drop: Optional[str] = None
+        self.stall = False
+        self.port = 0
+        self._server: Optional[asyncio.Server] = None
+        self._handlers: set[asyncio.Task] = set()
+        self._writers: set[asyncio.StreamWriter] = set()
+        # SCAN cursors by the last key they returned, like Redis they
+        # survive keys being deleted between calls
+        self._cursors: list[str] = ['']
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._serve, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        for writer in self._writers:
+            writer.close()
+        await asyncio.gather(*self._handlers)
+        await self._server.wait_closed()
+
+    def url(self, credentials: str = '', db: int = 0) -> str:
+        return f'redis://{credentials}127.0.0.1:{self.port}/{db}'
+
+    def keys(self) -> list[str]:
+        now = time.monotonic()
+        return sorted(key for key, (_, expires_at) in self.data.items()
+                      if expires_at > now)
+
+    async def _serve(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._handlers.add(asyncio.current_task())
+        self._writers.add(writer)
+        try:
+            while (command := await self._read_command(reader)) is not None:
+                self.commands.append([arg.decode() for arg in command])
+                if self.drop == 'before_reply':
+                    self.drop = None
+                    break
+                if self.stall:
+                    continue
+                reply = self._execute(command)
+                if self.drop == 'mid_reply':
+                    self.drop = None
+                    writer.write(reply[:len(reply) // 2])
+                    await writer.drain()
+                    break
+                writer.write(reply)
+                await writer.drain()
+        finally:
+            writer.close()
+            self._writers.discard(writer)
+
+    @staticmethod
+    async def _read_command(
+            reader: asyncio.StreamReader) -> Optional[list[bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    @staticmethod
+    def _bulk(value: Optional[bytes]) -> bytes:
+        if value is None:
+            return b'$-1\r\n'
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def _execute(self, command: list[bytes]) -> bytes:
+        name, args = command[0].decode().upper(), command[1:]
+        if name in ('AUTH', 'SELECT'):
+            return b'+OK\r\n'
+        if name == 'GET':
+            key = args[0].decode()
+            value = self.data.get(key)
+            if value is None or value[1] <= time.monotonic():
+                return self._bulk(None)
+            return self._bulk(value[0])
+        if name == 'SET':
+            key, value, option, milliseconds = args
+            assert option.upper() == b'PX'
+            self.data[key.decode()] = (
+                value, time.monotonic() + int(milliseconds) / 1000)
+            return b'+OK\r\n'
+        if name == 'DEL':
+            deleted = sum(self.data.pop(key.decode(), None) is not None
+                          for key in args)
+            return b':%d\r\n' % deleted
+        if name == 'SCAN':
+            last_key, pattern = self._cursors[int(args[0])], args[2].decode()
+            keys = [key for key in self.keys() if key > last_key]
+            page = keys[:self.scan_page]
+            next_cursor = 0
+            if len(keys) > self.scan_page:
+                next_cursor = len(self._cursors)
+                self._cursors.append(page[-1])
+            matches = [key.encode() for key in page
+                       if glob_match(pattern, key)]
+            return (b'*2\r\n' + self._bulk(str(next_cursor).encode())
+                    + b'*%d\r\n' % len(matches)
+                    + b''.join(self._bulk(key) for key in matches))
+        return b'-ERR unknown command \'%s\'\r\n' % name.encode()
+
+
+@pytest.fixture
+def redis_server(run):
+    server = StandInRedis()
+    run(server.start())
+    yield server
+    run(server.stop())
+
+
+@pytest.fixture
+def redis_backend(redis_server):
+    return RedisCacheBackend(redis_server.url(), 'test:')
+
+
+def test_redis_set_and_get(run, redis_server, redis_backend):
+    run(redis_backend.set('tags:1', {'id': 1, 'name': 'tag'}, 60))
+
+    assert run(redis_backend.get('tags:1')) == {'id': 1, 'name': 'tag'}
+    assert run(redis_backend.get('tags:2')) is MISSING
+    assert redis_server.commands[0] == [
+        'SET', 'test:tags:1', '{"id": 1, "name": "tag"}', 'PX', '60000']
+    # the connection went back to the pool and was reused
+    assert redis_server.connections == 1
+
+
+def test_redis_entries_expire(run, redis_backend):
+    run(redis_backend.set('tags:1', 'value', 0.01))
+    run(asyncio.sleep(0.02))
+
+    assert run(redis_backend.get('tags:1')) is MISSING
+
+
+def test_redis_delete(run, redis_server, redis_backend):
+    for key in ('tags:1', 'tags:2', 'tags:3'):
+        run(redis_backend.set(key, key, 60))
+
+    run(redis_backend.delete(['tags:1', 'tags:3']))
+    run(redis_backend.delete([]))
+
+    assert redis_server.keys() == ['test:tags:2']
+
+
+def test_redis_delete_prefix_follows_scan_cursor(
+        run, redis_server, redis_backend):
+    for key in ('recipes:1', 'recipes:2', 'recipes:list:a', 'recipesx',
+                'tags:1', 'a*b:1', 'aXb:1'):
+        run(redis_backend.set(key, key, 60))
+    redis_server.data['other:recipes:1'] = (b'"foreign"', float('inf'))
+
+    run(redis_backend.delete_prefix('recipes:'))
+    run(redis_backend.delete_prefix('a*b:'))
+
+    assert redis_server.keys() == [
+        'other:recipes:1', 'test:aXb:1', 'test:recipesx', 'test:tags:1']
+    scans = [command for command in redis_server.commands
+             if command[0] == 'SCAN']
+    assert len(scans) > 2
+    assert scans[-1][2:4] == ['MATCH', 'test:a\\*b:*']
+
+
+def test_redis_clear_keeps_other_namespaces(run, redis_server,
+                                            redis_backend):
+    run(redis_backend.set('tags:1', 1, 60))
+    redis_server.data['other:tags:1'] = (b'1', float('inf'))
+
+    run(redis_backend.clear())
+
+    assert redis_server.keys() == ['other:tags:1']
+
+
+def test_redis_auth_and_select(run, redis_server):
+    backend = RedisCacheBackend(
+        redis_server.url(credentials=':p%40ss@', db=3), 'test:')
+
+    run(backend.get('tags:1'))
+
+    assert redis_server.commands[:2] == [['AUTH', 'p@ss'], ['SELECT', '3']]
+
+
+def test_redis_error_reply(run, redis_server, redis_backend):
+    with pytest.raises(RedisError, match='unknown command'):
+        run(redis_backend.execute('FLUSHALL'))
+
+    run(redis_backend.set('tags:1', 1, 60))
+    assert run(redis_backend.get('tags:1')) == 1
+
+
+@pytest.mark.parametrize('drop', ['before_reply', 'mid_reply'])
+def test_redis_connection_dropped_mid_command(
+        run, redis_server, redis_backend, drop):
+    run(redis_backend.set('tags:1', 'x' * 100, 60))
+    redis_server.drop = drop
+
+    with pytest.raises(ConnectionError):
+        run(redis_backend.get('tags:1'))
+
+    # the broken connection is dropped, the next command opens a new one
+    assert run(redis_backend.get('tags:1')) == 'x' * 100
+    assert redis_server.connections == 2
+
+
+@pytest.mark.parametrize('failure', ['before_reply', 'mid_reply', 'stall',
+                                     'stopped'])
+def test_cache_falls_back_to_load_when_backend_fails(
+        run, redis_server, failure):
+    backend = RedisCacheBackend(redis_server.url(), 'test:', timeout=0.05)
+    failing_cache = Cache(backend)
+    run(backend.set('tags:1', 'cached', 60))
+    if failure == 'stopped':
+        run(redis_server.stop())
+    elif failure == 'stall':
+        redis_server.stall = True
+    else:
+        redis_server.drop = failure
+
+    async def load():
+        return 'loaded'
+
+    assert run(failing_cache.get_or_set('tags:1', load)) == 'loaded'
+
+
+def test_cache_skips_writes_when_backend_is_down(run, redis_server):
+    failing_cache = Cache(RedisCacheBackend(redis_server.url(), 'test:'))
+    run(redis_server.stop())
+
+    run(failing_cache.remember_missing('tags:1', 'Tag with ID 1 not found'))
+    run(failing_cache.raise_if_known_missing('tags:1'))
+
+    async def invalidate():
+        failing_cache.invalidate('tags')
+        # the discard task logs the failure instead of raising it
+        await asyncio.gather(*_background_tasks)
+
+    run(invalidate())
+
+
+def test_handler_answers_while_cache_backend_is_down(
+        run, client, redis_server, monkeypatch):
+    monkeypatch.setattr(cache, 'backend', RedisCacheBackend(
+        redis_server.url(), 'test:', timeout=0.05))
+    run(redis_server.stop())
+
+    response = run(client.get('/api/tags'))
+
+    assert response.status_code == 200
+    assert response.json()
+
+
+def test_memory_evicts_least_recently_used(run):
+    backend = MemoryCacheBackend(max_entries=2)
+    run(backend.set('a', 1, 60))
+    run(backend.set('b', 2, 60))
+    run(backend.get('a'))
+
+    run(backend.set('c', 3, 60))
+
+    assert run(backend.get('b')) is MISSING
+    assert run(backend.get('a')) == 1
+    assert run(backend.get('c')) == 3
+
+
+def test_memory_entries_expire(run):
+    backend = MemoryCacheBackend(max_entries=10)
+    run(backend.set('short', 1, 0.01))
+    run(backend.set('long', 2, 60))
+    run(asyncio.sleep(0.02))
+
+    assert run(backend.get('short')) is MISSING
+    assert run(backend.get('long')) == 2
+
+
+def test_memory_delete_prefix(run):
+    backend = MemoryCacheBackend(max_entries=10)
+    for key in ('recipes:1', 'recipes:list:a', 'tags:1'):
+        run(backend.set(key, key, 60))
+
+    run(backend.delete_prefix('recipes:'))
+
+    assert run(backend.get('tags:1')) == 'tags:1'
+    assert run(backend.get('recipes:1')) is MISSING
+
+
+def test_not_found_is_cached(run):
+    cache = Cache(MemoryCacheBackend(max_entries=10), negative_ttl=60)
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail='Tag with ID 1 not found')
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as raised:
+            run(cache.get_or_set('tags:1', load))
+        assert raised.value.status_code == status.HTTP_404_NOT_FOUND
+        assert raised.value.detail == 'Tag with ID 1 not found'
+
+    assert calls == 1
+    assert run(cache.backend.get('tags:1')) == {
+        NOT_FOUND: 'Tag with ID 1 not found'}
+    with pytest.raises(HTTPException):
+        run(cache.raise_if_known_missing('tags:1'))
+
+
+def test_not_found_expires_after_negative_ttl(run):
+    cache = Cache(MemoryCacheBackend(max_entries=10), negative_ttl=0.01)
+    run(cache.remember_missing('tags:1', 'Tag with ID 1 not found'))
+    run(asyncio.sleep(0.02))
+
+    async def load():
+        return {'id': 1}
+
+    assert run(cache.get_or_set('tags:1', load)) == {'id': 1}
+
+
+def test_other_errors_are_not_cached(run):
+    cache = Cache(MemoryCacheBackend(max_entries=10))
+
+    async def load():
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+
+    with pytest.raises(HTTPException):
+        run(cache.get_or_set('tags:1', load))
+
+    assert run(cache.backend.get('tags:1')) is MISSING
+
+
+def test_value_invalidated_while_loading_is_not_cached(run):
+    cache = Cache(MemoryCacheBackend(max_entries=10))
+
+    async def load():
+        cache.invalidate('tags', '1')
+        return {'id': 1}
+
+    assert run(cache.get_or_set('tags:1', load)) == {'id': 1}
+    assert run(cache.backend.get('tags:1')) is MISSING
+
+
+def test_single_flight_coalesces_concurrent_calls(run):
+    flight = SingleFlight('test_coalesce')
+    release = asyncio.Event()
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return object()
+
+    async def main():
+        tasks = [asyncio.create_task(flight.do('key', call))
+                 for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    results = run(main())
+
+    assert calls == 1
+    assert all(result is results[0] for result in results)
+    assert SHARED_CALLS.get(name='test_coalesce') == 4
+
+
+def test_single_flight_shares_errors(run):
+    flight = SingleFlight('test_errors')
+
+    async def call():
+        await asyncio.sleep(0)
+        raise ValueError('failed')
+
+    async def main():
+        return await asyncio.gather(
+            *(flight.do('key', call) for _ in range(3)),
+            return_exceptions=True)
+
+    errors = run(main())
+
+    assert [str(error) for error in errors] == ['failed'] * 3
+
+
+def test_single_flight_survives_cancelled_leader(run):
+    flight = SingleFlight('test_cancel')
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def main():
+        leader = asyncio.create_task(flight.do('key', call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do('key', call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    # the follower runs the call itself instead of failing with the leader
+    assert run(main()) == 2
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from db.catalog_import import import_catalog
+from db.invalidation import CHANNEL
+
+TAGS_CSV = '''name,slug,color
+import-test-1,import-test-1,#fff001
+import-test-2,bad slug!,#fff002
+import-test-3,import-test-3,red
+import-test-4,tag-1,#fff004
+import-test-5,import-test-dup,#fff005
+import-test-6,import-test-dup,#fff006
+,import-test-7,#fff007
+import-test-1,import-test-1,#fff008
+'''
+
+
+@pytest.fixture
+def notifications(run, database):
+    payloads = []
+
+    def listener(connection, pid, channel, payload):
+        payloads.append(payload)
+
+    run(database.add_listener(CHANNEL, listener))
+    yield payloads
+    run(database.remove_listener(CHANNEL, listener))
+
+
+@pytest.fixture
+def cleanup(run, database):
+    yield
+    run(database.execute("DELETE FROM tags WHERE name LIKE 'import-test-%'"))
+
+
+def test_import_skips_bad_tags(run, database, tmp_path, notifications,
+                               cleanup):
+    path = tmp_path / 'tags.csv'
+    path.write_text(TAGS_CSV)
+
+    inserted, updated, rejected = run(
+        import_catalog('tags', str(path), 'csv', batch_size=3))
+    run(asyncio.sleep(0.1))
+
+    assert (inserted, updated) == (1, 0)
+    assert [tuple(row) for row in rejected] == [
+        (2, 'invalid slug'),
+        (3, 'invalid color'),
+        (4, 'slug used by another row'),
+        (5, 'duplicate slug in the file'),
+        (6, 'duplicate slug in the file'),
+        (7, 'missing name'),
+    ]
+    # the last occurrence of a name wins
+    assert run(database.fetchval(
+        "SELECT color FROM tags WHERE name = 'import-test-1'")) == '#fff008'
+    # one notification for the table instead of one per row
+    assert notifications == ['tags:']
@@ -0,0 +1,18 @@
+import gzip
+
+from api import compression
+from api.cache import Cache, MemoryCacheBackend
+
+
+def test_compressed_body_is_shared_through_cache(run, monkeypatch):
+    shared_cache = Cache(MemoryCacheBackend(max_entries=10))
+    monkeypatch.setattr(compression, 'cache', shared_cache)
+    body = b'{"id": 1}' * 100
+
+    compressed = run(compression.compress('gzip', body, 'W/"etag"'))
+
+    assert gzip.decompress(compressed) == body
+    # another worker finds the variant instead of compressing again
+    monkeypatch.setitem(compression.CODECS, 'gzip', (None, None))
+    assert run(compression.compress('gzip', body, 'W/"etag"')) == compressed
+    assert run(shared_cache.backend.get('compressed:gzip:W/"etag"'))
@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from api import profiling
+from api.profiling import is_signed, sign_request
+
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_SECRET', 'secret')
+    monkeypatch.setattr(profiling, '_used_nonces', {})
+
+
+def test_signature_is_accepted_once():
+    expires = int(time.time()) + 60
+    signature = sign_request('get', '/api/recipes', expires, 'a1')
+
+    assert is_signed('GET', '/api/recipes', signature)
+    assert not is_signed('GET', '/api/recipes', signature)
+    assert is_signed('GET', '/api/recipes',
+                     sign_request('GET', '/api/recipes', expires, 'b2'))
+
+
+def test_signature_is_bound_to_its_request_and_expiry():
+    expires = int(time.time()) + 60
+    signature = sign_request('GET', '/api/recipes', expires, 'a1')
+    tampered_nonce = signature.replace('.a1.', '.b2.')
+
+    assert not is_signed('GET', '/api/tags', signature)
+    assert not is_signed('GET', '/api/recipes', tampered_nonce)
+    assert not is_signed('GET', '/api/recipes', sign_request(
+        'GET', '/api/recipes', int(time.time()) - 1, 'c3'))
+    assert not is_signed('GET', '/api/recipes', 'not a signature')
+
+
+def test_expired_nonces_are_forgotten(monkeypatch):
+    expires = int(time.time()) + 60
+    is_signed('GET', '/api/recipes',
+              sign_request('GET', '/api/recipes', expires, 'a1'))
+
+    monkeypatch.setattr(time, 'time', lambda: expires + 1)
+    is_signed('GET', '/api/recipes',
+              sign_request('GET', '/api/recipes', expires + 60, 'b2'))
+
+    assert profiling._used_nonces == {'b2': expires + 60}
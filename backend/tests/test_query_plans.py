@@ -0,0 +1,248 @@
+'''
+Checks the plans PostgreSQL picks for the queries in api.dals, against
+the database in POSTGRES_URL filled by db.synthetic:
+
+    python -m db.synthetic --seed 42 --truncate
+    python -m pytest tests/test_query_plans.py
+
+Each case runs a DAL function against a session that stops it at its
+first query, renders the statement with the case's parameters inlined and
+runs EXPLAIN (FORMAT JSON) on it, without executing it. A plan fails when
+it reads one of the case's large tables with a sequential scan, does not
+use one of the indexes the case expects, or has an estimated total cost
+over the case's ceiling. Costs grow with the data, so the ceilings assume
+the db.synthetic default sizes.
+'''
+import itertools
+import json
+from typing import Awaitable, Callable, Iterator, Optional
+
+import pytest
+
+from api.dals import (_recipes_list_validators_query, _recipes_query,
+                      bulk_add_recipes, bulk_remove_recipes, get_amount,
+                      get_recipe_or_404, get_recipe_validators,
+                      get_recipes_by_user_id, get_recipes_from_db,
+                      get_recipes_list_validators, get_shopping_cart,
+                      get_single_recipe_from_db, get_user_by_email_for_auth,
+                      get_user_or_404, get_user_subscriptions, get_users_page,
+                      is_recipe_in_favorite, is_recipe_in_shopping_cart,
+                      is_subscribed, recipe_tag_association_exists,
+                      stream_ingredients, stream_recipes_from_db,
+                      stream_users)
+from api.utils import BoolOptions
+from db.models import favorite, shopping_cart
+from db.query_capture import (DIALECT, CapturingSession, capture_query,
+                              render_statement)
+
+# a popular user and recipe of the synthetic data, and a few of its tags
+USER_ID = 1
+USER_EMAIL = 'user1@example.com'
+AUTHOR_ID = 2
+RECIPE_ID = 1
+RECIPE_IDS = [1, 2, 3]
+INGREDIENT_ID = 1
+TAG_ID = 1
+TAGS = ['tag-1', 'tag-2']
+
+
+class PlanCase:
+    def __init__(self, call: Callable[[CapturingSession], Awaitable],
+                 no_seq_scan: tuple[str, ...] = (),
+                 indexes: tuple[str, ...] = (),
+                 max_cost: Optional[float] = None):
+        self.call = call
+        self.no_seq_scan = no_seq_scan
+        self.indexes = indexes
+        self.max_cost = max_cost
+
+
+CASES: dict[str, PlanCase] = {
+    # lists every recipe, the scan of recipes is expected
+    'get_recipes_from_db': PlanCase(
+        lambda session: get_recipes_from_db(
+            session, None, USER_ID, None, None, None, None),
+        no_seq_scan=('favorite', 'shopping_cart'),
+        indexes=('unique_favorite', 'unique_shopping_cart')),
+    'get_recipes_from_db_by_author': PlanCase(
+        lambda session: get_recipes_from_db(
+            session, None, USER_ID, AUTHOR_ID, None, None, None),
+        no_seq_scan=('recipes', 'favorite', 'shopping_cart'),
+        indexes=('recipes_author_pub_date_index',),
+        max_cost=2000),
+    'get_recipes_from_db_filtered': PlanCase(
+        lambda session: get_recipes_from_db(
+            session, None, USER_ID, None, TAGS, BoolOptions.true,
+            BoolOptions.false),
+        no_seq_scan=('recipes', 'favorite', 'shopping_cart',
+                     'recipe_tag_association'),
+        indexes=('unique_favorite',),
+        max_cost=5000),
+    'get_single_recipe_from_db': PlanCase(
+        lambda session: get_single_recipe_from_db(
+            RECIPE_ID, session, None, USER_ID),
+        no_seq_scan=('recipes', 'favorite', 'shopping_cart'),
+        indexes=('recipes_pkey',),
+        max_cost=100),
+    'get_recipe_validators': PlanCase(
+        lambda session: get_recipe_validators(session, RECIPE_ID, USER_ID),
+        no_seq_scan=('recipes', 'users', 'favorite', 'shopping_cart',
+                     'recipe_tag_association', 'amounts'),
+        indexes=('recipes_pkey', 'users_pkey'),
+        max_cost=500),
+    'get_recipes_list_validators_by_author': PlanCase(
+        lambda session: get_recipes_list_validators(
+            session, USER_ID, AUTHOR_ID, None, None, None),
+        no_seq_scan=('recipes', 'users'),
+        indexes=('recipes_author_pub_date_index',),
+        max_cost=2000),
+    'get_recipes_by_user_id': PlanCase(
+        lambda session: get_recipes_by_user_id(AUTHOR_ID, session, 6),
+        no_seq_scan=('recipes',),
+        indexes=('recipes_author_pub_date_index',),
+        max_cost=500),
+    'get_user_subscriptions': PlanCase(
+        lambda session: get_user_subscriptions(USER_ID, session, 6),
+        no_seq_scan=('users', 'subscriptions', 'recipes'),
+        indexes=('unique_subscription', 'recipes_author_pub_date_index'),
+        max_cost=5000),
+    'get_users_page': PlanCase(
+        lambda session: get_users_page(session, 100, 10),
+        no_seq_scan=('users',),
+        indexes=('users_pkey',),
+        max_cost=500),
+    'get_shopping_cart': PlanCase(
+        lambda session: get_shopping_cart(session, None, USER_ID),
+        no_seq_scan=('shopping_cart', 'amounts'),
+        indexes=('unique_shopping_cart', 'amounts_pkey'),
+        max_cost=2000),
+    'is_recipe_in_favorite': PlanCase(
+        lambda session: is_recipe_in_favorite(session, USER_ID, RECIPE_ID),
+        no_seq_scan=('favorite',),
+        indexes=('unique_favorite',),
+        max_cost=50),
+    'is_recipe_in_shopping_cart': PlanCase(
+        lambda session: is_recipe_in_shopping_cart(
+            session, USER_ID, RECIPE_ID),
+        no_seq_scan=('shopping_cart',),
+        indexes=('unique_shopping_cart',),
+        max_cost=50),
+    'is_subscribed': PlanCase(
+        lambda session: is_subscribed(session, USER_ID, AUTHOR_ID),
+        no_seq_scan=('subscriptions',),
+        indexes=('unique_subscription',),
+        max_cost=50),
+    'recipe_tag_association_exists': PlanCase(
+        lambda session: recipe_tag_association_exists(
+            session, TAG_ID, RECIPE_ID),
+        no_seq_scan=('recipe_tag_association',),
+        indexes=('unique_recipe_tag',),
+        max_cost=50),
+    'get_amount': PlanCase(
+        lambda session: get_amount(session, RECIPE_ID, INGREDIENT_ID),
+        no_seq_scan=('amounts',),
+        indexes=('amounts_pkey',),
+        max_cost=50),
+    'get_recipe_or_404': PlanCase(
+        lambda session: get_recipe_or_404(RECIPE_ID, session),
+        no_seq_scan=('recipes',),
+        indexes=('recipes_pkey',),
+        max_cost=50),
+    'get_user_or_404': PlanCase(
+        lambda session: get_user_or_404(USER_ID, session),
+        no_seq_scan=('users',),
+        indexes=('users_pkey',),
+        max_cost=50),
+    # runs on every log in
+    'get_user_by_email_for_auth': PlanCase(
+        lambda session: get_user_by_email_for_auth(USER_EMAIL, session),
+        no_seq_scan=('users',),
+        indexes=('users_email_index',),
+        max_cost=50),
+    # the conflict check on unique_favorite is not a plan node
+    'bulk_add_recipes': PlanCase(
+        lambda session: bulk_add_recipes(
+            session, favorite, USER_ID, RECIPE_IDS),
+        no_seq_scan=('recipes', 'favorite'),
+        indexes=('recipes_pkey',),
+        max_cost=500),
+    'bulk_remove_recipes': PlanCase(
+        lambda session: bulk_remove_recipes(
+            session, shopping_cart, USER_ID, RECIPE_IDS),
+        no_seq_scan=('recipes', 'shopping_cart'),
+        indexes=('recipes_pkey', 'unique_shopping_cart'),
+        max_cost=500),
+    # streaming functions are async generators, anext() runs them to
+    # their query
+    'stream_users': PlanCase(
+        lambda session: anext(stream_users(session, 100, 'user1')),
+        no_seq_scan=('users',),
+        indexes=('username_prefix_index',),
+        max_cost=500),
+    'stream_ingredients': PlanCase(
+        lambda session: anext(stream_ingredients(session, 'salt')),
+        max_cost=500),
+    'stream_recipes_from_db_by_author': PlanCase(
+        lambda session: anext(stream_recipes_from_db(
+            session, None, USER_ID, AUTHOR_ID, None, None, None)),
+        no_seq_scan=('recipes', 'favorite', 'shopping_cart'),
+        indexes=('recipes_author_pub_date_index',),
+        max_cost=2000),
+}
+
+
+def render(call: Callable[[CapturingSession], Awaitable]) -> str:
+    return render_statement(capture_query(call))
+
+
+def walk(node: dict) -> Iterator[dict]:
+    yield node
+    for child in node.get('Plans', ()):
+        yield from walk(child)
+
+
+def check(case: PlanCase, plan: dict) -> list[str]:
+    nodes = list(walk(plan))
+    problems = []
+
+    seq_scans = {node['Relation Name'] for node in nodes
+                 if node['Node Type'] == 'Seq Scan'}
+    for table in case.no_seq_scan:
+        if table in seq_scans:
+            problems.append(f'sequential scan of {table}')
+
+    indexes = {node['Index Name'] for node in nodes if 'Index Name' in node}
+    for index in case.indexes:
+        if index not in indexes:
+            problems.append(f'{index} not used')
+
+    cost = plan['Total Cost']
+    if case.max_cost is not None and cost > case.max_cost:
+        problems.append(f'cost {cost:.0f} over {case.max_cost:.0f}')
+
+    return problems
+
+
+@pytest.mark.parametrize('name', CASES)
+def test_statement_compiles(name):
+    assert render(CASES[name].call)
+
+
+@pytest.mark.parametrize('filters', itertools.product((False, True), repeat=4))
+@pytest.mark.parametrize('fields', [None, ('id',), ('id', 'is_favorited')])
+def test_recipes_queries_compile(filters, fields):
+    _recipes_query(*filters, fields).compile(dialect=DIALECT)
+    _recipes_list_validators_query(*filters).compile(dialect=DIALECT)
+
+
+@pytest.mark.parametrize('name', CASES)
+def test_query_plan(run, database, name):
+    case = CASES[name]
+    statement = render(case.call)
+    result = run(database.fetchval(f'EXPLAIN (FORMAT JSON) {statement}'))
+    plan = json.loads(result)[0]['Plan']
+
+    problems = check(case, plan)
+
+    assert not problems, '\n'.join(
+        [*problems, statement, json.dumps(plan, indent=2)])
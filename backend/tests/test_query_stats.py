@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from db.query_stats import (QueryBudgetExceeded, assert_query_budget,
+                            statement_shape)
+from db.session import engine
+
+# validators, recipes, then authors, tags and ingredients in batches
+RECIPES_LIST_BUDGET = 6
+
+
+@pytest.fixture(scope='module')
+def author_id(run, database):
+    return run(database.fetchval(
+        'SELECT author FROM recipes GROUP BY author '
+        'ORDER BY count(*) DESC LIMIT 1'))
+
+
+def test_statement_shape_collapses_in_lists():
+    assert (statement_shape('SELECT * FROM t WHERE id IN ($1, $2, $3)')
+            == statement_shape('SELECT * FROM t WHERE id IN ($1)')
+            == 'SELECT * FROM t WHERE id IN (?)')
+
+
+def test_recipes_list_within_budget(run, client, author_id):
+    with assert_query_budget(RECIPES_LIST_BUDGET) as stats:
+        response = run(client.get(
+            '/api/recipes', params={'author': author_id}))
+
+    assert response.status_code == 200
+    assert response.json()
+    assert not stats.duplicates
+
+
+def test_exceeding_budget_raises(run, client, author_id):
+    with pytest.raises(QueryBudgetExceeded, match='budget is 1'):
+        with assert_query_budget(1):
+            run(client.get('/api/recipes', params={'author': author_id}))
+
+
+def test_failed_statement_is_not_left_timed(run, database):
+    async def execute_failing() -> dict:
+        async with engine.connect() as connection:
+            with pytest.raises(DBAPIError):
+                await connection.execute(text('SELECT 1 / 0'))
+            return connection.sync_connection.info
+
+    info = run(execute_failing())
+
+    assert info['query_start_time'] == []
+    assert info['slow_query_start_time'] == []
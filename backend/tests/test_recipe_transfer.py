@@ -0,0 +1,63 @@
+import base64
+import json
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from db import recipe_transfer
+from db.recipe_transfer import import_recipes
+
+
+@pytest.fixture
+def recipes_file(run, database, tmp_path):
+    image = BytesIO()
+    Image.new('RGB', (2, 2)).save(image, 'PNG')
+    row = run(database.fetchrow(
+        '''
+        SELECT (SELECT username FROM users ORDER BY id LIMIT 1) AS author,
+               (SELECT name FROM ingredients ORDER BY id LIMIT 1)
+                   AS ingredient,
+               (SELECT name FROM tags ORDER BY id LIMIT 1) AS tag
+        '''))
+    recipe = {
+        'name': 'transfer-test', 'text': 'text', 'cooking_time': 5,
+        'image': 'recipes/images/transfer.png',
+        'pub_date': '2026-01-01T12:00:00',
+        'author': row['author'],
+        'ingredients': [{'name': row['ingredient'], 'amount': 1}],
+        'tags': [row['tag']],
+        'image_data': base64.b64encode(image.getvalue()).decode(),
+    }
+    path = tmp_path / 'recipes.ndjson'
+    path.write_text(json.dumps(recipe) + '\n')
+    yield str(path)
+    run(database.execute("DELETE FROM recipes WHERE name = 'transfer-test'"))
+
+
+def test_imported_recipes_get_their_own_images(run, database, tmp_path,
+                                               recipes_file):
+    media_root = tmp_path / 'media'
+    for _ in range(2):
+        imported, _ = run(import_recipes(
+            recipes_file, 10, str(media_root), None, 1))
+        assert imported == 1
+
+    images = [row['image'] for row in run(database.fetch(
+        "SELECT image FROM recipes WHERE name = 'transfer-test'"))]
+    assert len(set(images)) == 2
+    assert all((media_root / image).is_file() for image in images)
+
+
+def test_failed_chunk_removes_its_images(run, tmp_path, recipes_file,
+                                         monkeypatch):
+    async def fail(self, recipes):
+        raise RuntimeError('write failed')
+
+    monkeypatch.setattr(recipe_transfer.RecipeImporter, '_write_chunk', fail)
+    media_root = tmp_path / 'media'
+
+    with pytest.raises(RuntimeError):
+        run(import_recipes(recipes_file, 10, str(media_root), None, 1))
+
+    assert not [path for path in media_root.rglob('*') if path.is_file()]
@@ -0,0 +1,111 @@
+import json
+from datetime import datetime, timezone
+from email.utils import format_datetime
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def user(run, database):
+    # a synthetic user with recipes both in favorites and in the cart
+    return run(database.fetchrow(
+        '''
+        SELECT u.id, u.email FROM users u
+        WHERE u.email LIKE 'user%@example.com'
+          AND EXISTS (SELECT 1 FROM favorite f WHERE f.user_id = u.id)
+          AND EXISTS (SELECT 1 FROM shopping_cart s WHERE s.user_id = u.id)
+        ORDER BY u.id LIMIT 1
+        '''))
+
+
+@pytest.fixture(scope='module')
+def headers(log_in, user):
+    return log_in(user['email'])
+
+
+@pytest.mark.parametrize('flag, table', [
+    ('is_favorited', 'favorite'),
+    ('is_in_shopping_cart', 'shopping_cart'),
+])
+@pytest.mark.parametrize('stream', [None, 'ndjson', 'json'])
+def test_recipes_list_filtered_by_flag(run, client, database, user, headers,
+                                       flag, table, stream):
+    params = {flag: '1'}
+    if stream is not None:
+        params['stream'] = stream
+
+    response = run(client.get('/api/recipes', params=params,
+                              headers=headers))
+
+    assert response.status_code == 200
+    if stream == 'ndjson':
+        recipes = [json.loads(line) for line in response.text.splitlines()]
+    else:
+        recipes = response.json()
+    expected_ids = {row['recipe_id'] for row in run(database.fetch(
+        f'SELECT recipe_id FROM {table} WHERE user_id = $1', user['id']))}
+    assert {recipe['id'] for recipe in recipes} == expected_ids
+    assert all(recipe[flag] for recipe in recipes)
+
+
+def test_deleting_recipe_changes_list_validators(run, client, database, user,
+                                                 headers):
+    recipe_id = run(database.fetchval(
+        '''
+        WITH recipe AS (
+            INSERT INTO recipes
+                (name, text, pub_date, author, cooking_time, image)
+            VALUES ('Short lived', 'text', timezone('utc', now()), $1, 1,
+                    'recipes/images/short_lived.jpg')
+            RETURNING id
+        ), tag AS (
+            INSERT INTO recipe_tag_association (recipe_id, tag_id)
+            SELECT recipe.id, (SELECT min(id) FROM tags) FROM recipe
+        )
+        SELECT id FROM recipe
+        ''', user['id']))
+    params = {'author': user['id']}
+    etag = run(client.get('/api/recipes', params=params)).headers['ETag']
+
+    response = run(client.delete(f'/api/recipes/{recipe_id}',
+                                 headers=headers))
+    assert response.status_code == 204
+
+    modified_since = format_datetime(datetime.now(timezone.utc), usegmt=True)
+    for conditional in ({'If-None-Match': etag},
+                        {'If-Modified-Since': modified_since}):
+        response = run(client.get('/api/recipes', params=params,
+                                  headers=conditional))
+        assert response.status_code == 200
+        assert recipe_id not in {recipe['id'] for recipe in response.json()}
+
+
+@pytest.mark.parametrize('path, table', [
+    ('favorite', 'favorite'),
+    ('shopping_cart', 'shopping_cart'),
+])
+def test_bulk_add_and_delete(run, client, database, user, headers,
+                             path, table):
+    recipe_ids = [row['id'] for row in run(database.fetch(
+        f'''
+        SELECT id FROM recipes WHERE id NOT IN (
+            SELECT recipe_id FROM {table} WHERE user_id = $1)
+        ORDER BY id LIMIT 2
+        ''', user['id']))]
+    # ids repeat and include a missing recipe
+    body = {'ids': [*recipe_ids, recipe_ids[0], 0]}
+
+    def statuses(action: str) -> list[str]:
+        response = run(client.post(f'/api/recipes/{path}/{action}',
+                                   json=body, headers=headers))
+        assert response.status_code == 200
+        return [result['status'] for result in response.json()]
+
+    assert statuses('bulk') == ['added', 'added', 'not_found']
+    assert statuses('bulk') == ['unchanged', 'unchanged', 'not_found']
+    assert statuses('bulk/delete') == ['removed', 'removed', 'not_found']
+    assert statuses('bulk/delete') == ['unchanged', 'unchanged', 'not_found']
+    assert not run(database.fetchval(
+        f'SELECT count(*) FROM {table} '
+        'WHERE user_id = $1 AND recipe_id = any($2)',
+        user['id'], recipe_ids))
@@ -0,0 +1,39 @@
+import pytest
+
+from db.query_stats import assert_query_budget
+
+
+@pytest.fixture(scope='module')
+def follower(run, database):
+    # a synthetic user following an author with more recipes than the limit
+    return run(database.fetchrow(
+        '''
+        SELECT u.id, u.email FROM users u
+        JOIN subscriptions s ON s.user_id = u.id
+        WHERE u.email LIKE 'user%@example.com'
+          AND (SELECT count(*) FROM recipes r
+               WHERE r.author = s.followed_user_id) > 3
+        ORDER BY u.id LIMIT 1
+        '''))
+
+
+def test_subscriptions_load_latest_recipes_only(run, client, database,
+                                                log_in, follower):
+    headers = log_in(follower['email'])
+
+    # the followed users, then their latest recipes in one windowed query
+    with assert_query_budget(2):
+        response = run(client.get('/api/users/subscriptions',
+                                  params={'recipes_limit': 2},
+                                  headers=headers))
+
+    assert response.status_code == 200
+    authors = response.json()
+    assert authors
+    for author in authors:
+        latest_ids = [row['id'] for row in run(database.fetch(
+            'SELECT id FROM recipes WHERE author = $1 '
+            'ORDER BY pub_date DESC LIMIT 2', author['id']))]
+        assert [recipe['id'] for recipe in author['recipes']] == latest_ids
+        assert author['recipes_count'] == run(database.fetchval(
+            'SELECT count(*) FROM recipes WHERE author = $1', author['id']))
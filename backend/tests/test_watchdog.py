@@ -0,0 +1,36 @@
+import asyncio
+import threading
+
+from api.middleware import task_routes
+from api.watchdog import find_route
+
+
+def test_find_route_from_another_thread(run, loop):
+    def read_route() -> list[str]:
+        # the loop is blocked while the thread reads, as in the watchdog
+        routes = []
+        thread = threading.Thread(
+            target=lambda: routes.append(find_route(loop)))
+        thread.start()
+        thread.join()
+        return routes
+
+    async def request():
+        task_routes[asyncio.current_task()] = 'GET /api/tags'
+        try:
+            return read_route()
+        finally:
+            del task_routes[asyncio.current_task()]
+
+    async def background():
+        return read_route()
+
+    assert run(request()) == ['GET /api/tags']
+    assert run(background()) == ['background']
+
+
+def test_route_is_forgotten_after_request(run, client):
+    response = run(client.get('/api/tags'))
+
+    assert response.status_code == 200
+    assert not task_routes
@@ -0,0 +1,28 @@
+import asyncio
+import threading
+
+from api.workers import WorkerPool
+
+
+def test_cancelled_queued_call_leaves_the_queue(run):
+    pool = WorkerPool('test_cancel', 1)
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+        return 'done'
+
+    async def main():
+        running = asyncio.create_task(pool.run(block))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        queued = asyncio.create_task(pool.run(block))
+        await asyncio.sleep(0)
+        assert (pool.queued, pool.running) == (1, 1)
+
+        queued.cancel()
+        release.set()
+        return await running
+
+    assert run(main()) == 'done'
+    assert (pool.queued, pool.running) == (0, 0)